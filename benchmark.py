@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas
+
+from data_cleanup import eva_dupont_ferrier, louis_gaudreau, michel_pioro_ladriere
+from gridded_diagram import GriddedDiagram
+from instrumentation import StageTimer
+from loaders import load_interpolated_csv, load_raw_csv, load_raw_npz, save_interpolated, save_raw
+from process_annotations import vertices_to_volt
+from raw_to_images import filter_interpolated, image_interpolation, save_images
+from spatial_index import RawPointsIndex
+
+# The voltage step between 2 measured points of the synthetic diagrams (V)
+SWEEP_STEP = 0.0005
+# Stages faster than this are not flagged as regressions, because the measure is mostly noise (s)
+MIN_REGRESSION_TIME = 0.005
+
+
+def synthetic_values(x: np.ndarray, y: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Generate a current map that looks like a stability diagram: periodic transition lines with noise.
+
+    :param x: The x coordinates of the points (V).
+    :param y: The y coordinates of the points (V).
+    :param rng: The random generator.
+    :return: The current at each point (A).
+    """
+    # Slanted lines, like the transitions of a double dot
+    lines = np.sin((x + 0.3 * y) * 400) ** 8 + 0.5 * np.sin((y - 0.2 * x) * 250) ** 8
+    return 1e-9 * (lines + rng.normal(0, 0.05, np.shape(x)))
+
+
+def regular_sweep(size: int, rng: np.random.Generator) -> pandas.DataFrame:
+    """
+    Generate a diagram measured as a rectilinear sweep (same x values for every y value).
+
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    :return: The diagram as a pandas dataframe, with columns x, y, z.
+    """
+    x, y = np.meshgrid(-0.5 + np.arange(size) * SWEEP_STEP, -0.7 + np.arange(size) * SWEEP_STEP)
+    x, y = x.ravel(), y.ravel()
+    return pandas.DataFrame({'x': x, 'y': y, 'z': synthetic_values(x, y, rng)})
+
+
+def gridded_sweep(size: int, rng: np.random.Generator) -> GriddedDiagram:
+    """
+    Generate a diagram measured as a rectilinear sweep, as a gridded diagram (the same points as regular_sweep).
+
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    :return: The gridded diagram.
+    """
+    x_axis, y_axis = -0.5 + np.arange(size) * SWEEP_STEP, -0.7 + np.arange(size) * SWEEP_STEP
+    x, y = np.meshgrid(x_axis, y_axis)
+    return GriddedDiagram.from_axes(x_axis, y_axis, synthetic_values(x, y, rng))
+
+
+def scattered_points(size: int, rng: np.random.Generator, jitter: float = 0.3) -> pandas.DataFrame:
+    """
+    Generate a diagram with irregular points: a sweep grid with random offsets, in random order.
+
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    :param jitter: The maximal offset of each point, relative to the sweep step.
+    :return: The diagram as a pandas dataframe, with columns x, y, z.
+    """
+    diagram = regular_sweep(size, rng).sample(frac=1, random_state=0, ignore_index=True)
+    offsets = rng.uniform(-jitter * SWEEP_STEP, jitter * SWEEP_STEP, (len(diagram), 2))
+    x, y = diagram.x.to_numpy() + offsets[:, 0], diagram.y.to_numpy() + offsets[:, 1]
+    return pandas.DataFrame({'x': x, 'y': y, 'z': synthetic_values(x, y, rng)})
+
+
+def write_michel_dat(file_path: Path, size: int, rng: np.random.Generator, channels: int = 2) -> None:
+    """
+    Write a synthetic diagram with the format of the michel_pioro_ladriere files (Nanonis .dat with header).
+    Each row is a point of the sweep axis, with the values of every channel for every step.
+
+    :param file_path: The path of the file to write.
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    :param channels: The number of acquired channels.
+    """
+    start_x, start_y = -0.5, -0.7
+    stop_x, stop_y = start_x + (size - 1) * SWEEP_STEP, start_y + (size - 1) * SWEEP_STEP
+    header = [
+        'Experiment\tStability diagram',
+        'Sweep channel: Name\tG1',
+        f'Sweep channel: Start\t{start_x}',
+        f'Sweep channel: Stop\t{stop_x}',
+        f'Sweep channel: Points\t{size}',
+        'Step channel 1: Name\tG2',
+        f'Step channel 1: Start\t{start_y}',
+        f'Step channel 1: Stop\t{stop_y}',
+        f'Step channel 1: Points\t{size}',
+        'Acquire channels\t' + ';'.join(f'Current {channel} (A)' for channel in range(channels)),
+        '',
+        '[DATA]',
+        '\t'.join(['G1 (V)'] + [f'Current {channel} [{step}] (A)' for step in range(size)
+                                for channel in range(channels)]),
+    ]
+
+    x = np.linspace(start_x, stop_x, size)
+    y = np.linspace(start_y, stop_y, size)
+    values = synthetic_values(x[:, np.newaxis], y[np.newaxis, :], rng)
+    # Columns: x, then the channels of each step
+    data = np.column_stack([x] + [values[:, step] * (channel + 1) for step in range(size)
+                                  for channel in range(channels)])
+
+    with open(file_path, 'w') as file:
+        file.write('\n'.join(header) + '\n')
+        np.savetxt(file, data, delimiter='\t', fmt='%.6e')
+
+
+def write_louis_grey(file_path: Path, size: int, rng: np.random.Generator) -> None:
+    """
+    Write a synthetic diagram with the format of the louis_gaudreau files (CSV with several gates, current in pA and a
+    footer line).
+
+    :param file_path: The path of the file to write.
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    """
+    diagram = regular_sweep(size, rng)
+    index = np.arange(len(diagram))
+    data = np.column_stack((index, diagram.y, np.zeros(len(diagram)), diagram.x, np.zeros(len(diagram)),
+                            diagram.z * 1e12))
+    with open(file_path, 'w') as file:
+        np.savetxt(file, data, delimiter=',', fmt='%.8g')
+        file.write('end\n')
+
+
+def write_eva_dat(file_path: Path, size: int, rng: np.random.Generator) -> None:
+    """
+    Write a synthetic diagram with the format of the eva_dupont_ferrier files (columns separated by spaces, with the
+    gates and the current interleaved with other measurements).
+
+    :param file_path: The path of the file to write.
+    :param size: The number of points on each axis.
+    :param rng: The random generator.
+    """
+    diagram = regular_sweep(size, rng)
+    zeros = np.zeros(len(diagram))
+    np.savetxt(file_path, np.column_stack((diagram.x, zeros, diagram.y, zeros, diagram.z)), fmt='%.8g')
+
+
+def measure(timer: StageTimer, case: str, stage: str, function: Callable, repeat: int, **counts):
+    """
+    Run a function several times, and record each run as a stage.
+
+    :param timer: The timer that records the runs.
+    :param case: The name of the benchmark case (e.g. 'regular/300/1.0mV').
+    :param stage: The name of the stage (e.g. 'interpolate').
+    :param function: The function to measure, without argument.
+    :param repeat: The number of runs.
+    :param counts: Some counts to add to the records (e.g. raw_points=10_000).
+    :return: The result of the last run.
+    """
+    result = None
+    for _ in range(repeat):
+        with timer.stage(case, stage, **counts):
+            result = function()
+    return result
+
+
+def run_benchmarks(sizes: List[int], pixel_sizes: List[float], methods: List[str], repeat: int,
+                   work_dir: Path) -> StageTimer:
+    """
+    Generate the synthetic diagrams and measure every stage of the processing.
+
+    :param sizes: The number of points on each axis of the diagrams.
+    :param pixel_sizes: The output grid resolutions (V).
+    :param methods: The interpolation methods.
+    :param repeat: The number of runs of each stage.
+    :param work_dir: The directory where to write the temporary files.
+    :return: The timer with the records of every run.
+    """
+    timer = StageTimer()
+    rng = np.random.default_rng(0)
+
+    for size in sizes:
+        print(f'Size {size}x{size}')
+
+        # Raw file parsers of each research group
+        dat_file, grey_file, eva_file = work_dir / 'michel.dat', work_dir / 'louis.grey', work_dir / 'eva.dat'
+        write_michel_dat(dat_file, size, rng)
+        write_louis_grey(grey_file, size, rng)
+        write_eva_dat(eva_file, size, rng)
+        for name, parser, file_path in (('michel_pioro_ladriere', michel_pioro_ladriere.load_raw_points, dat_file),
+                                        ('louis_gaudreau', louis_gaudreau.load_raw_points, grey_file),
+                                        ('eva_dupont_ferrier', eva_dupont_ferrier.load_raw_points, eva_file)):
+            def parse():
+                with open(file_path, 'rb') as file:
+                    return parser(file)
+
+            measure(timer, f'parser/{size}', name, parse, repeat, raw_points=size * size)
+
+        for kind, generator in (('regular', regular_sweep), ('gridded', gridded_sweep),
+                                ('scattered', scattered_points)):
+            diagram = generator(size, rng)
+            raw_points = size * size
+            for raw_format, load_function in (('csv', load_raw_csv), ('npz', load_raw_npz)):
+                raw_file = work_dir / f'{kind}.{raw_format}'
+                measure(timer, f'{kind}/{size}', f'save_raw_{raw_format}', lambda: save_raw(raw_file, diagram), repeat,
+                        raw_points=raw_points)
+                measure(timer, f'{kind}/{size}', f'load_raw_{raw_format}', lambda: load_function(raw_file), repeat,
+                        raw_points=raw_points)
+
+            raw_index = measure(timer, f'{kind}/{size}', 'raw_index', lambda: RawPointsIndex.build(diagram), repeat,
+                                raw_points=raw_points)
+            x_min, x_max, y_min, y_max = raw_index.bounds
+            x_center, y_center = (x_min + x_max) / 2, (y_min + y_max) / 2
+
+            for method in methods:
+                for pixel_size in pixel_sizes:
+                    case = f'{kind}/{size}/{method}/{pixel_size * 1000}mV'
+                    # A window of 1/8 of each axis (at least 4 pixels), in the middle of the diagram
+                    x_half = max((x_max - x_min) / 16, 2 * pixel_size)
+                    y_half = max((y_max - y_min) / 16, 2 * pixel_size)
+                    window = (x_center - x_half, x_center + x_half, y_center - y_half, y_center + y_half)
+                    x_i, y_i, pixels = measure(timer, case, 'interpolate',
+                                               lambda: image_interpolation(diagram, pixel_size, method), repeat,
+                                               raw_points=raw_points)
+                    measure(timer, case, 'interpolate_window',
+                            lambda: image_interpolation(raw_index, pixel_size, method, window=window), repeat,
+                            raw_points=raw_points)
+                    measure(timer, case, 'filter', lambda: filter_interpolated(diagram, pixels, pixel_size, method),
+                            repeat, pixels=pixels.size)
+
+                    for interpolated_format in ('gz', 'npy'):
+                        out_file = work_dir / f'interpolated.{interpolated_format}'
+                        measure(timer, case, f'save_{interpolated_format}',
+                                lambda: save_interpolated(out_file, pixels, x_i, y_i, pixel_size), repeat,
+                                pixels=pixels.size)
+                        measure(timer, case, f'load_{interpolated_format}',
+                                lambda: np.asarray(load_interpolated_csv(out_file)[2]).sum(), repeat,
+                                pixels=pixels.size)
+
+                    for image_dtype in ('float64', 'float32'):
+                        stage = 'save_images' if image_dtype == 'float64' else f'save_images_{image_dtype}'
+                        measure(timer, case, stage,
+                                lambda: save_images(work_dir / 'images', 'diagram', pixels, method, pixel_size,
+                                                    dtype=image_dtype), repeat, pixels=pixels.size)
+
+                    # Labels conversion, with about 50 vertices by label
+                    vertices = rng.uniform(0, pixels.shape[1] - 1, (pixels.size // 100, 2))
+                    measure(timer, case, 'vertices_to_volt', lambda: vertices_to_volt(vertices, x_i[0], y_i[:, 0]),
+                            repeat, vertices=len(vertices))
+
+    return timer
+
+
+def best_runs(timer: StageTimer) -> Dict[str, dict]:
+    """
+    Keep the best run of each stage of each case, to limit the noise of the measures.
+
+    :param timer: The timer with the records of every run.
+    :return: The minimal wall and CPU times, the maximal peak memory and the counts, by 'case/stage'.
+    """
+    results = {}
+    for record in timer.records:
+        # The diagram of the records is the benchmark case
+        key = f'{record["diagram"]}/{record["stage"]}'
+        if key not in results:
+            results[key] = dict(record)
+            del results[key]['diagram'], results[key]['stage']
+        else:
+            best = results[key]
+            best['wall_time'] = min(best['wall_time'], record['wall_time'])
+            best['cpu_time'] = min(best['cpu_time'], record['cpu_time'])
+            best['peak_rss'] = max(best['peak_rss'], record['peak_rss'])
+    return results
+
+
+def environment() -> Dict[str, str]:
+    """
+    :return: The description of the machine and the library versions, to know if 2 runs can be compared.
+    """
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': str(os.cpu_count()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pandas.__version__,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Compare the wall time of each stage with a baseline, and print the comparison table.
+
+    :param results: The results of the current run, as returned by best_runs.
+    :param baseline: The results of the baseline run.
+    :param tolerance: The relative slowdown accepted before flagging a regression (e.g. 0.25 for 25%).
+    :return: The list of regressed stages.
+    """
+    regressions = []
+    print(f'{"Stage":<60}{"Baseline (s)":>14}{"Current (s)":>14}{"Ratio":>8}')
+    for key, result in results.items():
+        if key not in baseline:
+            print(f'{key:<60}{"-":>14}{result["wall_time"]:>14.4f}{"-":>8}  new')
+            continue
+
+        reference = baseline[key]['wall_time']
+        ratio = result['wall_time'] / reference if reference > 0 else float('inf')
+        regressed = ratio > 1 + tolerance and result['wall_time'] - reference > MIN_REGRESSION_TIME
+        print(f'{key:<60}{reference:>14.4f}{result["wall_time"]:>14.4f}{ratio:>8.2f}'
+              f'{"  REGRESSION" if regressed else ""}')
+        if regressed:
+            regressions.append(key)
+
+    return regressions
+
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the processing stages with synthetic stability diagrams.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300],
+                        help='number of points on each axis of the synthetic diagrams')
+    parser.add_argument('--pixel-sizes', type=float, nargs='+', default=[0.001, 0.002],
+                        help='output grid resolutions (V)')
+    parser.add_argument('--methods', nargs='+', default=['nearest'], help='interpolation methods')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each stage, the best one is kept')
+    parser.add_argument('--out', type=Path, default=Path('out', 'benchmark', 'results.json'),
+                        help='path of the results file')
+    parser.add_argument('--baseline', type=Path, help='results file of a previous run, to detect regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown accepted before flagging a regression')
+    args = parser.parse_args(arguments)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        timer = run_benchmarks(args.sizes, args.pixel_sizes, args.methods, args.repeat, Path(work_dir))
+
+    results = best_runs(timer)
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, 'w') as results_file:
+        json.dump({'environment': environment(), 'results': results}, results_file, indent=1)
+    print(f'Results saved in {args.out}')
+
+    if args.baseline is None:
+        print(timer.summary_table())
+        return 0
+
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if baseline['environment'] != environment():
+        print('Warning: the baseline was measured in another environment, the comparison may not be relevant')
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    print(f'{len(regressions)} regression(s) found')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
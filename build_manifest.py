@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Union
+
+from file_utils import file_hash
+
+# Change this version to invalidate every existing manifest if the structure changes
+MANIFEST_VERSION = 1
+
+
+def settings_hash(**parameters) -> str:
+    """
+    Compute a stable hash of the parameters that define an output, to detect when it has to be built again.
+
+    :param parameters: The parameters, with JSON serializable values.
+    :return: The hexadecimal digest.
+    """
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class BuildManifest:
+    """
+    Record of the outputs built by the processing pipeline, stored as a JSON file.
+    Each output file is recorded with the hash of the raw file it was built from and the hash of the settings used.
+    An output has to be built again if it is missing, if the raw file content changed or if the settings changed.
+    The raw file hashes are cached with their size and modification time, so unchanged files are not read again.
+    """
+
+    def __init__(self, file_path: Union[str, Path], root_dir: Union[str, Path]):
+        """
+        Load a build manifest, or start an empty one if the file doesn't exist or has an old version.
+
+        :param file_path: The path to the manifest file (JSON).
+        :param root_dir: The directory used as the origin of every path recorded in the manifest.
+        """
+        self.file_path = Path(file_path)
+        self.root_dir = Path(root_dir)
+
+        manifest = {}
+        if self.file_path.is_file():
+            with open(self.file_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+
+        if manifest.get('version') != MANIFEST_VERSION:
+            manifest = {'version': MANIFEST_VERSION, 'raw': {}, 'outputs': {}}
+
+        self._raw = manifest['raw']
+        self._outputs = manifest['outputs']
+
+    def _relative(self, file_path: Path) -> str:
+        return Path(file_path).relative_to(self.root_dir).as_posix()
+
+    def raw_hash(self, raw_file: Path) -> str:
+        """
+        Get the content hash of a raw file. Only computed if the size or the modification time changed.
+
+        :param raw_file: The path to the raw file.
+        :return: The hexadecimal SHA-256 digest.
+        """
+        key = self._relative(raw_file)
+        stat = raw_file.stat()
+        cached = self._raw.get(key)
+        if cached is None or cached['size'] != stat.st_size or cached['mtime_ns'] != stat.st_mtime_ns:
+            cached = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(raw_file)}
+            self._raw[key] = cached
+        return cached['sha256']
+
+    def is_stale(self, output_files: Iterable[Path], raw_file: Path, settings_digest: str) -> bool:
+        """
+        Check if a group of outputs has to be built again.
+
+        :param output_files: The paths to the output files built together.
+        :param raw_file: The path to the raw file they are built from.
+        :param settings_digest: The hash of the settings they are built with (see settings_hash).
+        :return: True if at least one output is missing, not recorded, or recorded with another raw file content or
+         other settings.
+        """
+        raw_digest = self.raw_hash(raw_file)
+        for output_file in output_files:
+            record = self._outputs.get(self._relative(output_file))
+            if record is None or not output_file.is_file() or record['raw_sha256'] != raw_digest \
+                    or record['settings'] != settings_digest:
+                return True
+        return False
+
+    def record(self, output_files: Iterable[Path], raw_file: Path, settings_digest: str) -> None:
+        """
+        Record a group of outputs that has just been built.
+
+        :param output_files: The paths to the output files built together.
+        :param raw_file: The path to the raw file they are built from.
+        :param settings_digest: The hash of the settings they are built with (see settings_hash).
+        """
+        raw_digest = self.raw_hash(raw_file)
+        for output_file in output_files:
+            self._outputs[self._relative(output_file)] = {
+                'raw': self._relative(raw_file),
+                'raw_sha256': raw_digest,
+                'settings': settings_digest,
+            }
+
+    def save(self) -> None:
+        """
+        Write the manifest file. The previous file is replaced atomically, so an interrupted run can't corrupt it.
+        """
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.file_path.with_suffix('.tmp')
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({'version': MANIFEST_VERSION, 'raw': self._raw, 'outputs': self._outputs}, manifest_file,
+                      indent=1)
+        os.replace(temporary_path, self.file_path)
+
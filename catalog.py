@@ -0,0 +1,236 @@
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Change this version to reset every existing catalog if the structure changes
+CATALOG_VERSION = 1
+
+# The columns of the raw diagram statistics, as computed by the loaders (see load_raw_csv)
+STATISTICS_COLUMNS = ('points', 'x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max', 'z_p1', 'z_p99')
+
+
+def diagram_store_name(diagram_file: Path, raw_clean_dir: Path) -> str:
+    """
+    Build the name of a diagram from its raw file, shared by the catalog and the diagram store.
+
+    :param diagram_file: The path to the raw file of the diagram (CSV or NPZ).
+    :param raw_clean_dir: The root directory of raw files.
+    :return: The name of the diagram (the store key without the pixel size), as its path in the raw_clean directory
+     without extension: 'single|double/research_group/diagram' or 'research_group/diagram' (as written by data_cleanup)
+    """
+    return (diagram_file.parent.relative_to(raw_clean_dir) / diagram_file.stem).as_posix()
+
+
+def name_parts(name: str) -> Tuple[Optional[bool], str]:
+    """
+    Extract the dot type and the research group from the name of a diagram.
+
+    :param name: The name of the diagram, as its path in the raw_clean directory without extension:
+     'single|double/research_group/diagram' or 'research_group/diagram' (as written by data_cleanup)
+    :return: True for a single dot diagram, False for a double dot diagram, None if unknown, and the research group.
+    """
+    parts = name.split('/')
+    if parts[0] in ('single', 'double') and len(parts) > 2:
+        return parts[0] == 'single', parts[1]
+    return None, parts[0]
+
+
+class Catalog:
+    """
+    Catalog of the dataset diagrams and of the outputs built from them, stored as a SQLite database.
+    The processing scripts record what they produce (raw statistics, grid shape of each pixel size, output paths), so
+    the diagrams for an experiment can be selected with a query, without opening any data file.
+
+    The tables are:
+        * diagrams: one row by raw diagram (name, research group, dot type, raw file, statistics)
+        * levels: one row by diagram and pixel size (grid shape, interpolated values file, image file)
+        * labels: one row by labeled diagram (number of transition lines and charge areas)
+    """
+
+    def __init__(self, file_path: Union[str, Path], root_dir: Union[str, Path]):
+        """
+        Open a catalog, and create it if it is missing or has an old version.
+
+        :param file_path: The path to the catalog file (SQLite).
+        :param root_dir: The directory used as the origin of every path recorded in the catalog.
+        """
+        self.file_path = Path(file_path)
+        self.root_dir = Path(root_dir)
+
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.file_path)
+        self._connection.row_factory = sqlite3.Row
+
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != CATALOG_VERSION:
+            self._create()
+
+    def __contains__(self, name: str) -> bool:
+        return self._connection.execute('SELECT 1 FROM diagrams WHERE name = ?', (name,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM diagrams').fetchone()[0]
+
+    def _create(self) -> None:
+        """
+        Create the tables, the content of a catalog with another version is removed.
+        """
+        statistics = ', '.join(f'{column} {"INTEGER" if column == "points" else "REAL"}'
+                               for column in STATISTICS_COLUMNS)
+        with self._connection:
+            for table in ('diagrams', 'levels', 'labels'):
+                self._connection.execute(f'DROP TABLE IF EXISTS {table}')
+            self._connection.execute(f'CREATE TABLE diagrams (name TEXT PRIMARY KEY, stem TEXT, research_group TEXT, '
+                                     f'single_dot INTEGER, raw_file TEXT, gridded INTEGER, {statistics})')
+            self._connection.execute('CREATE TABLE levels (name TEXT, pixel_size REAL, rows INTEGER, cols INTEGER, '
+                                     'values_file TEXT, image_file TEXT, PRIMARY KEY (name, pixel_size))')
+            self._connection.execute('CREATE TABLE labels (stem TEXT PRIMARY KEY, lines INTEGER, areas INTEGER)')
+            self._connection.execute('CREATE INDEX diagrams_group ON diagrams (research_group, single_dot)')
+            self._connection.execute('CREATE INDEX diagrams_stem ON diagrams (stem)')
+            self._connection.execute('CREATE INDEX levels_pixel_size ON levels (pixel_size)')
+            self._connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def _relative(self, file_path: Optional[Path]) -> Optional[str]:
+        if file_path is None:
+            return None
+        try:
+            return Path(file_path).relative_to(self.root_dir).as_posix()
+        except ValueError:
+            # Outside the root directory
+            return Path(file_path).as_posix()
+
+    def record_diagram(self, name: str, raw_file: Path, statistics: dict, gridded: bool = False,
+                       research_group: Optional[str] = None) -> None:
+        """
+        Add or replace a raw diagram.
+
+        :param name: The name of the diagram, as its path in the raw_clean directory without extension.
+        :param raw_file: The path to the raw file of the diagram.
+        :param statistics: The statistics of the raw values, as returned by the loaders (see load_raw_csv).
+        :param gridded: True if the raw file contains a GriddedDiagram.
+        :param research_group: The research group of the diagram, extracted from the name if None.
+        """
+        single_dot, name_group = name_parts(name)
+        with self._connection:
+            self._connection.execute(f'INSERT OR REPLACE INTO diagrams VALUES (?, ?, ?, ?, ?, ?, '
+                                     f'{", ".join("?" * len(STATISTICS_COLUMNS))})',
+                                     (name, Path(name).name, research_group or name_group, single_dot,
+                                      self._relative(raw_file), gridded,
+                                      *(statistics.get(column) for column in STATISTICS_COLUMNS)))
+
+    def record_level(self, name: str, pixel_size: float, shape: Tuple[int, int], values_file: Optional[Path] = None,
+                     image_file: Optional[Path] = None) -> None:
+        """
+        Add or replace the interpolated grid of a diagram for one pixel size.
+
+        :param name: The name of the diagram, as its path in the raw_clean directory without extension.
+        :param pixel_size: The pixel size of the grid, in volt.
+        :param shape: The shape of the interpolated values (rows, cols).
+        :param values_file: The path to the interpolated values file, if it is built.
+        :param image_file: The path to the image file, if it is built.
+        """
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO levels VALUES (?, ?, ?, ?, ?, ?)',
+                                     (name, pixel_size, int(shape[0]), int(shape[1]), self._relative(values_file),
+                                      self._relative(image_file)))
+
+    def record_labels(self, labels) -> int:
+        """
+        Replace the label counts with the content of a labels cache.
+
+        :param labels: The labels cache (see LabelsCache).
+        :return: The number of labeled diagrams recorded.
+        """
+        rows = []
+        for stem in labels.names():
+            diagram_labels = labels.get(stem)
+            rows.append((stem, len(np.unique(diagram_labels.line_indices)), len(diagram_labels.area_labels)))
+
+        with self._connection:
+            self._connection.execute('DELETE FROM labels')
+            self._connection.executemany('INSERT INTO labels VALUES (?, ?, ?)', rows)
+        return len(rows)
+
+    def has_level(self, name: str, pixel_size: float) -> bool:
+        """
+        :param name: The name of the diagram.
+        :param pixel_size: The pixel size, in volt.
+        :return: True if the diagram and its grid for this pixel size are recorded.
+        """
+        return name in self and self._connection.execute(
+            'SELECT 1 FROM levels WHERE name = ? AND ABS(pixel_size - ?) < 1e-12', (name, pixel_size)).fetchone() \
+            is not None
+
+    def levels(self, name: str) -> Dict[float, dict]:
+        """
+        :param name: The name of the diagram.
+        :return: The recorded grids of the diagram by pixel size (rows, cols, values_file, image_file).
+        """
+        rows = self._connection.execute('SELECT * FROM levels WHERE name = ? ORDER BY pixel_size', (name,))
+        return {row['pixel_size']: {key: row[key] for key in row.keys() if key not in ('name', 'pixel_size')}
+                for row in rows}
+
+    def query(self, pixel_size: Optional[float] = None, research_group: Optional[str] = None,
+              single_dot: Optional[bool] = None, labeled: Optional[bool] = None, min_points: Optional[int] = None,
+              min_shape: Optional[Tuple[int, int]] = None, voltage_area: Optional[Tuple] = None) -> List[dict]:
+        """
+        Select diagrams with their statistics, their label counts and, if a pixel size is given, their grid.
+        Every filter is optional, and the filters are combined.
+
+        :param pixel_size: Only select the diagrams interpolated with this pixel size (in volt), with the grid columns.
+        :param research_group: Only select the diagrams of this research group.
+        :param single_dot: If True only select single dot diagrams, if False only double dot diagrams.
+        :param labeled: If True only select labeled diagrams, if False only diagrams without labels.
+        :param min_points: Only select the diagrams with at least this number of raw points.
+        :param min_shape: Only select the diagrams with at least this grid shape (rows, cols), requires a pixel size.
+        :param voltage_area: Only select the diagrams that cover this area, as (x_min, x_max, y_min, y_max) in volt.
+        :return: The selected diagrams as dictionaries of columns, sorted by name.
+        """
+        columns = 'd.*, l.lines, l.areas'
+        joins = 'LEFT JOIN labels l ON l.stem = d.stem'
+        conditions, parameters = [], []
+
+        if pixel_size is not None:
+            columns += ', v.pixel_size, v.rows, v.cols, v.values_file, v.image_file'
+            joins += ' JOIN levels v ON v.name = d.name AND ABS(v.pixel_size - ?) < 1e-12'
+            parameters.append(pixel_size)
+        elif min_shape is not None:
+            raise ValueError('A pixel size is required to select diagrams by grid shape.')
+
+        if research_group is not None:
+            conditions.append('d.research_group = ?')
+            parameters.append(research_group)
+        if single_dot is not None:
+            conditions.append('d.single_dot = ?')
+            parameters.append(single_dot)
+        if labeled is not None:
+            conditions.append(f'l.stem IS {"NOT " if labeled else ""}NULL')
+        if min_points is not None:
+            conditions.append('d.points >= ?')
+            parameters.append(min_points)
+        if min_shape is not None:
+            conditions.append('v.rows >= ? AND v.cols >= ?')
+            parameters.extend(min_shape)
+        if voltage_area is not None:
+            conditions.append('d.x_min <= ? AND d.x_max >= ? AND d.y_min <= ? AND d.y_max >= ?')
+            parameters.extend(voltage_area)
+
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self._connection.execute(f'SELECT {columns} FROM diagrams d {joins}{where} ORDER BY d.name', parameters)
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+if __name__ == '__main__':
+    from settings import settings
+
+    catalog = Catalog(Path(settings.out_dir, 'catalog.sqlite'), settings.out_dir)
+    print(f'{len(catalog)} diagram(s) in the catalog')
+    for diagram in catalog.query(pixel_size=settings.pixel_size):
+        labels = f'{diagram["lines"]} lines, {diagram["areas"]} areas' if diagram['lines'] is not None else 'no label'
+        print(f'{diagram["name"]}: {diagram["points"]:,} raw points, {diagram["rows"]}x{diagram["cols"]} pixels '
+              f'at {settings.pixel_size * 1000}mV, {labels}')
@@ -0,0 +1,196 @@
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from catalog import Catalog, diagram_store_name
+from data_cleanup import eva_dupont_ferrier, louis_gaudreau, michel_pioro_ladriere
+from gridded_diagram import GriddedDiagram
+from instrumentation import StageTimer
+from loaders import raw_statistics, save_raw
+from settings import settings
+
+
+class SourceSpec(NamedTuple):
+    """
+    How to convert the original files of one research group.
+    """
+    # The function that loads a file as x, y, z columns
+    parser: Callable[..., Tuple[np.ndarray, np.ndarray, np.ndarray]]
+    # The arguments of the parser for every file (e.g. the columns), None to skip the files not listed in file_args
+    default_args: Optional[dict] = {}
+    # The arguments of the parser for specific files (by name, without extension), replace the default ones
+    file_args: Dict[str, dict] = {}
+    # The files (by name, without extension) that can't be converted
+    excluded: Tuple[str, ...] = ()
+    # The files (by name, without extension) cut in 2 parts along the y-axis
+    split: Tuple[str, ...] = ()
+    # The function that loads a file as a GriddedDiagram, if the source is a regular sweep (same arguments as parser)
+    gridded_parser: Optional[Callable[..., GriddedDiagram]] = None
+
+
+# The conversion of each research group, the zip files of originals are named as the groups
+SOURCE_SPECS = {
+    'eva_dupont_ferrier': SourceSpec(eva_dupont_ferrier.load_raw_points),
+    # The column format is not always the same, so only the files with known columns are converted
+    'louis_gaudreau': SourceSpec(louis_gaudreau.load_raw_points,
+                                 default_args=None,
+                                 file_args={'jul25300s': {'columns': (3, 1, 5)}}),
+    'michel_pioro_ladriere': SourceSpec(michel_pioro_ladriere.load_raw_points,
+                                        # TODO check why "1779Dev2-20161127_473.dat" is not good
+                                        excluded=('1779Dev2-20161127_473',),
+                                        # Cut this one in half because it's quite big and create out of distribution
+                                        # issue with cross-validation
+                                        split=('1779Dev2-20161127_145',),
+                                        gridded_parser=michel_pioro_ladriere.load_grid),
+}
+
+
+def split_diagram(diagram: Union[pd.DataFrame, GriddedDiagram]) -> Tuple[Union[pd.DataFrame, GriddedDiagram], ...]:
+    """
+    Cut a diagram in 2 parts along the y-axis, the same way as the original dataset.
+
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+    :return: The part above the cut and the part below the cut.
+    """
+    if isinstance(diagram, GriddedDiagram):
+        mean_y = (diagram.y.max() - diagram.y.min()) / 2
+        return diagram.select_rows(diagram.y > mean_y), diagram.select_rows(diagram.y <= mean_y)
+
+    mean_y = (diagram['y'].max() - diagram['y'].min()) / 2
+    return diagram[diagram['y'] > mean_y], diagram[diagram['y'] <= mean_y]
+
+
+def count_points(diagram: Union[pd.DataFrame, GriddedDiagram]) -> int:
+    """
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+    :return: The number of measured points.
+    """
+    return diagram.size if isinstance(diagram, GriddedDiagram) else len(diagram)
+
+
+def convert_member(research_group: str, member: str, originals_dir: Path, out_dir: Path, plot_results: bool,
+                   raw_clean_format: str = 'csv', instrumentation: bool = False) -> dict:
+    """
+    Convert one original file of a research group into raw_clean file(s).
+    The regular sweeps are saved as gridded diagrams in NPZ files, if the group has a gridded parser.
+    Every argument is explicit to be able to run this function in a worker process.
+
+    :param research_group: The name of the research group, key of SOURCE_SPECS.
+    :param member: The path of the original file in the zip file of the group.
+    :param originals_dir: The directory of the zip files of originals.
+    :param out_dir: The raw_clean directory, the files are saved in a sub-directory for each group.
+    :param plot_results: If True, plot each converted diagram.
+    :param raw_clean_format: The file format (extension) of the raw_clean files: 'csv' or 'npz'.
+    :param instrumentation: If True, measure each processing stage (see StageTimer).
+    :return: The conversion result, with the keys 'outputs' (name, file, statistics and gridded flag of each file saved,
+     see raw_statistics) and 'stages' (the stage records, empty if not measured).
+    """
+    spec = SOURCE_SPECS[research_group]
+    name = Path(member).with_suffix('').as_posix()
+    parser_args = spec.file_args.get(Path(member).stem, spec.default_args)
+    gridded = raw_clean_format == 'npz' and spec.gridded_parser is not None
+    timer = StageTimer(instrumentation)
+
+    with timer.stage(name, 'parse') as counts:
+        with zipfile.ZipFile(originals_dir / f'{research_group}.zip', 'r') as zip_file, \
+                zip_file.open(member, 'r') as file:
+            if gridded:
+                diagram = spec.gridded_parser(file, **parser_args)
+            else:
+                x, y, z = spec.parser(file, **parser_args)
+                diagram = pd.DataFrame({'x': x, 'y': y, 'z': z})
+        counts['raw_points'] = count_points(diagram)
+
+    if Path(member).stem in spec.split:
+        parts = zip((f'{name}-part1', f'{name}-part2'), split_diagram(diagram))
+    else:
+        parts = [(name, diagram)]
+
+    outputs = []
+    for part_name, part in parts:
+        if plot_results:
+            # Import here to load matplotlib only if necessary
+            from plots import plot_raw
+            plot_raw(part.to_dataframe() if gridded else part, part_name)
+
+        part_file = out_dir / research_group / f'{part_name}.{raw_clean_format}'
+        with timer.stage(part_name, 'save', raw_points=count_points(part)):
+            save_raw(part_file, part)
+
+        # Recorded in the catalog by the main process
+        with timer.stage(part_name, 'statistics', raw_points=count_points(part)):
+            statistics = raw_statistics(part)
+        outputs.append({'name': part_name, 'file': part_file, 'statistics': statistics, 'gridded': gridded})
+
+    return {'outputs': outputs, 'stages': timer.records}
+
+
+def list_members(originals_dir: Path, research_group: str) -> List[str]:
+    """
+    List the original files of a research group to convert, according to its spec.
+
+    :param originals_dir: The directory of the zip files of originals.
+    :param research_group: The name of the research group, key of SOURCE_SPECS.
+    :return: The sorted paths of the files in the zip file.
+    """
+    spec = SOURCE_SPECS[research_group]
+    with zipfile.ZipFile(originals_dir / f'{research_group}.zip', 'r') as zip_file:
+        members = sorted(name for name in zip_file.namelist() if not name.endswith('/'))
+
+    selected = []
+    for member in members:
+        stem = Path(member).stem
+        if stem in spec.excluded:
+            print(f'{research_group}/{member} skipped (excluded)')
+        elif spec.default_args is None and stem not in spec.file_args:
+            print(f'{research_group}/{member} skipped (no column spec)')
+        else:
+            selected.append(member)
+    return selected
+
+
+def main():
+    originals_dir = Path(settings.data_dir, 'originals')
+    out_dir = Path(settings.out_dir, 'raw_clean')
+    research_groups = settings.research_groups or list(SOURCE_SPECS)
+
+    # The interactive plots can't be shown from worker processes
+    convert = partial(convert_member,
+                      originals_dir=originals_dir,
+                      out_dir=out_dir,
+                      plot_results=settings.plot_results and settings.workers <= 1,
+                      raw_clean_format=settings.raw_clean_format,
+                      instrumentation=settings.instrumentation)
+
+    tasks = [(group, member) for group in research_groups for member in list_members(originals_dir, group)]
+    timer = StageTimer(settings.instrumentation)
+    # Record of the converted diagrams, with their statistics
+    catalog = Catalog(Path(settings.out_dir, 'catalog.sqlite'), settings.out_dir)
+    count = 0
+
+    with ProcessPoolExecutor(max_workers=settings.workers) if settings.workers > 1 else nullcontext() as executor:
+        # Lazy evaluation in the main process, or parallel evaluation in the worker pool
+        groups, members = [group for group, _ in tasks], [member for _, member in tasks]
+        results = executor.map(convert, groups, members) if executor else map(convert, groups, members)
+
+        for (group, _), result in zip(tasks, results):
+            timer.extend(result['stages'])
+            for output in result['outputs']:
+                # Same name as the later stages (raw_to_images), so they update this diagram
+                catalog.record_diagram(diagram_store_name(output['file'], out_dir), output['file'],
+                                       output['statistics'], output['gridded'], research_group=group)
+                print(f'{group}/{output["name"]} converted ({output["statistics"]["points"]:,} points)')
+                count += 1
+
+    print(f'{count} raw diagrams converted to {settings.raw_clean_format} in {out_dir}')
+    timer.save(Path(settings.out_dir, 'instrumentation'), 'convert')
+
+
+if __name__ == '__main__':
+    main()
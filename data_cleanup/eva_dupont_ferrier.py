@@ -5,30 +5,38 @@ from zipfile import ZipFile
 import numpy as np
 import pandas as pd
 
-from raw_to_images import plot_raw
 
-
-def load_raw_points(diagram_file: IO) -> Tuple[List[float], List[float], List]:
+def load_raw_points(diagram_file: IO, columns: Tuple[int, int, int] = (0, 2, 4)) -> Tuple[List[float], List[float],
+                                                                                         List]:
     """
     Load the raw files with all columns.
 
     :param diagram_file: The diagram file to load.
+    :param columns: The index of the x, y and z columns.
     :return: The columns x, y, z according to the selected ones.
     """
-    data = np.loadtxt(diagram_file)
+    data = np.loadtxt(diagram_file, usecols=columns)
     x = data[:, 0]
-    y = data[:, 2]
-    z = data[:, 4]
+    y = data[:, 1]
+    z = data[:, 2]
     return x, y, z
 
 
 if __name__ == '__main__':
+    # Import here to load matplotlib only if this file is run as a script
+    from instrumentation import StageTimer
+    from plots import plot_raw
+    from settings import settings
+
+    timer = StageTimer(settings.instrumentation)
+
     count = 0
     with ZipFile('../data/originals/eva_dupont_ferrier.zip', 'r') as zip_file:
         for file_name in zip_file.namelist():
             print(f'---------- {file_name[:-4]} ----------')
-            with zip_file.open(file_name, 'r') as file:
+            with timer.stage(file_name[:-4], 'load') as counts, zip_file.open(file_name, 'r') as file:
                 x, y, values = load_raw_points(file)
+                counts['raw_points'] = len(values)
 
             df = pd.DataFrame({'x': x, 'y': y, 'z': values})
             plot_raw(df, file_name)
@@ -39,7 +47,9 @@ if __name__ == '__main__':
             # Change '.dat' for '.csv'
             out_dir = Path(f'../out/raw_clean/eva_dupont_ferrier')
             out_dir.mkdir(parents=True, exist_ok=True)
-            df.to_csv(out_dir / f'{file_name[:-4]}.csv', index=False)
+            with timer.stage(file_name[:-4], 'save', raw_points=len(df)):
+                df.to_csv(out_dir / f'{file_name[:-4]}.csv', index=False)
             count += 1
 
     print(f'{count} raw diagrams converted to csv')
+    timer.save(Path('../out/instrumentation'), 'eva_dupont_ferrier')
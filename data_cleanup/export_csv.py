@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from loaders import load_raw_npz, save_raw
+from settings import settings
+
+
+def export_csv(raw_clean_dir: Path) -> int:
+    """
+    Export every binary raw diagram (NPZ) as a CSV file next to it, for the public release of the dataset.
+    The CSV files already up-to-date (more recent than the NPZ file) are not exported again.
+
+    :param raw_clean_dir: The root directory of raw files.
+    :return: The number of files exported.
+    """
+    count = 0
+    for npz_file in sorted(raw_clean_dir.rglob('*.npz')):
+        csv_file = npz_file.with_suffix('.csv')
+        if csv_file.is_file() and csv_file.stat().st_mtime_ns >= npz_file.stat().st_mtime_ns:
+            continue
+
+        diagram, _ = load_raw_npz(npz_file)
+        save_raw(csv_file, diagram)
+        count += 1
+
+    return count
+
+
+if __name__ == '__main__':
+    out_dir = Path(settings.out_dir, 'raw_clean')
+    print(f'{export_csv(out_dir)} raw diagrams exported to csv in {out_dir}')
@@ -1,100 +1,174 @@
 from pathlib import Path
-from typing import List, Tuple, IO
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
 from zipfile import ZipFile
 
 import numpy as np
 import pandas as pd
 
-from raw_to_images import plot_raw
+from gridded_diagram import GriddedDiagram
 
 
-def load_raw_points(file: IO) -> Tuple[List[float], List[float], List]:
+# Header parameters used to reconstruct the axes, with the function to parse each value
+HEADER_PARAMETERS = {
+    'Sweep channel: Name': str,
+    'Sweep channel: Start': float,
+    'Sweep channel: Stop': float,
+    'Sweep channel: Points': lambda value: int(float(value)),
+    'Step channel 1: Name': str,
+    'Step channel 1: Start': float,
+    'Step channel 1: Stop': float,
+    'Step channel 1: Points': lambda value: int(float(value)),
+    'Acquire channels': lambda value: value.split(';'),
+}
+
+
+def read_header(file: IO) -> Tuple[dict, int]:
+    """
+    Read the header of a .dat file, line by line until the beginning of the data.
+    The file position is then at the first data row.
+
+    :param file: The diagram file, in binary or text mode (seekable).
+    :return: The header parameters (see HEADER_PARAMETERS) and the number of data columns.
     """
-    Load the raw files with all columns (some are useless the game is to find which ones
+    params = dict.fromkeys(HEADER_PARAMETERS)
+    while line := file.readline():
+        line = line.decode() if isinstance(line, bytes) else line
+        if '[DATA]' in line:
+            # The line after [DATA] is the column labels, skip it
+            file.readline()
+            # Count the columns of the first row, since the labels include the missing steps of incomplete measurements
+            position = file.tell()
+            nb_columns = len(file.readline().split())
+            file.seek(position)
+            return params, nb_columns
+
+        fields = line.rstrip('\r\n').split('\t')
+        if len(fields) > 1 and fields[0] in HEADER_PARAMETERS:
+            params[fields[0]] = HEADER_PARAMETERS[fields[0]](fields[1])
+
+    raise ValueError('No [DATA] section found in the file.')
+
+
+def load_data(file: IO, channels: Optional[Iterable[int]] = None) -> Tuple[dict, List[int], np.ndarray, np.ndarray,
+                                                                           np.ndarray]:
+    """
+    Load the data of the requested channels, with a single pass on the file. Only their columns are converted.
     Function based on this notebook (private link) :
     https://usherbrooke-my.sharepoint.com/:u:/r/personal/roum2013_usherbrooke_ca/Documents/Doctorat/Data/Data%20set%20for%20machine%20learning/data_info.ipynb?csf=1&web=1&e=BOvoam
 
-    :param file: The diagram file to load.
-    :return: The columns x, y, z according to the selected ones.
+    :param file: The diagram file to load, in binary or text mode (seekable).
+    :param channels: The index of the channels to load (in the "Acquire channels" order). All channels if None.
+    :return: The header parameters, the index of the channels loaded, the x-axis, the y-axis, and the data as an array
+     (x length, y length * channels) with the steps of each channel next to each other.
     """
+    params, nb_columns = read_header(file)
+
+    # The first column is the x-axis, then the value of each channel for each step of the y-axis
+    nb_ch = len(params['Acquire channels'])
+    channels = list(range(nb_ch) if channels is None else channels)
+    use_columns = [column for ch in channels for column in range(1 + ch, nb_columns, nb_ch)]
 
-    # Reading .dat file
-    file_content = file.readlines()
-
-    # Reading header
-    header_size = 0
-    param_labels = ["Sweep channel: Name", "Sweep channel: Start", "Sweep channel: Stop", "Sweep channel: Points",
-                    "Step channel 1: Name", "Step channel 1: Start", "Step channel 1: Stop", "Step channel 1: Points",
-                    "Acquire channels"]
-    params = dict.fromkeys(param_labels)
-    for line in file_content:
-        line = line.decode()  # bytes to str
-
-        for label in param_labels:
-            if label in line:
-                if "Name" in label:
-                    params[label] = line.split("\t")[1]
-                elif "Points" in label:
-                    params[label] = int(float(line.split("\t")[1]))
-                elif "Acquire channels" in label:
-                    params[label] = line.split("\t")[1].split(";")
-                else:
-                    params[label] = float(line.split("\t")[1])
-
-        if '[DATA]' not in line:
-            header_size = header_size + 1
-        else:
-            header_size = header_size + 2  # skip [DATA] line and column labels
-            break
-
-    print(params)
-
-    # Extract data from file
-    data = np.genfromtxt(file_content[header_size:]).transpose()
-    data = data[1:, :]  # first row is the x-axis, remove from data
-
-    # Separate data measured from multiple channels
-    nb_ch = len(params["Acquire channels"])
-    data_arrays = []
-    for ch in range(nb_ch):
-        data_arrays.append(data[ch::nb_ch])
+    # Extract data from file, with the C parser of numpy
+    data = np.loadtxt(file, usecols=use_columns, ndmin=2)
+    if (nb_columns - 1) % nb_ch != 0 or data.shape[1] % len(channels) != 0:
+        # Each channel would be sliced with the columns of the next one
+        raise ValueError(f'The {nb_columns - 1} data columns can not be split between the {nb_ch} channels (incomplete '
+                         f'last step?).')
+    nb_steps = data.shape[1] // len(channels)
 
     # Verify shape of data
-    data_shape = data_arrays[0].shape  # (y length, x length)
-    header_data_shape = (params["Step channel 1: Points"], params["Sweep channel: Points"])
+    data_shape = (nb_steps, data.shape[0])  # (y length, x length)
+    header_data_shape = (params['Step channel 1: Points'], params['Sweep channel: Points'])
 
     if data_shape != header_data_shape:  # if the measurement is incomplete for example
         # Adjust y-axis last point
-        dy = (params["Step channel 1: Stop"] - params["Step channel 1: Start"]) / (params["Step channel 1: Points"])
-        params["Step channel 1: Stop"] = params["Step channel 1: Start"] + dy * data_shape[0]
+        dy = (params['Step channel 1: Stop'] - params['Step channel 1: Start']) / (params['Step channel 1: Points'])
+        params['Step channel 1: Stop'] = params['Step channel 1: Start'] + dy * data_shape[0]
 
         # Adjust number of points
-        params["Step channel 1: Points"], params["Sweep channel: Points"] = data_shape
+        params['Step channel 1: Points'], params['Sweep channel: Points'] = data_shape
 
     # Reconstruct axis from header
-    x = np.linspace(params["Sweep channel: Start"], params["Sweep channel: Stop"], params["Sweep channel: Points"])
-    y = np.linspace(params["Step channel 1: Start"], params["Step channel 1: Stop"], params["Step channel 1: Points"])
+    x = np.linspace(params['Sweep channel: Start'], params['Sweep channel: Stop'], params['Sweep channel: Points'])
+    y = np.linspace(params['Step channel 1: Start'], params['Step channel 1: Stop'], params['Step channel 1: Points'])
+
+    return params, channels, x, y, data
+
+
+def load_channels(file: IO, channels: Optional[Iterable[int]] = None) -> Iterator[Tuple[str, np.ndarray, np.ndarray,
+                                                                                       np.ndarray]]:
+    """
+    Load the raw files as x, y, z columns, with a single pass on the file.
+
+    :param file: The diagram file to load, in binary or text mode (seekable).
+    :param channels: The index of the channels to load (in the "Acquire channels" order). All channels if None.
+    :return: An iterator of channels, as the channel name and the columns x, y, z. The flattened columns are built
+     when the channel is requested.
+    """
+    params, channels, x, y, data = load_data(file, channels)
+    nb_steps = len(y)
+
+    # Match axis with flatten image
+    len_y, len_x = len(y), len(x)
+    x = np.tile(x, len_y)
+    y = y.repeat(len_x)
+
+    for i, ch in enumerate(channels):
+        # Flatten image, the rows of the file are the x-axis
+        z = data[:, i * nb_steps:(i + 1) * nb_steps].T.reshape(-1)
+        yield params['Acquire channels'][ch], x, y, z
 
-    # Process data for all channels measured
-    for i in range(nb_ch):
-        z = data_arrays[i]
-        if "Demod" not in params["Acquire channels"][i]:
-            dz = np.gradient(z, axis=1)  # use the numerical derivative if transconductance is not used
-        else:
-            dz = z
 
-        # Flatten image
-        len_y, len_x = z.shape
-        z = z.reshape(-1)
-        # Match axis with flatten image
-        x = x.reshape((1, -1)).repeat(len_y, axis=0).reshape(-1)
-        y = y.repeat(len_x)
+def load_gridded_channels(file: IO, channels: Optional[Iterable[int]] = None) -> Iterator[Tuple[str, GriddedDiagram]]:
+    """
+    Load the raw files as gridded diagrams, since each file is a regular sweep. Nothing is flattened.
+
+    :param file: The diagram file to load, in binary or text mode (seekable).
+    :param channels: The index of the channels to load (in the "Acquire channels" order). All channels if None.
+    :return: An iterator of channels, as the channel name and the gridded diagram.
+    """
+    params, channels, x, y, data = load_data(file, channels)
+    nb_steps = len(y)
+    axes = {'sweep': params['Sweep channel: Name'], 'step': params['Step channel 1: Name']}
+
+    for i, ch in enumerate(channels):
+        # The rows of the file are the x-axis, copy the values to make them contiguous as [y, x]
+        values = np.ascontiguousarray(data[:, i * nb_steps:(i + 1) * nb_steps].T)
+        name = params['Acquire channels'][ch]
+        yield name, GriddedDiagram.from_axes(x, y, values, {'channel': name, **axes})
+
+
+def load_raw_points(file: IO, channel: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load one channel of the raw files.
+
+    :param file: The diagram file to load, in binary or text mode (seekable).
+    :param channel: The index of the channel to load (in the "Acquire channels" order).
+    :return: The columns x, y, z of this channel.
+    """
+    _, x, y, z = next(load_channels(file, [channel]))
+    return x, y, z
 
-        # Return only the first channel
-        return x, y, z
+
+def load_grid(file: IO, channel: int = 0) -> GriddedDiagram:
+    """
+    Load one channel of the raw files as a gridded diagram.
+
+    :param file: The diagram file to load, in binary or text mode (seekable).
+    :param channel: The index of the channel to load (in the "Acquire channels" order).
+    :return: The gridded diagram of this channel.
+    """
+    _, diagram = next(load_gridded_channels(file, [channel]))
+    return diagram
 
 
 if __name__ == '__main__':
+    # Import here to load matplotlib only if this file is run as a script
+    from instrumentation import StageTimer
+    from plots import plot_raw
+    from settings import settings
+
+    timer = StageTimer(settings.instrumentation)
 
     out_dir = Path('../out/raw_clean/michel_pioro_ladriere/')
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -111,8 +185,9 @@ if __name__ == '__main__':
 
             name = file_name[:-4]
             print(f'---------- {name} ----------')
-            with zip_file.open(file_name, 'r') as file:
+            with timer.stage(name, 'load') as counts, zip_file.open(file_name, 'r') as file:
                 x, y, values = load_raw_points(file)
+                counts['raw_points'] = len(values)
 
             df = pd.DataFrame({'x': x, 'y': y, 'z': values})
 
@@ -128,7 +203,8 @@ if __name__ == '__main__':
                 print(df2.describe(percentiles=[.25, .5, .75, .99]))
 
                 # Change '.dat' for '.csv'
-                df2.to_csv(out_dir / f'{name}-part1.csv', index=False)
+                with timer.stage(name + '-part1', 'save', raw_points=len(df2)):
+                    df2.to_csv(out_dir / f'{name}-part1.csv', index=False)
 
                 name += '-part2'  # rename the following one
 
@@ -138,7 +214,9 @@ if __name__ == '__main__':
             print(df.describe(percentiles=[.25, .5, .75, .99]))
 
             # Change '.dat' for '.csv'
-            df.to_csv(out_dir / f'{name}.csv', index=False)
+            with timer.stage(name, 'save', raw_points=len(df)):
+                df.to_csv(out_dir / f'{name}.csv', index=False)
             count += 1
 
     print(f'{count} raw diagrams converted to csv')
+    timer.save(Path('../out/instrumentation'), 'michel_pioro_ladriere')
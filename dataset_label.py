@@ -1,23 +1,31 @@
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 from labelbox import AssetAttachment, Client, DataRow, Dataset
 
 from settings import settings
+from upload_queue import UploadQueue
 
 
 class DatasetLabel(Client):
 
-    def __int__(self):
+    def __init__(self, api_key: Optional[str] = None, dataset: Optional[Dataset] = None):
         """
         Create a LabelBox client connected to a specific dataset.
         Use setting values to establish the connection.
+
+        :param api_key: The API key, the one of the settings if None.
+        :param dataset: The dataset to use, found or created from the settings if None.
         """
-        super().__init__(api_key=settings.api_key)
+        super().__init__(api_key=api_key or settings.api_key)
         self._dataset: Dataset
+        # The link of each data row by external ID, fetched once at the first search
+        self._row_links: Optional[Dict[str, str]] = None
 
+        if dataset is not None:
+            self._dataset = dataset
         # If the dataset id is specified, use it
-        if settings.dataset_id:
+        elif settings.dataset_id:
             self._dataset = self.get_dataset(settings.dataset_id)
         else:
             # If the dataset name is specified, try to find it
@@ -50,9 +58,13 @@ class DatasetLabel(Client):
         :param row_id: The ID of the desired data_row link.
         :return: The first row link that matches the id.
         """
-        for data_row in self._dataset.data_rows():
-            if data_row.external_id == row_id:
-                return data_row.row_data
+        if self._row_links is None:
+            self._row_links = {}
+            for data_row in self._dataset.data_rows():
+                self._row_links.setdefault(data_row.external_id, data_row.row_data)
+
+        if row_id in self._row_links:
+            return self._row_links[row_id]
 
         raise ValueError(f"Data row '{row_id}' not found in dataset '{self._dataset.name}'.")
 
@@ -87,9 +99,22 @@ class DatasetLabel(Client):
         data_row.create_attachment(attachment_type="IMAGE_OVERLAY", attachment_value=datarow_link,
                                    attachment_name="DzDx")
 
+    def upload_queue(self) -> UploadQueue:
+        """
+        Create a queue to upload many images into the dataset, in batches and in parallel (see UploadQueue).
+        Use setting values for the batch size, the number of threads and the number of retries.
+
+        :return: The upload queue, to use as a context manager.
+        """
+        return UploadQueue(self._dataset, self,
+                           batch_size=settings.upload_batch_size,
+                           threads=settings.upload_threads,
+                           retries=settings.upload_retries)
+
     def load_img_into_labelbox(self, file_dir: Path, file_basename: str) -> Optional[DataRow]:
         """
-        Upload an image with 2 attachement in Labelbox
+        Upload an image with 2 attachement in Labelbox.
+        Every data row of the dataset is listed for each image, so use upload_queue to upload many images.
 
         :param file_dir: The directory where the images are stored
         :param file_basename: The base name of the image to upload
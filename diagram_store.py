@@ -0,0 +1,292 @@
+import gzip
+import json
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+
+from loaders import load_interpolated_csv
+
+# File signature and header: signature, offset of the index (little-endian unsigned 64 bits)
+STORE_SIGNATURE = b'QDSDSTR1'
+HEADER_FORMAT = '<8sQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Alignment of each diagram in the file (bytes), to keep memory-mapped arrays aligned
+BLOCK_ALIGNMENT = 64
+# The store is compacted when the space of replaced diagrams and old indexes is more than this part of the file
+COMPACT_RATIO = 0.5
+# The number of diagrams added before the index is written, the index is also written when the store is closed
+INDEX_INTERVAL = 256
+
+
+def diagram_key(pixel_size: float, single_dot: bool, research_group: str, diagram_name: str) -> str:
+    """
+    Build the key of a diagram in the store, with the same structure as the interpolated_csv folders.
+
+    :param pixel_size: The pixel size of the interpolated diagram, in volt
+    :param single_dot: If true this is a single dot diagram, if false a double dot diagram
+    :param research_group: The name of the research group that provided the diagram
+    :param diagram_name: The name of the diagram, without extension
+    :return: The key as 'pixel_size/single|double/research_group/diagram'
+    """
+    return f'{pixel_size * 1000}mV/{"single" if single_dot else "double"}/{research_group}/{diagram_name}'
+
+
+class DiagramStore:
+    """
+    Single file store of interpolated diagrams, with random access by key.
+
+    The file is made of a small header, the axes and the values of every diagram (aligned blocks) and a JSON index at
+    the end.
+    The index gives the position and the shape of the axes and the values of each diagram.
+    The values are memory-mapped when read, so reading a diagram or a sub-window of a diagram only touches the
+    required part of the file (no decompression and no parsing).
+
+    The new diagrams are appended after the current index, and the index is kept in memory until INDEX_INTERVAL
+    diagrams are added or the store is closed. Then the new index is appended and the header is updated last. So the
+    file is always readable with the previous index if the process stops during an update (the diagrams added since
+    the last index are lost). The replaced diagrams and the old indexes are dead space, removed by compact
+    (automatically when they exceed COMPACT_RATIO of the file).
+    Use the store as a context manager, or call close, to write the index of the last diagrams added.
+    """
+
+    def __init__(self, file_path: Union[str, Path], mode: str = 'r'):
+        """
+        Open a diagram store.
+
+        :param file_path: The path to the store file.
+        :param mode: 'r' to read an existing store, 'a' to read and add diagrams (the file is created if necessary).
+        """
+        if mode not in ('r', 'a'):
+            raise ValueError(f'Invalid store mode "{mode}", expected "r" or "a".')
+
+        self.file_path = Path(file_path)
+        self.mode = mode
+        # The number of diagrams added since the index was written
+        self._unsaved = 0
+
+        if mode == 'a' and not self.file_path.is_file():
+            # Create an empty store
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.file_path, 'wb') as file:
+                self._write_index(file, HEADER_SIZE, {})
+
+        self._read_index()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __enter__(self) -> 'DiagramStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def keys(self, prefix: str = '') -> List[str]:
+        """
+        :param prefix: Only return the keys starting with this prefix (e.g. '1.0mV/single/').
+        :return: The sorted list of diagram keys in the store.
+        """
+        return sorted(key for key in self._index if key.startswith(prefix))
+
+    def put(self, key: str, x, y, values) -> None:
+        """
+        Add a diagram to the store. If the key already exists, the previous diagram is replaced.
+
+        :param key: The key of the diagram (see diagram_key).
+        :param x: The x axis of the diagram (in volt).
+        :param y: The y axis of the diagram (in volt).
+        :param values: The 2D array of values.
+        """
+        if self.mode != 'a':
+            raise ValueError('The diagram store is open in read only mode.')
+
+        with open(self.file_path, 'r+b') as file:
+            # Append after the current index, which stays valid until the header is updated
+            file.seek(0, os.SEEK_END)
+            self._index[key] = self._write_block(file, x, y, values)
+
+        self._unsaved += 1
+        if self._unsaved >= INDEX_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the index of the diagrams added since the last index, then compact the store if there is too much dead
+        space.
+        """
+        if self._unsaved == 0:
+            return
+
+        with open(self.file_path, 'r+b') as file:
+            index_offset = file.seek(0, os.SEEK_END)
+            self._write_index(file, index_offset, self._index)
+
+        self._index_offset, self._unsaved = index_offset, 0
+        if self.dead_space > COMPACT_RATIO * self._index_offset:
+            self.compact()
+
+    def close(self) -> None:
+        """
+        Write the index of the last diagrams added, if any.
+        """
+        if self.mode == 'a':
+            self.flush()
+
+    @property
+    def dead_space(self) -> int:
+        """
+        :return: The number of bytes before the index that are not used by a diagram (replaced diagrams, old indexes
+         and alignment).
+        """
+        live = sum(8 * (entry['shape'][0] + entry['shape'][1]) +
+                   int(np.prod(entry['shape'])) * np.dtype(entry['dtype']).itemsize for entry in self._index.values())
+        return self._index_offset - HEADER_SIZE - live
+
+    def compact(self) -> None:
+        """
+        Rewrite the store without dead space, in a temporary file that replaces the store file once complete.
+        The stores open in other processes have to be opened again after this.
+        """
+        if self.mode != 'a':
+            raise ValueError('The diagram store is open in read only mode.')
+
+        temporary_path = self.file_path.with_name(f'{self.file_path.name}.tmp')
+        with open(temporary_path, 'wb') as file:
+            file.write(struct.pack(HEADER_FORMAT, STORE_SIGNATURE, 0))
+            index = {key: self._write_block(file, *self.get(key)) for key in self._index}
+            self._write_index(file, file.tell(), index)
+        os.replace(temporary_path, self.file_path)
+
+        self._read_index()
+        self._unsaved = 0
+
+    def _read_index(self) -> None:
+        """
+        Read the header and the index of the store file.
+        """
+        with open(self.file_path, 'rb') as file:
+            signature, self._index_offset = struct.unpack(HEADER_FORMAT, file.read(HEADER_SIZE))
+            if signature != STORE_SIGNATURE:
+                raise ValueError(f'The file "{self.file_path}" is not a diagram store.')
+            file.seek(self._index_offset)
+            # Ignore what follows the index (e.g. the end of an interrupted update), the index is ASCII JSON
+            self._index = json.JSONDecoder().raw_decode(file.read().decode('latin-1'))[0]
+
+    @staticmethod
+    def _write_block(file, x, y, values) -> dict:
+        """
+        Write the axes and the values of a diagram at the current position of the file, as aligned blocks.
+
+        :param file: The store file, open in binary write mode.
+        :param x: The x axis of the diagram (in volt).
+        :param y: The y axis of the diagram (in volt).
+        :param values: The 2D array of values.
+        :return: The index entry of the diagram.
+        """
+        values = np.ascontiguousarray(values)
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+        offsets = []
+        for array in (x, y, values):
+            offsets.append(-(-file.tell() // BLOCK_ALIGNMENT) * BLOCK_ALIGNMENT)
+            file.write(b'\0' * (offsets[-1] - file.tell()))
+            file.write(memoryview(array).cast('B'))
+
+        return {
+            'x_offset': offsets[0],
+            'y_offset': offsets[1],
+            'offset': offsets[2],
+            'shape': list(values.shape),
+            'dtype': values.dtype.str,
+            'step': float(x[1] - x[0]) if len(x) > 1 else None,
+        }
+
+    def get(self, key: str) -> Tuple:
+        """
+        Read a diagram from the store.
+
+        :param key: The key of the diagram (see diagram_key).
+        :return: The stability diagram data as a tuple: x, y, values (read-only memory-mapped array)
+        """
+        try:
+            entry = self._index[key]
+        except KeyError:
+            raise KeyError(f'Diagram "{key}" not found in the store "{self.file_path}".') from None
+
+        values = np.memmap(self.file_path, dtype=entry['dtype'], mode='r', offset=entry['offset'],
+                           shape=tuple(entry['shape']))
+
+        x = np.fromfile(self.file_path, dtype=np.float64, count=values.shape[1], offset=entry['x_offset'])
+        y = np.fromfile(self.file_path, dtype=np.float64, count=values.shape[0], offset=entry['y_offset'])
+
+        return x, y, values
+
+    def get_window(self, key: str, rows: slice, cols: slice) -> Tuple:
+        """
+        Read a sub-window of a diagram from the store. Only the corresponding part of the file is read.
+
+        :param key: The key of the diagram (see diagram_key).
+        :param rows: The slice of rows to read (y axis).
+        :param cols: The slice of columns to read (x axis).
+        :return: The sub-window data as a tuple: x, y, values
+        """
+        x, y, values = self.get(key)
+        return x[cols], y[rows], values[rows, cols]
+
+    @staticmethod
+    def _write_index(file, index_offset: int, index: dict) -> None:
+        """
+        Write the index, flush it to the disk, then update the header to point to it.
+
+        :param file: The store file, open in binary write mode.
+        :param index_offset: The position of the index in the file.
+        :param index: The index to write.
+        """
+        file.seek(index_offset)
+        file.write(json.dumps(index).encode())
+        file.flush()
+        os.fsync(file.fileno())
+        file.seek(0)
+        file.write(struct.pack(HEADER_FORMAT, STORE_SIGNATURE, index_offset))
+
+
+def pack_zip(zip_path: Path, store_path: Path) -> int:
+    """
+    Pack every interpolated diagram of an interpolated_csv zip file into a diagram store.
+
+    :param zip_path: The path to the zip file, with the structure 'pixel_size/single|double/research_group/diagram'.
+    :param store_path: The path to the store file (created or updated).
+    :return: The number of diagrams added to the store.
+    """
+    count = 0
+    with DiagramStore(store_path, 'a') as store, zipfile.ZipFile(zip_path) as zip_file:
+        for member in zip_file.namelist():
+            member_path = Path(member)
+            if member.endswith('/') or member_path.suffix not in ('.gz', '.csv', '.npy'):
+                continue
+
+            with zip_file.open(member, 'r') as diagram_file:
+                x, y, values = load_interpolated_csv(gzip.open(diagram_file) if member_path.suffix == '.gz'
+                                                     else diagram_file)
+
+            store.put(member_path.with_suffix('').as_posix(), x, y, values)
+            count += 1
+
+    return count
+
+
+if __name__ == '__main__':
+    from settings import settings
+
+    count = pack_zip(Path(settings.data_dir, 'interpolated_csv.zip'), Path(settings.data_dir, 'interpolated_store.bin'))
+    print(f'{count} diagram(s) packed')
@@ -0,0 +1,17 @@
+import hashlib
+from pathlib import Path
+
+
+def file_hash(file_path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 hash of a file, reading it by blocks.
+
+    :param file_path: The path to the file.
+    :param block_size: The size of the blocks to read, in bytes.
+    :return: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while block := file.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,120 @@
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas
+
+
+class GriddedDiagram(NamedTuple):
+    """
+    A raw diagram measured as a rectilinear sweep: 2 axes and a 2D array of values, instead of x, y, z columns.
+    It takes 3 times less memory than the columns and the grid doesn't have to be detected again for the interpolation.
+    The axes are sorted in ascending order (see from_axes), and the original direction of each axis is kept in the
+    metadata to flatten the grid in the order of the sweep file.
+    """
+    # The x axis (sweep) as an array (cols,) and the y axis (step) as an array (rows,), in volt
+    x: np.ndarray
+    y: np.ndarray
+    # The measured values as an array (rows, cols), indexed as [y, x]
+    values: np.ndarray
+    # Information about the measurement (e.g. channel names)
+    metadata: dict = {}
+
+    @classmethod
+    def from_axes(cls, x, y, values, metadata: dict = None) -> 'GriddedDiagram':
+        """
+        Create a gridded diagram, with the axes sorted in ascending order (the sweeps can be measured in both
+        directions). A descending axis is recorded in the metadata ('x_descending' or 'y_descending'), so to_columns
+        gives the points in the original order.
+
+        :param x: The x axis, monotonic.
+        :param y: The y axis, monotonic.
+        :param values: The measured values, indexed as [y, x].
+        :param metadata: Information about the measurement.
+        :return: The gridded diagram.
+        """
+        x, y, values = np.asarray(x), np.asarray(y), np.asarray(values)
+        if values.shape != (len(y), len(x)):
+            raise ValueError(f'The shape of the values {values.shape} does not match the axes ({len(y)}, {len(x)}).')
+
+        metadata = dict(metadata or {})
+        if len(x) > 1 and x[0] > x[-1]:
+            x, values = x[::-1], values[:, ::-1]
+            metadata['x_descending'] = True
+        if len(y) > 1 and y[0] > y[-1]:
+            y, values = y[::-1], values[::-1, :]
+            metadata['y_descending'] = True
+
+        return cls(x, y, values, metadata)
+
+    @property
+    def size(self) -> int:
+        """
+        :return: The number of measured points.
+        """
+        return self.values.size
+
+    def select_rows(self, rows: np.ndarray) -> 'GriddedDiagram':
+        """
+        :param rows: The boolean mask of the rows (y values) to keep.
+        :return: The gridded diagram restricted to these rows.
+        """
+        return self._replace(y=self.y[rows], values=self.values[rows])
+
+    def to_columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Flatten the grid as x, y, z columns, row by row, with the original direction of the axes (same order as the
+        sweep files).
+
+        :return: The columns x, y, z.
+        """
+        x, y, values = self.x, self.y, self.values
+        if self.metadata.get('x_descending'):
+            x, values = x[::-1], values[:, ::-1]
+        if self.metadata.get('y_descending'):
+            y, values = y[::-1], values[::-1, :]
+        return np.tile(x, len(y)), y.repeat(len(x)), values.reshape(-1)
+
+    def to_dataframe(self) -> 'pandas.DataFrame':
+        """
+        :return: The diagram as a pandas dataframe, with columns x, y, z (for the code that needs scattered points).
+        """
+        # Import here to keep this module light
+        import pandas
+
+        x, y, z = self.to_columns()
+        return pandas.DataFrame({'x': x, 'y': y, 'z': z}, copy=False)
+
+    def save(self, file_path: Path) -> None:
+        """
+        Save the gridded diagram as a NPZ file (not compressed).
+
+        :param file_path: The path where to save the file.
+        """
+        np.savez(file_path, x_axis=self.x, y_axis=self.y, values=self.values,
+                 metadata=np.array(json.dumps(self.metadata)))
+
+    @classmethod
+    def load(cls, file_path: Union[str, Path], dtype: str = None) -> 'GriddedDiagram':
+        """
+        Load a gridded diagram saved as a NPZ file.
+
+        :param file_path: The path to the NPZ file.
+        :param dtype: The type of the values once loaded ('float32' or 'float64'), the same as the file if None.
+        :return: The gridded diagram.
+        """
+        with np.load(file_path) as grid_file:
+            values = grid_file['values'] if dtype is None else grid_file['values'].astype(dtype, copy=False)
+            return cls(grid_file['x_axis'], grid_file['y_axis'], values, json.loads(str(grid_file['metadata'])))
+
+    @staticmethod
+    def is_gridded_file(file_path: Union[str, Path]) -> bool:
+        """
+        :param file_path: The path to a raw NPZ file.
+        :return: True if the file contains a gridded diagram, False if it contains x, y, z columns.
+        """
+        with np.load(file_path) as raw_file:
+            return 'values' in raw_file.files
@@ -0,0 +1,169 @@
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Union
+
+# The fields of every stage record, the other fields are counts specific to the stage
+RECORD_FIELDS = ('diagram', 'stage', 'wall_time', 'cpu_time', 'peak_rss')
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the peak resident memory (high water mark) of the current process.
+    Only supported on Linux, no effect on other systems.
+    """
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    """
+    :return: The peak resident memory of the current process since the last reset (see reset_peak_rss), in bytes.
+     On systems without /proc, the peak since the process start.
+    """
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024  # Value in kB
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return 0
+
+    # Value in bytes on macOS, in kB on other systems
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageTimer:
+    """
+    Record the wall time, the CPU time, the peak resident memory and some counts (e.g. number of points) of each
+    processing stage of each diagram.
+    The records of several processes can be merged, then saved as JSON and CSV files with a summary by stage.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        :param enabled: If False, the stages are not measured (no overhead) and nothing is recorded.
+        """
+        self.enabled = enabled
+        self.records: List[Dict[str, Union[str, float, int]]] = []
+
+    @contextmanager
+    def stage(self, diagram: str, stage: str, **counts) -> Iterator[Dict[str, int]]:
+        """
+        Measure a processing stage, as a context manager.
+        The stages should not be nested, because the peak memory is reset at the beginning of each stage.
+
+        :param diagram: The name of the diagram processed.
+        :param stage: The name of the stage (e.g. 'load', 'interpolate').
+        :param counts: Some counts known at the beginning of the stage (e.g. raw_points=10_000).
+        :return: A dictionary of counts that can be completed during the stage, added to the record.
+        """
+        counts = dict(counts)
+        if not self.enabled:
+            yield counts
+            return
+
+        reset_peak_rss()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            self.records.append({
+                'diagram': diagram,
+                'stage': stage,
+                'wall_time': time.perf_counter() - start_wall,
+                'cpu_time': time.process_time() - start_cpu,
+                'peak_rss': peak_rss(),
+                **counts,
+            })
+
+    def extend(self, records: Iterable[Dict[str, Union[str, float, int]]]) -> None:
+        """
+        Add the records of another timer, for example from a worker process.
+
+        :param records: The records to add.
+        """
+        if self.enabled:
+            self.records.extend(records)
+
+    def max_peak_rss(self) -> int:
+        """
+        :return: The largest peak memory of the recorded stages, in bytes (0 if nothing is recorded).
+        """
+        return max((record['peak_rss'] for record in self.records), default=0)
+
+    def summary(self) -> List[Dict[str, Union[str, float, int]]]:
+        """
+        Aggregate the records by stage, in the order of the first record of each stage.
+
+        :return: For each stage: the number of records, the total and the maximal wall time (with the diagram of the
+         maximum), the total CPU time, the maximal peak memory and the sum of every count.
+        """
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'wall_time': 0.,
+                                                        'max_wall_time': -1., 'slowest_diagram': '', 'cpu_time': 0.,
+                                                        'peak_rss': 0})
+            stage['calls'] += 1
+            stage['wall_time'] += record['wall_time']
+            stage['cpu_time'] += record['cpu_time']
+            stage['peak_rss'] = max(stage['peak_rss'], record['peak_rss'])
+            if record['wall_time'] > stage['max_wall_time']:
+                stage['max_wall_time'] = record['wall_time']
+                stage['slowest_diagram'] = record['diagram']
+
+            for name, value in record.items():
+                if name not in RECORD_FIELDS:
+                    stage[name] = stage.get(name, 0) + value
+
+        return list(stages.values())
+
+    def summary_table(self) -> str:
+        """
+        :return: The summary by stage as a human readable table.
+        """
+        summary = self.summary()
+        width = max([len(stage['stage']) for stage in summary] + [len('Stage')]) + 2
+        lines = [f'{"Stage":<{width}}{"Calls":>8}{"Wall (s)":>12}{"CPU (s)":>12}{"Max (s)":>10}{"Peak (MB)":>11}  '
+                 f'Slowest diagram']
+        for stage in summary:
+            lines.append(f'{stage["stage"]:<{width}}{stage["calls"]:>8}{stage["wall_time"]:>12.3f}'
+                         f'{stage["cpu_time"]:>12.3f}{stage["max_wall_time"]:>10.3f}{stage["peak_rss"] / 1e6:>11.0f}  '
+                         f'{stage["slowest_diagram"]}')
+        return '\n'.join(lines)
+
+    def save(self, out_dir: Path, name: str) -> None:
+        """
+        Save the records and the summary as JSON ('name.json') and the records as CSV ('name.csv'), then print the
+        summary table. Nothing is done if the timer is disabled.
+
+        :param out_dir: The directory where to save the files.
+        :param name: The name of the files, without extension.
+        """
+        if not self.enabled:
+            return
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with open(out_dir / f'{name}.json', 'w') as json_file:
+            json.dump({'summary': self.summary(), 'records': self.records}, json_file, indent=1)
+
+        # The count columns depend on the stages
+        columns = list(RECORD_FIELDS) + sorted({key for record in self.records for key in record} - set(RECORD_FIELDS))
+        with open(out_dir / f'{name}.csv', 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+        print(self.summary_table())
+        print(f'Stage measurements saved in {out_dir / name}.json and .csv')
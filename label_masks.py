@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Tuple, Union
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Polygon
+
+# The code of each charge region class in the masks (0 means no label)
+REGION_CLASSES = ['0_electron', '1_electron', '2_electrons', '3_electrons', '4+_electrons']
+# Maximal value of the line distance (pixels), larger distances are saturated
+MAX_LINE_DISTANCE = 255
+
+
+def pixel_centers(x, y) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the coordinates of the pixel centers of an interpolated diagram, with the orientation of the values array
+    (first row is the top of the image, so the largest y value).
+
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :return: The x coordinates as a row vector (1, cols) and the y coordinates as a column vector (rows, 1)
+    """
+    return np.asarray(x)[np.newaxis, :], np.asarray(y)[::-1, np.newaxis]
+
+
+def charge_mask(charge_regions: Iterable[Tuple[str, Polygon]], x, y) -> np.ndarray:
+    """
+    Rasterize the charge regions on the grid of an interpolated diagram.
+    A pixel belongs to a region if its center is inside the polygon or on its border.
+
+    :param charge_regions: The regions annotation, as (label, shapely.geometry.Polygon) in volt
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :return: The class code of each pixel as a uint8 array (see REGION_CLASSES), 0 for pixels without label
+    """
+    x_centers, y_centers = pixel_centers(x, y)
+    mask = np.zeros((len(y), len(x)), dtype=np.uint8)
+
+    for label, polygon in charge_regions:
+        if label not in REGION_CLASSES:
+            raise ValueError(f'Unknown charge region label "{label}".')
+
+        # Only test the pixels inside the bounding box of the polygon
+        x_min, y_min, x_max, y_max = polygon.bounds
+        cols = slice(np.searchsorted(x_centers[0], x_min), np.searchsorted(x_centers[0], x_max, side='right'))
+        rows = slice(len(y) - np.searchsorted(y, y_max, side='right'), len(y) - np.searchsorted(y, y_min))
+
+        inside = shapely.intersects_xy(polygon, x_centers[:, cols], y_centers[rows, :])
+        mask[rows, cols][inside] = REGION_CLASSES.index(label) + 1
+
+    return mask
+
+
+def line_distance(transition_lines: Iterable[LineString], x, y,
+                  max_distance: float = MAX_LINE_DISTANCE) -> np.ndarray:
+    """
+    Compute the distance between each pixel center and the nearest transition line.
+    Each segment only updates the pixels inside its bounding box extended by the maximal distance, so the cost depends
+    on the length of the lines instead of the size of the diagram.
+
+    :param transition_lines: The transition line annotations, as shapely.geometry.LineString in volt
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :param max_distance: The maximal distance computed (in pixels), the pixels farther from every line are infinite
+    :return: The distance in pixels as a float32 array
+    """
+    x_centers, y_centers = pixel_centers(x, y)
+    step = x[1] - x[0]
+    margin = max_distance * step
+    squared_distance = np.full((len(y), len(x)), np.inf, dtype=np.float32)
+
+    for line in transition_lines:
+        coords = np.asarray(line.coords)
+        for (start_x, start_y), (end_x, end_y) in zip(coords[:-1], coords[1:]):
+            # Only the pixels inside the bounding box of the segment, extended by the margin
+            cols = slice(np.searchsorted(x_centers[0], min(start_x, end_x) - margin),
+                         np.searchsorted(x_centers[0], max(start_x, end_x) + margin, side='right'))
+            rows = slice(len(y) - np.searchsorted(y, max(start_y, end_y) + margin, side='right'),
+                         len(y) - np.searchsorted(y, min(start_y, end_y) - margin))
+            window_x, window_y = x_centers[:, cols], y_centers[rows, :]
+            if window_x.size == 0 or window_y.size == 0:
+                continue
+
+            # Projection of each pixel center on the segment, clipped to the segment ends
+            delta_x, delta_y = end_x - start_x, end_y - start_y
+            length = delta_x ** 2 + delta_y ** 2
+            t = ((window_x - start_x) * delta_x + (window_y - start_y) * delta_y) / length if length > 0 else 0
+            t = np.clip(t, 0, 1)
+            window_distance = squared_distance[rows, cols]
+            np.minimum(window_distance,
+                       (window_x - start_x - t * delta_x) ** 2 + (window_y - start_y - t * delta_y) ** 2,
+                       out=window_distance, casting='unsafe')
+
+    return np.sqrt(squared_distance) / np.float32(step)
+
+
+def lines_masks(transition_lines: Iterable[LineString], x, y) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rasterize the transition lines on the grid of an interpolated diagram.
+
+    :param transition_lines: The transition line annotations, as shapely.geometry.LineString in volt
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :return: The line bitmask (1 if a line is within half a pixel of the pixel center) and the distance to the nearest
+     line (in pixels, rounded and saturated to MAX_LINE_DISTANCE), both as uint8 arrays
+    """
+    distance = line_distance(transition_lines, x, y)
+    line_mask = (distance <= 0.5).astype(np.uint8)
+    return line_mask, np.minimum(np.rint(distance), MAX_LINE_DISTANCE).astype(np.uint8)
+
+
+def save_label_masks(file_path: Path, charge_regions: Iterable[Tuple[str, Polygon]],
+                     transition_lines: Iterable[LineString], x, y) -> None:
+    """
+    Rasterize the labels of a diagram and save the masks as a compressed numpy file.
+
+    :param file_path: The path where to save the masks (NPZ file)
+    :param charge_regions: The regions annotation, as (label, shapely.geometry.Polygon) in volt
+    :param transition_lines: The transition line annotations, as shapely.geometry.LineString in volt
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    """
+    # Create directories if necessary
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    line_mask, distance = lines_masks(transition_lines, x, y)
+    np.savez_compressed(file_path, charge=charge_mask(charge_regions, x, y), line_mask=line_mask,
+                        line_distance=distance, region_classes=np.array(REGION_CLASSES))
+
+
+def load_label_masks(file_path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Load the label masks of a diagram.
+
+    :param file_path: The path to the masks (NPZ file)
+    :return: The masks as a dictionary: 'charge', 'line_mask', 'line_distance' and 'region_classes'
+    """
+    with np.load(file_path) as masks:
+        return dict(masks)
+
+
+def diagram_label_masks(diagram: Tuple[str, Callable[[], Tuple]], labels_path: Path, out_dir: Path) -> bool:
+    """
+    Rasterize and save the label masks of one diagram.
+    Can run in a worker process.
+
+    :param diagram: The diagram name and the function to load it, as returned by iter_interpolated_diagrams.
+    :param labels_path: The path to the Labelbox export.
+    :param out_dir: The directory where to save the masks of this diagram folder.
+    :return: True if the masks are saved, False if the diagram has no label.
+    """
+    # Import here to avoid circular import
+    from process_annotations import charge_polygons, open_labels_cache, transition_linestrings
+
+    file_basename, load_diagram = diagram
+    labels = open_labels_cache(labels_path)
+    if file_basename not in labels:
+        return False
+
+    x, y, _ = load_diagram()
+    current_labels = labels.get(file_basename)
+
+    transition_lines = transition_linestrings(current_labels.line_vertices, current_labels.line_indices, x, y)
+    charge_regions = charge_polygons(current_labels.area_vertices, current_labels.area_indices,
+                                     current_labels.area_labels, x, y)
+
+    save_label_masks(out_dir / f'{file_basename}.npz', charge_regions, transition_lines, x, y)
+    return True
+
+
+def main():
+    """
+    Save the label masks of every diagram found (all pixel sizes, dot types and research groups) in
+    'out_dir/label_masks', with the same structure as the diagram store keys.
+    """
+    # Import here to avoid circular import
+    from diagram_store import diagram_key
+    from labels_cache import LabelsCache
+    from process_annotations import iter_interpolated_diagrams, list_interpolated_folders
+    from settings import settings
+
+    data_dir = Path(settings.data_dir)
+    out_dir = Path(settings.out_dir, 'label_masks')
+    labels_path = data_dir / 'labels.json'
+
+    # Compile the cache once, before starting the workers
+    print(f'{len(LabelsCache(labels_path))} labeled diagrams found')
+
+    count = 0
+    with ProcessPoolExecutor(max_workers=settings.workers) if settings.workers > 1 else nullcontext() as executor:
+        for pixel_size, single_dot, research_group in list_interpolated_folders(data_dir):
+            folder = diagram_key(pixel_size, single_dot, research_group, '').rstrip('/')
+            diagrams = list(iter_interpolated_diagrams(pixel_size, single_dot, research_group, data_dir))
+            save_masks = partial(diagram_label_masks, labels_path=labels_path, out_dir=out_dir / folder)
+
+            # Lazy evaluation in the main process, or parallel evaluation in the worker pool
+            results = executor.map(save_masks, diagrams, chunksize=8) if executor else map(save_masks, diagrams)
+
+            saved = sum(results)
+            print(f'{folder}: {saved} label masks saved, {len(diagrams) - saved} diagram(s) without label')
+            count += saved
+
+    print(f'{count} label masks saved in {out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from file_utils import file_hash
+
+# Change this version to invalidate every existing cache if the structure changes
+CACHE_VERSION = 2
+# The extension of the labeled images, the External ID of a diagram in the export is its name with this extension
+IMAGE_SUFFIX = '.png'
+
+
+class DiagramLabels(NamedTuple):
+    """
+    The labels of one diagram, as arrays of pixel coordinates (before volt conversion).
+    """
+    # The vertices of every transition line as an array (N, 2), and the index of the line of each vertex (N,)
+    line_vertices: np.ndarray
+    line_indices: np.ndarray
+    # The vertices of every charge area polygon as an array (M, 2), and the index of the area of each vertex (M,)
+    area_vertices: np.ndarray
+    area_indices: np.ndarray
+    # The label of each charge area (e.g. '1_electron')
+    area_labels: List[str]
+
+
+def objects_vertices(objects: Iterable, geometry_key: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gather the vertices of several label objects in a single array.
+
+    :param objects: List of label as json object (from Labelbox export)
+    :param geometry_key: The key of the list of vertices in the objects ('polygon' or 'line')
+    :return: The vertices coordinates as an array (N, 2) and the index of the object of each vertex as an array (N,)
+    """
+    objects = list(objects)
+    vertices = np.array([(p['x'], p['y']) for obj in objects for p in obj[geometry_key]], dtype=float).reshape(-1, 2)
+    indices = np.repeat(np.arange(len(objects)), [len(obj[geometry_key]) for obj in objects])
+    return vertices, indices
+
+
+def split_labels(objects: Iterable) -> Tuple[List, List]:
+    """
+    Split the label objects of a diagram between transition lines and charge areas.
+
+    :param objects: List of label as json object (from Labelbox export)
+    :return: The list of transition lines and the list of charge areas
+    """
+    lines, areas = [], []
+    for obj in objects:
+        (lines if obj['title'] == 'line' else areas).append(obj)
+    return lines, areas
+
+
+class LabelsCache:
+    """
+    Indexed cache of the Labelbox export (labels.json), stored as a SQLite database.
+    The export is compiled once, then the labels of one diagram are read without loading or parsing the whole export.
+    The cache is compiled again if the export file changed (modification time and size, then content hash).
+    The labels are stored by exact External ID, and a diagram name matches the External ID '<name>.png'.
+    """
+
+    def __init__(self, labels_path: Union[str, Path], cache_path: Optional[Union[str, Path]] = None):
+        """
+        Open the cache of a Labelbox export, and compile it if it is missing or outdated.
+
+        :param labels_path: The path to the Labelbox export (JSON file).
+        :param cache_path: The path to the cache file. By default, next to the export with the '.sqlite' extension.
+        """
+        self.labels_path = Path(labels_path)
+        self.cache_path = Path(cache_path) if cache_path else self.labels_path.with_suffix('.sqlite')
+
+        self._connection = sqlite3.connect(self.cache_path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS source '
+                                 '(version INTEGER, size INTEGER, mtime_ns INTEGER, sha256 TEXT)')
+
+        if not self._is_valid():
+            self.compile()
+
+        self._classes = dict(self._connection.execute('SELECT code, name FROM classes'))
+
+    def __contains__(self, name: str) -> bool:
+        return self._connection.execute('SELECT 1 FROM diagrams WHERE external_id = ?',
+                                        (name + IMAGE_SUFFIX,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM diagrams').fetchone()[0]
+
+    def names(self) -> List[str]:
+        """
+        :return: The sorted list of labeled diagram names (without extension).
+        """
+        rows = self._connection.execute('SELECT external_id FROM diagrams WHERE external_id GLOB ? '
+                                        'ORDER BY external_id', (f'*{IMAGE_SUFFIX}',))
+        return [external_id[:-len(IMAGE_SUFFIX)] for external_id, in rows]
+
+    def get(self, name: str) -> DiagramLabels:
+        """
+        Read the labels of one diagram.
+
+        :param name: The name of the diagram, without extension.
+        :return: The labels of the diagram as arrays.
+        """
+        row = self._connection.execute('SELECT line_vertices, line_indices, area_vertices, area_indices, area_classes '
+                                       'FROM diagrams WHERE external_id = ?', (name + IMAGE_SUFFIX,)).fetchone()
+        if row is None:
+            raise KeyError(f'No label found for "{name}" in "{self.labels_path}".')
+
+        line_vertices, line_indices, area_vertices, area_indices, area_classes = row
+        return DiagramLabels(np.frombuffer(line_vertices, dtype=np.float64).reshape(-1, 2),
+                             np.frombuffer(line_indices, dtype=np.int32),
+                             np.frombuffer(area_vertices, dtype=np.float64).reshape(-1, 2),
+                             np.frombuffer(area_indices, dtype=np.int32),
+                             [self._classes[code] for code in np.frombuffer(area_classes, dtype=np.uint16)])
+
+    def compile(self) -> None:
+        """
+        Compile the Labelbox export into the cache (replace the previous content).
+        """
+        print(f'Compiling labels cache of "{self.labels_path}"')
+        stat = self.labels_path.stat()
+        with open(self.labels_path, 'r') as annotations_file:
+            labels_json = json.load(annotations_file)
+
+        classes = {}
+        rows = []
+        for obj in labels_json:
+            lines, areas = split_labels(obj['Label']['objects'])
+            line_vertices, line_indices = objects_vertices(lines, 'line')
+            area_vertices, area_indices = objects_vertices(areas, 'polygon')
+            area_classes = [classes.setdefault(area['value'], len(classes)) for area in areas]
+
+            # Exact External ID, the stem would merge the names with dots or the other extensions
+            rows.append((obj['External ID'],
+                         line_vertices.tobytes(), line_indices.astype(np.int32).tobytes(),
+                         area_vertices.tobytes(), area_indices.astype(np.int32).tobytes(),
+                         np.array(area_classes, dtype=np.uint16).tobytes()))
+
+        if len(classes) > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f'Too many charge area classes in "{self.labels_path}" ({len(classes)}).')
+
+        with self._connection:
+            self._connection.execute('DROP TABLE IF EXISTS diagrams')
+            self._connection.execute('DROP TABLE IF EXISTS classes')
+            self._connection.execute('CREATE TABLE diagrams (external_id TEXT PRIMARY KEY, line_vertices BLOB, '
+                                     'line_indices BLOB, area_vertices BLOB, area_indices BLOB, area_classes BLOB)')
+            self._connection.execute('CREATE TABLE classes (code INTEGER PRIMARY KEY, name TEXT)')
+            self._connection.executemany('INSERT OR REPLACE INTO diagrams VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._connection.executemany('INSERT INTO classes VALUES (?, ?)',
+                                         [(code, name) for name, code in classes.items()])
+            self._connection.execute('DELETE FROM source')
+            self._connection.execute('INSERT INTO source VALUES (?, ?, ?, ?)',
+                                     (CACHE_VERSION, stat.st_size, stat.st_mtime_ns, file_hash(self.labels_path)))
+
+        print(f'{len(rows)} labeled diagrams compiled')
+
+    def _is_valid(self) -> bool:
+        """
+        Check if the cache matches the current Labelbox export.
+        If only the modification time changed, the content hash is compared and the time is updated.
+
+        :return: True if the cache is up-to-date.
+        """
+        source = self._connection.execute('SELECT version, size, mtime_ns, sha256 FROM source').fetchone()
+        if source is None or source[0] != CACHE_VERSION:
+            return False
+
+        _, size, mtime_ns, sha256 = source
+        stat = self.labels_path.stat()
+        if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+            return True
+
+        if stat.st_size == size and file_hash(self.labels_path) == sha256:
+            with self._connection:
+                self._connection.execute('UPDATE source SET mtime_ns = ?', (stat.st_mtime_ns,))
+            return True
+
+        return False
@@ -0,0 +1,284 @@
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Iterator, Tuple, Union
+
+import numpy as np
+
+from gridded_diagram import GriddedDiagram
+
+if TYPE_CHECKING:
+    import pandas
+
+# The file extensions of the raw diagrams: text (CSV) or binary (NPZ with x, y, z columns)
+RAW_SUFFIXES = ('.csv', '.npz')
+
+
+def count_lines(file_path: Path, block_size: int = 1 << 20) -> int:
+    """
+    Count the number of lines of a text file, reading it by blocks.
+
+    :param file_path: The path to the file.
+    :param block_size: The size of the blocks to read, in bytes.
+    :return: The number of lines, including the last one if it doesn't end with a new line.
+    """
+    count = 0
+    last_block = b''
+    with open(file_path, 'rb') as file:
+        while block := file.read(block_size):
+            count += block.count(b'\n')
+            last_block = block
+
+    if last_block and not last_block.endswith(b'\n'):
+        count += 1
+    return count
+
+
+def iter_raw_chunks(file_path: Path, chunk_size: int, dtype: str) -> Iterator[Tuple[np.ndarray, ...]]:
+    """
+    Read a raw CSV file (columns x, y, z) by chunks of rows.
+    Use the pyarrow streaming CSV reader if it is installed, otherwise the pandas C parser.
+
+    :param file_path: The path to the raw CSV file.
+    :param chunk_size: The approximate number of rows by chunk.
+    :param dtype: The type of the values ('float32' or 'float64').
+    :return: An iterator of chunks as x, y, z arrays.
+    """
+    column_types = {'x': dtype, 'y': dtype, 'z': dtype}
+
+    try:
+        from pyarrow import csv as pyarrow_csv
+    except ImportError:
+        import pandas
+
+        for chunk in pandas.read_csv(file_path, dtype=column_types, chunksize=chunk_size, engine='c'):
+            yield chunk.x.to_numpy(), chunk.y.to_numpy(), chunk.z.to_numpy()
+        return
+
+    # The block size is in bytes, with about 64 bytes by row of text
+    reader = pyarrow_csv.open_csv(file_path,
+                                  read_options=pyarrow_csv.ReadOptions(block_size=chunk_size * 64),
+                                  convert_options=pyarrow_csv.ConvertOptions(column_types=column_types))
+    for batch in reader:
+        yield (batch.column('x').to_numpy(zero_copy_only=False),
+               batch.column('y').to_numpy(zero_copy_only=False),
+               batch.column('z').to_numpy(zero_copy_only=False))
+
+
+def load_raw_csv(file_path: Path, chunk_size: int = 1_000_000,
+                 dtype: str = 'float64') -> Tuple['pandas.DataFrame', dict]:
+    """
+    Load a raw CSV file (columns x, y, z) by chunks, into pre-allocated arrays.
+    The memory used is bounded to one copy of the diagram plus one chunk, and the statistics are computed on the fly.
+
+    :param file_path: The path to the raw CSV file.
+    :param chunk_size: The number of rows parsed at once.
+    :param dtype: The type of the values ('float32' or 'float64').
+    :return: The diagram as a pandas dataframe (with columns x, y, z) and its statistics (number of points, min and max
+     of each column, 1st and 99th percentiles of z).
+    """
+    # Import here to keep this module light, pandas is only required for the raw files
+    import pandas
+
+    # The first line is the header
+    nb_rows = count_lines(file_path) - 1
+    columns = {name: np.empty(nb_rows, dtype=dtype) for name in ('x', 'y', 'z')}
+    statistics = {'points': 0}
+
+    position = 0
+    for chunk in iter_raw_chunks(file_path, chunk_size, dtype):
+        chunk_length = len(chunk[0])
+        for name, values in zip(('x', 'y', 'z'), chunk):
+            columns[name][position:position + chunk_length] = values
+            if chunk_length > 0:
+                statistics[f'{name}_min'] = min(statistics.get(f'{name}_min', np.inf), float(np.min(values)))
+                statistics[f'{name}_max'] = max(statistics.get(f'{name}_max', -np.inf), float(np.max(values)))
+        position += chunk_length
+
+    statistics['points'] = position
+    # Exact percentiles require every value, compute both in one partition pass
+    if position > 0:
+        statistics['z_p1'], statistics['z_p99'] = (float(p) for p in np.percentile(columns['z'][:position], [1, 99]))
+
+    # Blank lines are skipped, so some pre-allocated rows can be unused (views, no copy)
+    diagram = pandas.DataFrame({name: values[:position] for name, values in columns.items()}, copy=False)
+    return diagram, statistics
+
+
+def load_raw_npz(file_path: Path, dtype: str = 'float64') -> Tuple[Union['pandas.DataFrame', GriddedDiagram], dict]:
+    """
+    Load a raw binary file (NPZ with columns x, y, z, or a gridded diagram), with the same statistics as load_raw_csv.
+
+    :param file_path: The path to the raw NPZ file.
+    :param dtype: The type of the values ('float32' or 'float64').
+    :return: The diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram if the file contains a
+     grid, and its statistics (number of points, min and max of each column, 1st and 99th percentiles of z).
+    """
+    # Import here to keep this module light, pandas is only required for the raw files
+    import pandas
+
+    if GriddedDiagram.is_gridded_file(file_path):
+        diagram = GriddedDiagram.load(file_path, dtype)
+    else:
+        with np.load(file_path) as raw_file:
+            columns = {name: raw_file[name].astype(dtype, copy=False) for name in ('x', 'y', 'z')}
+        diagram = pandas.DataFrame(columns, copy=False)
+
+    return diagram, raw_statistics(diagram)
+
+
+def raw_statistics(diagram: Union['pandas.DataFrame', GriddedDiagram]) -> dict:
+    """
+    Compute the statistics of a raw diagram already loaded, the same as load_raw_csv.
+
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+    :return: The number of points, min and max of each column, 1st and 99th percentiles of z.
+    """
+    if isinstance(diagram, GriddedDiagram):
+        columns = {'x': diagram.x, 'y': diagram.y, 'z': diagram.values}
+    else:
+        columns = {name: diagram[name].to_numpy() for name in ('x', 'y', 'z')}
+
+    statistics = {'points': columns['z'].size}
+    if statistics['points'] > 0:
+        for name, values in columns.items():
+            statistics[f'{name}_min'], statistics[f'{name}_max'] = float(np.min(values)), float(np.max(values))
+        statistics['z_p1'], statistics['z_p99'] = (float(p) for p in np.percentile(columns['z'], [1, 99]))
+
+    return statistics
+
+
+def load_raw(file_path: Path, chunk_size: int = 1_000_000,
+             dtype: str = 'float64') -> Tuple[Union['pandas.DataFrame', GriddedDiagram], dict]:
+    """
+    Load a raw diagram file, with the file format defined by the extension (CSV or NPZ).
+
+    :param file_path: The path to the raw file.
+    :param chunk_size: The number of rows parsed at once, for CSV files.
+    :param dtype: The type of the values ('float32' or 'float64').
+    :return: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram, and its statistics (see
+     load_raw_csv).
+    """
+    if file_path.suffix == '.npz':
+        return load_raw_npz(file_path, dtype)
+    return load_raw_csv(file_path, chunk_size, dtype)
+
+
+def save_raw(file_path: Path, diagram: Union['pandas.DataFrame', GriddedDiagram]) -> None:
+    """
+    Save a raw diagram with the file format defined by the extension (CSV or NPZ).
+    The NPZ file is not compressed, so it is read at disk speed and without text parsing.
+    A gridded diagram is saved as a grid in NPZ files, and as x, y, z columns in CSV files.
+
+    :param file_path: The path where to save the file.
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+    """
+    # Create directories if necessary
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if isinstance(diagram, GriddedDiagram):
+        if file_path.suffix == '.npz':
+            diagram.save(file_path)
+        else:
+            diagram.to_dataframe().to_csv(file_path, index=False)
+    elif file_path.suffix == '.npz':
+        np.savez(file_path, x=diagram['x'].to_numpy(), y=diagram['y'].to_numpy(), z=diagram['z'].to_numpy())
+    else:
+        diagram.to_csv(file_path, index=False)
+
+
+def save_interpolated_csv(file_path: Path, values, x, y, pixel_size: float) -> None:
+    """
+    Save interpolated data as a CSV file.
+
+    :param file_path: The path where to save the CSV. The extension define the file format (GZ or CSV)
+    :param values: The list of voltage values as a numpy array
+    :param x: The x coordinates of the pixels (post interpolation), used in information row
+    :param y: The y coordinates of the pixels (post interpolation), used in information row
+    :param pixel_size: The size of pixels, in voltage, used in information row
+    """
+    # Create directories if necessary
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    compact_diagram = np.insert(values, 0, [x[0][0], y[0][0], pixel_size] + [0] * (len(x[0]) - 3), 0)
+    np.savetxt(file_path, compact_diagram, delimiter=',', fmt='%.6g',
+               header='First row: x start (V), y start (V), step (V) / Second row to end: values (V)')
+
+
+def save_interpolated_npy(file_path: Path, values, x, y, pixel_size: float) -> None:
+    """
+    Save interpolated data as a binary numpy file, without rounding.
+    The array has the same layout as the CSV file, so it can be memory-mapped and the values sliced without copy.
+
+    :param file_path: The path where to save the NPY file
+    :param values: The list of voltage values as a numpy array
+    :param x: The x coordinates of the pixels (post interpolation), used in information row
+    :param y: The y coordinates of the pixels (post interpolation), used in information row
+    :param pixel_size: The size of pixels, in voltage, used in information row
+    """
+    # Create directories if necessary
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    compact_diagram = np.insert(values, 0, [x[0][0], y[0][0], pixel_size] + [0] * (len(x[0]) - 3), 0)
+    np.save(file_path, compact_diagram)
+
+
+def save_interpolated(file_path: Path, values, x, y, pixel_size: float) -> None:
+    """
+    Save interpolated data with the file format defined by the extension (GZ, CSV or NPY).
+
+    :param file_path: The path where to save the file
+    :param values: The list of voltage values as a numpy array
+    :param x: The x coordinates of the pixels (post interpolation), used in information row
+    :param y: The y coordinates of the pixels (post interpolation), used in information row
+    :param pixel_size: The size of pixels, in voltage, used in information row
+    """
+    if file_path.suffix == '.npy':
+        save_interpolated_npy(file_path, values, x, y, pixel_size)
+    else:
+        save_interpolated_csv(file_path, values, x, y, pixel_size)
+
+
+def is_npy(file_path: Union[IO, str, Path]) -> bool:
+    """
+    Detect if an interpolated diagram file is a binary numpy file or a CSV file.
+
+    :param file_path: The path to the file or the byte stream.
+    :return: True if this is a numpy file.
+    """
+    if isinstance(file_path, (str, Path)):
+        return Path(file_path).suffix == '.npy'
+
+    if not file_path.seekable():
+        return False
+
+    # Check the magic string at the beginning of the stream, then go back to the initial position
+    position = file_path.tell()
+    magic = file_path.read(len(np.lib.format.MAGIC_PREFIX))
+    file_path.seek(position)
+    return magic == np.lib.format.MAGIC_PREFIX
+
+
+def load_interpolated_csv(file_path: Union[IO, str, Path]) -> Tuple:
+    """
+    Load the stability diagrams from CSV file or NPY file (detected automatically).
+    If the path of a NPY file is given, the values are memory-mapped (read-only) instead of loaded.
+
+    :param file_path: The path to the CSV / NPY file or the byte stream.
+    :return: The stability diagram data as a tuple: x, y, values
+    """
+    if is_npy(file_path):
+        compact_diagram = np.load(file_path, mmap_mode='r' if isinstance(file_path, (str, Path)) else None)
+    else:
+        compact_diagram = np.loadtxt(file_path, delimiter=',')
+
+    # Extract information
+    x_start, y_start, step = (float(v) for v in compact_diagram[0][:3])
+
+    # Remove the information row (view, no copy)
+    values = compact_diagram[1:]
+
+    # Reconstruct the axes
+
+    x = np.arange(values.shape[1]) * step + x_start
+    y = np.arange(values.shape[0]) * step + y_start
+
+    return x, y, values
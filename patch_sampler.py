@@ -0,0 +1,254 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from diagram_store import DiagramStore
+from label_masks import REGION_CLASSES, load_label_masks
+
+# Change this version to invalidate every existing index if the structure changes
+INDEX_VERSION = 1
+
+
+class PatchIndex(NamedTuple):
+    """
+    The positions of every valid patch of a set of interpolated diagrams, for a patch size and a stride.
+    A patch is valid if it is inside the diagram and all its values are finite.
+    """
+    # The store keys of the diagrams, the patches refer to them by position in this list
+    keys: List[str]
+    # The size of the patches (square), in pixels
+    patch_size: int
+    # The step between 2 patches of the same diagram, in pixels
+    stride: int
+    # The diagram (position in keys), the row and the column of the top left corner of each patch
+    diagram: np.ndarray
+    row: np.ndarray
+    col: np.ndarray
+    # The number of transition line pixels in each patch, None if the index is built without labels
+    line_pixels: Optional[np.ndarray] = None
+    # The charge classes present in each patch as a bitmask (bit 0 for the pixels without label, then bit i + 1 for
+    # REGION_CLASSES[i]), None if the index is built without labels
+    charge_classes: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.diagram)
+
+    @property
+    def has_labels(self) -> bool:
+        return self.line_pixels is not None
+
+    def save(self, file_path: Union[str, Path]) -> None:
+        """
+        Save the index as a compressed numpy file.
+
+        :param file_path: The path where to save the index (NPZ file).
+        """
+        file_path = Path(file_path)
+        # Create directories if necessary
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        labels = {'line_pixels': self.line_pixels, 'charge_classes': self.charge_classes} if self.has_labels else {}
+        np.savez_compressed(file_path, version=INDEX_VERSION, keys=np.array(self.keys, dtype=str),
+                            patch_size=self.patch_size, stride=self.stride, diagram=self.diagram, row=self.row,
+                            col=self.col, **labels)
+
+    @classmethod
+    def load(cls, file_path: Union[str, Path]) -> 'PatchIndex':
+        """
+        Load an index saved with save.
+
+        :param file_path: The path to the index (NPZ file).
+        :return: The patch index.
+        """
+        with np.load(file_path) as index:
+            if int(index['version']) != INDEX_VERSION:
+                raise ValueError(f'The patch index "{file_path}" has an old version, it has to be built again.')
+            return cls(index['keys'].tolist(), int(index['patch_size']), int(index['stride']), index['diagram'],
+                       index['row'], index['col'], index.get('line_pixels'), index.get('charge_classes'))
+
+
+class PatchBatch(NamedTuple):
+    """
+    A batch of patches, with their position and their label summary.
+    """
+    # The values of the patches as an array (batch size, patch size, patch size)
+    values: np.ndarray
+    # The position of the patches in the index
+    index: np.ndarray
+    # The diagram (position in the index keys), the row and the column of each patch
+    diagram: np.ndarray
+    row: np.ndarray
+    col: np.ndarray
+    # The label summary of each patch (see PatchIndex), None if the index is built without labels
+    line_pixels: Optional[np.ndarray] = None
+    charge_classes: Optional[np.ndarray] = None
+
+
+def window_sums(mask: np.ndarray, patch_size: int, stride: int) -> np.ndarray:
+    """
+    Sum the values of every patch of a 2D array, with a summed-area table (constant time by patch).
+
+    :param mask: The 2D array to sum (e.g. a boolean mask).
+    :param patch_size: The size of the patches (square), in pixels.
+    :param stride: The step between 2 patches, in pixels.
+    :return: The sum of each patch as an array (patch rows, patch columns), for the patches starting at every stride.
+    """
+    rows, cols = mask.shape
+    integral = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int64), axis=1, out=integral[1:, 1:])
+
+    top, left = np.arange(0, rows - patch_size + 1, stride), np.arange(0, cols - patch_size + 1, stride)
+    bottom, right = top + patch_size, left + patch_size
+    return (integral[np.ix_(bottom, right)] - integral[np.ix_(top, right)] - integral[np.ix_(bottom, left)]
+            + integral[np.ix_(top, left)])
+
+
+def build_patch_index(store: DiagramStore, patch_size: int, stride: int, prefix: str = '',
+                      masks_dir: Optional[Path] = None) -> PatchIndex:
+    """
+    Find every valid patch of the diagrams of a store.
+    Each diagram is read once, the validity and the label summaries of the patches are computed with summed-area
+    tables.
+
+    :param store: The store of interpolated diagrams.
+    :param patch_size: The size of the patches (square), in pixels.
+    :param stride: The step between 2 patches of the same diagram, in pixels.
+    :param prefix: Only index the diagrams with a key starting with this prefix (e.g. '1.0mV/single/').
+    :param masks_dir: The directory of the label masks (see label_masks.py), with the same structure as the store
+     keys. If set, only the labeled diagrams are indexed, with the label summary of each patch.
+    :return: The patch index.
+    """
+    keys = []
+    diagrams, rows, cols, line_pixels, charge_classes = [], [], [], [], []
+
+    for key in store.keys(prefix):
+        masks = None
+        if masks_dir is not None:
+            masks_file = masks_dir / f'{key}.npz'
+            if not masks_file.is_file():
+                continue
+            masks = load_label_masks(masks_file)
+
+        _, _, values = store.get(key)
+        if masks is not None and masks['charge'].shape != values.shape:
+            # The masks are built from the diagrams of the data directory (see label_masks.py)
+            raise ValueError(f'The label masks "{masks_file}" {masks["charge"].shape} do not match the diagram "{key}" '
+                             f'of the store {values.shape}, build the masks again from the same diagrams.')
+        if values.shape[0] < patch_size or values.shape[1] < patch_size:
+            continue
+
+        # A patch is valid if every value is finite (e.g. no value outside the convex hull of the raw points)
+        valid = window_sums(~np.isfinite(values), patch_size, stride) == 0
+        patch_rows, patch_cols = np.nonzero(valid)
+        if len(patch_rows) == 0:
+            continue
+
+        diagrams.append(np.full(len(patch_rows), len(keys), dtype=np.uint32))
+        rows.append((patch_rows * stride).astype(np.uint32))
+        cols.append((patch_cols * stride).astype(np.uint32))
+        keys.append(key)
+
+        if masks is not None:
+            line_pixels.append(window_sums(masks['line_mask'], patch_size, stride)[valid].astype(np.uint32))
+            classes = np.zeros(len(patch_rows), dtype=np.uint8)
+            for code in range(len(REGION_CLASSES) + 1):
+                present = window_sums(masks['charge'] == code, patch_size, stride)[valid] > 0
+                classes[present] |= np.uint8(1 << code)
+            charge_classes.append(classes)
+
+    def concatenate(arrays: List[np.ndarray], dtype) -> np.ndarray:
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+    labels = (concatenate(line_pixels, np.uint32), concatenate(charge_classes, np.uint8)) if masks_dir else (None, None)
+    return PatchIndex(keys, patch_size, stride, concatenate(diagrams, np.uint32), concatenate(rows, np.uint32),
+                      concatenate(cols, np.uint32), *labels)
+
+
+class PatchSampler:
+    """
+    Serve batches of patches from the interpolated diagrams of a store, with the positions of a patch index.
+    The diagrams are memory-mapped, so only the windows of the requested patches are read from the file.
+    """
+
+    def __init__(self, store: DiagramStore, index: PatchIndex, dtype: str = 'float32'):
+        """
+        :param store: The store of interpolated diagrams, the one used to build the index.
+        :param index: The patch index.
+        :param dtype: The type of the patch values.
+        """
+        self.store = store
+        self.index = index
+        self.dtype = dtype
+        # The memory-mapped values of each diagram, opened at the first patch requested
+        self._values: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _diagram_values(self, diagram: int) -> np.ndarray:
+        if diagram not in self._values:
+            self._values[diagram] = self.store.get(self.index.keys[diagram])[2]
+        return self._values[diagram]
+
+    def batch(self, positions: Sequence[int]) -> PatchBatch:
+        """
+        Read a batch of patches.
+        The patches are read by diagram and by row, to read the file in order, then returned in the requested order.
+
+        :param positions: The position of the patches in the index.
+        :return: The batch of patches.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        diagram, row, col = self.index.diagram[positions], self.index.row[positions], self.index.col[positions]
+        size = self.index.patch_size
+
+        values = np.empty((len(positions), size, size), dtype=self.dtype)
+        for i in np.lexsort((col, row, diagram)):
+            values[i] = self._diagram_values(int(diagram[i]))[row[i]:row[i] + size, col[i]:col[i] + size]
+
+        labels = (self.index.line_pixels[positions], self.index.charge_classes[positions]) if self.index.has_labels \
+            else (None, None)
+        return PatchBatch(values, positions, diagram, row, col, *labels)
+
+    def sequential_batches(self, batch_size: int) -> Iterator[PatchBatch]:
+        """
+        Iterate over every patch in the index order (diagram by diagram).
+
+        :param batch_size: The number of patches by batch, the last batch can be smaller.
+        :return: An iterator of batches.
+        """
+        for start in range(0, len(self.index), batch_size):
+            yield self.batch(np.arange(start, min(start + batch_size, len(self.index))))
+
+    def random_batches(self, batch_size: int, seed: Optional[int] = None, drop_last: bool = False) -> \
+            Iterator[PatchBatch]:
+        """
+        Iterate over every patch in a random order (one epoch).
+
+        :param batch_size: The number of patches by batch.
+        :param seed: The seed of the random order, for reproducible epochs.
+        :param drop_last: If True, the last batch is skipped if it is smaller than batch_size.
+        :return: An iterator of batches.
+        """
+        order = np.random.default_rng(seed).permutation(len(self.index))
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            if drop_last and len(positions) < batch_size:
+                return
+            yield self.batch(positions)
+
+
+if __name__ == '__main__':
+    from settings import settings
+
+    out_dir = Path(settings.out_dir)
+    pixel_size_dir = f'{settings.pixel_size * 1000}mV'
+    masks_dir = Path(out_dir, 'label_masks')
+
+    patch_index = build_patch_index(DiagramStore(Path(out_dir, 'interpolated_store.bin')), settings.patch_size,
+                                    settings.patch_stride, prefix=f'{pixel_size_dir}/',
+                                    masks_dir=masks_dir if masks_dir.is_dir() else None)
+    index_file = Path(out_dir, 'patch_index', f'{pixel_size_dir}_{settings.patch_size}px_{settings.patch_stride}.npz')
+    patch_index.save(index_file)
+    print(f'{len(patch_index):,} patches of {len(patch_index.keys)} diagram(s) indexed in {index_file}')
@@ -0,0 +1,191 @@
+import struct
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Number of colors in the colormap lookup tables (same as matplotlib)
+LUT_SIZE = 256
+# Index of the color used for not finite values, at the end of the lookup tables
+BAD_INDEX = LUT_SIZE
+# Number of image rows colored, filtered and compressed at once when encoding, to bound the memory used
+FILTER_BLOCK_ROWS = 256
+
+
+@lru_cache
+def colormap_lut(cmap_name: str) -> np.ndarray:
+    """
+    Get the lookup table of a matplotlib colormap, computed once by colormap.
+    Only the colormap registry is used, so no plotting backend is loaded.
+
+    :param cmap_name: The name of the matplotlib colormap (e.g. 'Greys').
+    :return: The RGBA colors as an array (LUT_SIZE + 1, 4) of uint8, the last one is the color of not finite values.
+    """
+    from matplotlib import colormaps
+
+    cmap = colormaps[cmap_name].resampled(LUT_SIZE)
+    return np.vstack((cmap(np.arange(LUT_SIZE), bytes=True), cmap(np.nan, bytes=True)))
+
+
+def colorize(values: np.ndarray, cmap_name: str, overwrite_values: bool = False) -> np.ndarray:
+    """
+    Map values to RGBA colors, with the same normalization as matplotlib.pyplot.imsave (linear between the min and the
+    max value). Not finite values are transparent.
+
+    :param values: The 2D array of values.
+    :param cmap_name: The name of the matplotlib colormap.
+    :param overwrite_values: If True, the values are normalized in place (see lut_index).
+    :return: The RGBA image as an array (rows, cols, 4) of uint8.
+    """
+    return colormap_lut(cmap_name)[lut_index(values, overwrite_values=overwrite_values)]
+
+
+def lut_index(values: np.ndarray, out: Optional[np.ndarray] = None, overwrite_values: bool = False) -> np.ndarray:
+    """
+    Normalize values to colormap indexes, with the same rounding as matplotlib. Not finite values are set to BAD_INDEX.
+    The values are normalized with their own type, so float32 values take half the memory of float64 values.
+
+    :param values: The 2D array of values.
+    :param out: Optional int16 array to store the result.
+    :param overwrite_values: If True and the values are floating point numbers, they are normalized in place instead
+     of in a temporary array. The values are then destroyed.
+    :return: The colormap indexes as an int16 array.
+    """
+    finite = np.isfinite(values)
+    all_finite = finite.all()
+    vmin = float(np.min(values) if all_finite else np.min(values, where=finite, initial=np.inf))
+    vmax = float(np.max(values) if all_finite else np.max(values, where=finite, initial=-np.inf))
+
+    if out is None:
+        out = np.empty(values.shape, dtype=np.int16)
+
+    if vmin == vmax:
+        out.fill(0)
+    else:
+        in_place = overwrite_values and np.issubdtype(values.dtype, np.floating)
+        scaled = np.subtract(values, vmin, out=values if in_place else None)
+        scaled /= vmax - vmin
+        scaled *= LUT_SIZE
+        # The max value is not out of range
+        np.clip(scaled, 0, LUT_SIZE - 1, out=scaled)
+        if not all_finite:
+            scaled[~finite] = 0  # Replaced after the cast
+        out[...] = scaled
+
+    if not all_finite:
+        out[~finite] = BAD_INDEX
+
+    return out
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """
+    Build a PNG chunk (length, type, data, CRC).
+
+    :param chunk_type: The 4 letters type of the chunk.
+    :param data: The content of the chunk.
+    :return: The chunk as bytes.
+    """
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def filter_scanlines(pixels: np.ndarray, previous_row: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Apply the PNG filter that should compress the best to each scanline, among None, Sub and Up.
+    The filter is chosen with the usual heuristic: the minimal sum of the absolute differences (as signed bytes).
+
+    :param pixels: The image rows as an array (rows, cols * 4) of uint8.
+    :param previous_row: The image row before these rows, for the Up filter. None for the first rows of the image.
+    :return: The filter type of each row and the filtered rows.
+    """
+    # Sub: difference with the previous pixel on the same row
+    sub = pixels.copy()
+    np.subtract(pixels[:, 4:], pixels[:, :-4], out=sub[:, 4:])
+    # Up: difference with the pixel of the previous row
+    up = pixels.copy()
+    np.subtract(pixels[1:], pixels[:-1], out=up[1:])
+    if previous_row is not None:
+        np.subtract(pixels[0], previous_row, out=up[0])
+
+    candidates = np.stack((pixels, sub, up))
+    cost = np.abs(candidates.view(np.int8), dtype=np.int32).sum(axis=2)
+    filter_types = np.argmin(cost, axis=0)
+
+    return filter_types.astype(np.uint8), candidates[filter_types, np.arange(len(pixels))]
+
+
+def compress_scanlines(blocks: Iterable[np.ndarray], compress_level: int = 6) -> bytes:
+    """
+    Filter and compress the rows of an image, block by block, so the whole filtered image is never in memory.
+    The compressed data is the same as compressing all the filtered rows at once.
+
+    :param blocks: The consecutive blocks of rows of the image, as arrays (rows, cols, 4) of uint8.
+    :param compress_level: The zlib compression level (0 to 9).
+    :return: The compressed scanlines, content of the IDAT chunk.
+    """
+    compressor = zlib.compressobj(compress_level)
+    data = []
+    previous_row = None
+    for block in blocks:
+        rows = block.reshape(len(block), -1)
+        filter_types, filtered = filter_scanlines(rows, previous_row)
+        # Each scanline starts with the filter type
+        data.append(compressor.compress(np.column_stack((filter_types, filtered))))
+        previous_row = rows[-1]
+    data.append(compressor.flush())
+    return b''.join(data)
+
+
+def png_file(rows: int, cols: int, compressed_scanlines: bytes, metadata: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    Build a RGBA PNG file (8 bits by channel).
+
+    :param rows: The height of the image.
+    :param cols: The width of the image.
+    :param compressed_scanlines: The compressed scanlines (see compress_scanlines).
+    :param metadata: Text information saved in the file.
+    :return: The PNG file content.
+    """
+    chunks = [png_chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, 6, 0, 0, 0))]  # 8 bits RGBA
+    for key, value in (metadata or {}).items():
+        chunks.append(png_chunk(b'tEXt', key.encode('latin-1') + b'\0' + str(value).encode('latin-1')))
+    chunks.append(png_chunk(b'IDAT', compressed_scanlines))
+    chunks.append(png_chunk(b'IEND', b''))
+
+    return PNG_SIGNATURE + b''.join(chunks)
+
+
+def encode_png(rgba: np.ndarray, metadata: Optional[Dict[str, str]] = None, compress_level: int = 6) -> bytes:
+    """
+    Encode a RGBA image as PNG, without any image library.
+
+    :param rgba: The image as an array (rows, cols, 4) of uint8.
+    :param metadata: Text information saved in the file.
+    :param compress_level: The zlib compression level (0 to 9).
+    :return: The PNG file content.
+    """
+    rows, cols, _ = rgba.shape
+    blocks = (rgba[start:start + FILTER_BLOCK_ROWS] for start in range(0, rows, FILTER_BLOCK_ROWS))
+    return png_file(rows, cols, compress_scanlines(blocks, compress_level), metadata)
+
+
+def save_png(file_path: Path, values: np.ndarray, cmap_name: str, metadata: Optional[Dict[str, str]] = None,
+             overwrite_values: bool = False) -> None:
+    """
+    Save a 2D array as a PNG image with a colormap, like matplotlib.pyplot.imsave but without plotting backend.
+    The values are normalized once to colormap indexes, then the colors are only built block by block for the encoding.
+
+    :param file_path: The path of the image.
+    :param values: The 2D array of values.
+    :param cmap_name: The name of the matplotlib colormap.
+    :param metadata: Text information saved in the file.
+    :param overwrite_values: If True, the values are normalized in place (see lut_index).
+    """
+    lut = colormap_lut(cmap_name)
+    indexes = lut_index(values, overwrite_values=overwrite_values)
+    rows, cols = indexes.shape
+    blocks = (lut[indexes[start:start + FILTER_BLOCK_ROWS]] for start in range(0, rows, FILTER_BLOCK_ROWS))
+    Path(file_path).write_bytes(png_file(rows, cols, compress_scanlines(blocks), metadata))
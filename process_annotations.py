@@ -1,13 +1,21 @@
 import gzip
 import json
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
+import shapely
 from shapely.geometry import LineString, Polygon
 
-from plots import plot_image
-from raw_to_images import load_interpolated_csv
+from diagram_store import DiagramStore, diagram_key
+from instrumentation import StageTimer
+from labels_cache import LabelsCache, objects_vertices
+from loaders import load_interpolated_csv
+from settings import settings
 
 DATA_DIR = Path('data')
 PIXEL_SIZE = 0.0010  # Volt
@@ -15,17 +23,12 @@ SINGLE_DOT = True  # If false take double dot
 RESEARCH_GROUP = 'michel_pioro_ladriere'  # 'louis_gaudreau' or 'michel_pioro_ladriere'
 
 
-def clip(n, smallest, largest):
-    """ Shortcut to clip a value between 2 others """
-    return max(smallest, min(n, largest))
-
-
 def coord_to_volt(coord: Iterable[float], min_coord: int, max_coord: int, value_start: float, value_step: float,
-                  snap: int = 1, is_y: bool = False) -> List[float]:
+                  snap: int = 1, is_y: bool = False) -> np.ndarray:
     """
     Convert some coordinates to volt value for a specific stability diagram.
 
-    :param coord: The list coordinates to convert
+    :param coord: The list coordinates to convert (as a numpy array to avoid a conversion)
     :param min_coord: The minimal valid value for the coordinate (before volt conversion)
     :param max_coord: The maximal valid value for the coordinate (before volt conversion)
     :param value_start: The voltage value of the 0 coordinate
@@ -33,19 +36,37 @@ def coord_to_volt(coord: Iterable[float], min_coord: int, max_coord: int, value_
     :param snap: The snap margin, every points near to image border at this distance will be rounded to the image border
     (in number of pixels)
     :param is_y: If true this is the y axis (to apply a rotation)
-    :return: The list of coordinates as gate voltage values
+    :return: The array of coordinates as gate voltage values
     """
+    coord = coord if isinstance(coord, np.ndarray) else np.fromiter(coord, dtype=float)
+
     if is_y:
         # Flip Y axis (I don't know why it's required)
-        coord = list(map(lambda t: max_coord - t, coord))
+        coord = max_coord - coord
 
     # Snap to border to avoid errors
-    coord = list(map(lambda t: clip(t, min_coord, max_coord), coord))
+    coord = np.clip(coord, min_coord, max_coord)
 
     # Convert coordinates to actual voltage value
-    coord = list(map(lambda t: t * value_step + value_start, coord))
+    return coord * value_step + value_start
+
+
+def vertices_to_volt(vertices: np.ndarray, x, y, snap: int = 1) -> np.ndarray:
+    """
+    Convert the pixel coordinates of vertices to volt values for a specific stability diagram.
+
+    :param vertices: The vertices coordinates as an array (N, 2)
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :param snap: The snap margin, every points near to image border at this distance will be rounded to the image border
+    (in number of pixels)
+    :return: The vertices coordinates in volt as an array (N, 2)
+    """
+    # Step (should be the same for every measurement)
+    step = x[1] - x[0]
 
-    return coord
+    return np.column_stack((coord_to_volt(vertices[:, 0], 0, len(x) - 1, x[0], step, snap),
+                            coord_to_volt(vertices[:, 1], 0, len(y) - 1, y[0], step, snap, True)))
 
 
 def load_charge_annotations(charge_areas: Iterable, x, y, snap: int = 1) -> List[Tuple[str, Polygon]]:
@@ -59,22 +80,38 @@ def load_charge_annotations(charge_areas: Iterable, x, y, snap: int = 1) -> List
     (in number of pixels)
     :return: The list of regions annotation for the image, as (label, shapely.geometry.Polygon)
     """
+    charge_areas = list(charge_areas)
+    vertices, indices = objects_vertices(charge_areas, 'polygon')
+    return charge_polygons(vertices, indices, [area['value'] for area in charge_areas], x, y, snap)
 
-    # Define borders for snap
-    min_x, max_x = 0, len(x) - 1
-    min_y, max_y = 0, len(y) - 1
-    # Step (should be the same for every measurement)
-    step = x[1] - x[0]
 
-    processed_areas = []
-    for area in charge_areas:
-        area_x = coord_to_volt((p['x'] for p in area['polygon']), min_x, max_x, x[0], step, snap)
-        area_y = coord_to_volt((p['y'] for p in area['polygon']), min_y, max_y, y[0], step, snap, True)
+def charge_polygons(vertices: np.ndarray, indices: np.ndarray, area_labels: List[str], x, y,
+                    snap: int = 1) -> List[Tuple[str, Polygon]]:
+    """
+    Build the regions annotation of an image from the vertices of every area.
 
-        area_obj = Polygon(zip(area_x, area_y))
-        processed_areas.append((area['value'], area_obj))
+    :param vertices: The vertices coordinates of every area, in pixel, as an array (N, 2)
+    :param indices: The index of the area of each vertex, as an array (N,)
+    :param area_labels: The label of each area
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :param snap: The snap margin, every points near to image border at this distance will be rounded to the image border
+    (in number of pixels)
+    :return: The list of regions annotation for the image, as (label, shapely.geometry.Polygon)
+    """
+    # Skip the degenerate areas (less than 3 vertices), and number the other areas without gap to keep their labels
+    valid = np.bincount(indices, minlength=len(area_labels)) >= 3
+    area_labels = [label for label, is_valid in zip(area_labels, valid) if is_valid]
+    if len(area_labels) == 0:
+        return []
+
+    vertices_mask = valid[indices]
+    indices = (np.cumsum(valid) - 1)[indices[vertices_mask]]
 
-    return processed_areas
+    # Convert every vertex of every area at once
+    areas = shapely.polygons(shapely.linearrings(vertices_to_volt(vertices[vertices_mask], x, y, snap),
+                                                 indices=indices))
+    return list(zip(area_labels, areas))
 
 
 def load_lines_annotations(lines: Iterable, x, y, snap: int = 1) -> List[LineString]:
@@ -88,35 +125,133 @@ def load_lines_annotations(lines: Iterable, x, y, snap: int = 1) -> List[LineStr
     (in number of pixels)
     :return: The list of line annotation for the image, as shapely.geometry.LineString
     """
+    return transition_linestrings(*objects_vertices(lines, 'line'), x, y, snap)
 
-    # Define borders for snap
-    min_x, max_x = 0, len(x) - 1
-    min_y, max_y = 0, len(y) - 1
-    # Step (should be the same for every measurement)
-    step = x[1] - x[0]
 
-    processed_lines = []
-    for line in lines:
-        line_x = coord_to_volt((p['x'] for p in line['line']), min_x, max_x, x[0], step, snap)
-        line_y = coord_to_volt((p['y'] for p in line['line']), min_y, max_y, y[0], step, snap, True)
+def transition_linestrings(vertices: np.ndarray, indices: np.ndarray, x, y, snap: int = 1) -> List[LineString]:
+    """
+    Build the transition line annotations of an image from the vertices of every line.
 
-        line_obj = LineString(zip(line_x, line_y))
-        processed_lines.append(line_obj)
+    :param vertices: The vertices coordinates of every line, in pixel, as an array (N, 2)
+    :param indices: The index of the line of each vertex, as an array (N,)
+    :param x: The x axis of the diagram (in volt)
+    :param y: The y axis of the diagram (in volt)
+    :param snap: The snap margin, every points near to image border at this distance will be rounded to the image border
+    (in number of pixels)
+    :return: The list of line annotation for the image, as shapely.geometry.LineString
+    """
+    if len(vertices) == 0:
+        return []
 
-    return processed_lines
+    # Convert every vertex of every line at once
+    return list(shapely.linestrings(vertices_to_volt(vertices, x, y, snap), indices=indices))
 
 
-def main():
-    # Open the json file that contains annotations for every diagrams
-    with open(Path(DATA_DIR, 'labels.json'), 'r') as annotations_file:
-        labels_json = json.load(annotations_file)
+@lru_cache
+def open_zip(zip_path: Path) -> zipfile.ZipFile:
+    """
+    Open a zip file once by process, to avoid reading the zip directory for every diagram.
+
+    :param zip_path: The path to the zip file.
+    :return: The open zip file.
+    """
+    return zipfile.ZipFile(zip_path)
+
+
+@lru_cache
+def open_store(store_path: Path) -> DiagramStore:
+    """
+    Open a diagram store once by process, to avoid reading the index for every diagram.
+
+    :param store_path: The path to the store file.
+    :return: The diagram store, in read only mode.
+    """
+    return DiagramStore(store_path)
+
+
+@lru_cache
+def open_labels_cache(labels_path: Path) -> LabelsCache:
+    """
+    Open the labels cache once by process (a SQLite connection can't be shared between processes).
+
+    :param labels_path: The path to the Labelbox export.
+    :return: The labels cache.
+    """
+    return LabelsCache(labels_path)
+
+
+def load_zip_diagram(zip_path: Path, member: str) -> Tuple:
+    """
+    Load an interpolated diagram from a zip file.
+
+    :param zip_path: The path to the zip file.
+    :param member: The path of the diagram in the zip file.
+    :return: The stability diagram data as a tuple: x, y, values
+    """
+    with open_zip(zip_path).open(member, 'r') as diagram_file:
+        # Load values from CSV or NPY file
+        return load_interpolated_csv(gzip.open(diagram_file) if member.endswith('.gz') else diagram_file)
+
+
+def load_store_diagram(store_path: Path, key: str) -> Tuple:
+    """
+    Load an interpolated diagram from a diagram store.
+
+    :param store_path: The path to the store file.
+    :param key: The key of the diagram in the store.
+    :return: The stability diagram data as a tuple: x, y, values
+    """
+    return open_store(store_path).get(key)
+
+
+def list_interpolated_folders(data_dir: Path = DATA_DIR) -> List[Tuple[float, bool, str]]:
+    """
+    List every folder of interpolated diagrams found in the diagram store and in the zip file.
+
+    :param data_dir: The directory that contains the store and / or the zip file.
+    :return: The sorted list of folders as (pixel size, single dot, research group)
+    """
+    folders = set()
+
+    store_path = Path(data_dir, 'interpolated_store.bin')
+    if store_path.is_file():
+        folders.update(tuple(key.split('/')[:3]) for key in DiagramStore(store_path))
+
+    zip_path = Path(data_dir, 'interpolated_csv.zip')
+    if zip_path.is_file():
+        with zipfile.ZipFile(zip_path) as zip_file:
+            folders.update(Path(name).parts[:3] for name in zip_file.namelist()
+                           if not name.endswith('/') and len(Path(name).parts) == 4)
+
+    # Folders are named as '1.0mV/single/research_group'
+    return sorted((float(size[:-2]) / 1000, dot == 'single', group) for size, dot, group in folders)
 
-    print(f'{len(labels_json)} labeled diagrams found')
-    labels = {obj['External ID']: obj for obj in labels_json}
+
+def iter_interpolated_diagrams(pixel_size: float, single_dot: bool, research_group: str,
+                               data_dir: Path = DATA_DIR) -> Iterator[Tuple[str, Callable[[], Tuple]]]:
+    """
+    Iterate over the interpolated diagrams of one folder.
+    Read them from the diagram store if it exists and contains this folder, otherwise from the zip file.
+
+    :param pixel_size: The pixel size of the interpolated diagrams, in volt
+    :param single_dot: If true take single dot diagrams, if false double dot diagrams
+    :param research_group: The name of the research group that provided the diagrams
+    :param data_dir: The directory that contains the store and / or the zip file.
+    :return: An iterator of (diagram name, function to load the diagram as a tuple x, y, values).
+     The functions can be sent to worker processes.
+    """
+    store_path = Path(data_dir, 'interpolated_store.bin')
+    if store_path.is_file():
+        prefix = diagram_key(pixel_size, single_dot, research_group, '')
+        keys = DiagramStore(store_path).keys(prefix)
+        if len(keys) > 0:
+            for key in keys:
+                yield key[len(prefix):], partial(load_store_diagram, store_path, key)
+            return
 
     # Open the zip file and iterate over all csv files
-    zip_path = Path(DATA_DIR, 'interpolated_csv.zip')
-    in_zip_path = Path(f'{PIXEL_SIZE * 1000}mV', 'single' if SINGLE_DOT else 'double', RESEARCH_GROUP)
+    zip_path = Path(data_dir, 'interpolated_csv.zip')
+    in_zip_path = Path(f'{pixel_size * 1000}mV', 'single' if single_dot else 'double', research_group)
     zip_dir = zipfile.Path(zip_path, str(in_zip_path) + '/')
 
     if not zip_dir.is_dir():
@@ -124,27 +259,137 @@ def main():
                          f'Check if pixel size and research group exist in this folder.')
 
     for diagram_name in zip_dir.iterdir():
-        file_basename = Path(str(diagram_name)).stem  # Remove extension
+        member = str(in_zip_path / diagram_name.name)
+        yield Path(member).stem, partial(load_zip_diagram, zip_path, member)  # Remove extension
+
+
+def convert_annotations(diagram: Tuple[str, Callable[[], Tuple]], labels_path: Path) -> Optional[dict]:
+    """
+    Convert the annotations of one diagram to volt coordinates.
+    Can run in a worker process.
+
+    :param diagram: The diagram name and the function to load it, as returned by iter_interpolated_diagrams.
+    :param labels_path: The path to the Labelbox export.
+    :return: The annotations as a dictionary: 'lines' (list of vertices) and 'regions' (list of label and vertices).
+     None if the diagram has no label.
+    """
+    file_basename, load_diagram = diagram
+    labels = open_labels_cache(labels_path)
+    if file_basename not in labels:
+        return None
+
+    x, y, _ = load_diagram()
+    current_labels = labels.get(file_basename)
+
+    transition_lines = transition_linestrings(current_labels.line_vertices, current_labels.line_indices, x, y,
+                                              snap=1)
+    charge_regions = charge_polygons(current_labels.area_vertices, current_labels.area_indices,
+                                     current_labels.area_labels, x, y, snap=1)
+
+    return {
+        'lines': [np.asarray(line.coords).tolist() for line in transition_lines],
+        'regions': [{'label': label, 'polygon': np.asarray(polygon.exterior.coords).tolist()}
+                    for label, polygon in charge_regions],
+    }
 
-        if f'{file_basename}.png' not in labels:
+
+def main():
+    # Import here to load matplotlib only if necessary
+    from plots import plot_image
+
+    # Compiled cache of the json file that contains annotations for every diagrams
+    labels = LabelsCache(Path(DATA_DIR, 'labels.json'))
+    print(f'{len(labels)} labeled diagrams found')
+
+    timer = StageTimer(settings.instrumentation)
+
+    for file_basename, load_diagram in iter_interpolated_diagrams(PIXEL_SIZE, SINGLE_DOT, RESEARCH_GROUP):
+        if file_basename not in labels:
             print(f'No label found for {file_basename}')
             continue
 
-        with diagram_name.open('r') as diagram_file:
-            # Load values from CSV file
-            x, y, values = load_interpolated_csv(gzip.open(diagram_file))
+        with timer.stage(file_basename, 'load') as counts:
+            x, y, values = load_diagram()
+            counts['pixels'] = values.size
 
-            current_labels = labels[f'{file_basename}.png']['Label']['objects']
+        with timer.stage(file_basename, 'convert') as counts:
+            current_labels = labels.get(file_basename)
 
             # Load annotation and convert the coordinates to volt
-            transition_lines = load_lines_annotations(filter(lambda l: l['title'] == 'line', current_labels), x, y,
+            transition_lines = transition_linestrings(current_labels.line_vertices, current_labels.line_indices, x, y,
                                                       snap=1)
-            charge_regions = load_charge_annotations(filter(lambda l: l['title'] != 'line', current_labels), x, y,
-                                                     snap=1)
+            charge_regions = charge_polygons(current_labels.area_vertices, current_labels.area_indices,
+                                             current_labels.area_labels, x, y, snap=1)
+            counts['lines'], counts['regions'] = len(transition_lines), len(charge_regions)
 
+        with timer.stage(file_basename, 'plot', pixels=values.size):
             plot_image(x, y, values, file_basename, 'nearest', x[1] - x[0], charge_regions, transition_lines)
 
+    timer.save(Path(settings.out_dir, 'instrumentation'), 'process_annotations')
+
+
+def batch():
+    """
+    Convert the annotations of every diagram found (all pixel sizes, dot types and research groups), without plots.
+    The annotations of each folder are saved as a JSON file in 'out_dir/annotations', with a summary of missing labels.
+    """
+    data_dir = Path(settings.data_dir)
+    out_dir = Path(settings.out_dir, 'annotations')
+    labels_path = data_dir / 'labels.json'
+
+    # Compile the cache once, before starting the workers
+    print(f'{len(LabelsCache(labels_path))} labeled diagrams found')
+
+    convert = partial(convert_annotations, labels_path=labels_path)
+    summary = {}
+    timer = StageTimer(settings.instrumentation)
+
+    with ProcessPoolExecutor(max_workers=settings.workers) if settings.workers > 1 else nullcontext() as executor:
+        for pixel_size, single_dot, research_group in list_interpolated_folders(data_dir):
+            folder = diagram_key(pixel_size, single_dot, research_group, '').rstrip('/')
+            diagrams = list(iter_interpolated_diagrams(pixel_size, single_dot, research_group, data_dir))
+
+            # Lazy evaluation in the main process, or parallel evaluation in the worker pool
+            results = executor.map(convert, diagrams, chunksize=8) if executor else map(convert, diagrams)
+
+            annotations = {}
+            missing = []
+            # Measured by folder, since the diagrams are converted in the workers
+            with timer.stage(folder, 'convert_folder', diagrams=len(diagrams)) as counts:
+                for (file_basename, _), result in zip(diagrams, results):
+                    if result is None:
+                        missing.append(file_basename)
+                    else:
+                        annotations[file_basename] = result
+                counts['labeled'] = len(annotations)
+
+            out_file = out_dir / f'{folder}.json'
+            out_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_file, 'w') as annotations_file:
+                json.dump(annotations, annotations_file)
+
+            summary[folder] = {
+                'diagrams': len(diagrams),
+                'labeled': len(annotations),
+                'lines': sum(len(a['lines']) for a in annotations.values()),
+                'regions': sum(len(a['regions']) for a in annotations.values()),
+                'missing_labels': missing,
+            }
+            print(f'{folder}: {len(annotations)} labeled diagram(s) converted, {len(missing)} without label')
+
+    with open(out_dir / 'summary.json', 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    print(f'{sum(s["labeled"] for s in summary.values())} labeled diagram(s) converted, '
+          f'{sum(len(s["missing_labels"]) for s in summary.values())} without label, '
+          f'from {len(summary)} folder(s)')
+
+    timer.save(Path(settings.out_dir, 'instrumentation'), 'process_annotations_batch')
+
 
 if __name__ == '__main__':
-    # Processing settings at the top of this file
-    main()
+    if settings.annotations_batch:
+        batch()
+    else:
+        # Processing settings at the top of this file
+        main()
@@ -1,58 +1,394 @@
 import gc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import IO, Tuple, Union
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas
-from scipy.interpolate import griddata
-
-from dataset_label import DatasetLabel
-from plots import plot_image, plot_raw
+from scipy.interpolate import CloughTocher2DInterpolator, LinearNDInterpolator, NearestNDInterpolator
+from scipy.spatial import Delaunay
+
+from build_manifest import BuildManifest, settings_hash
+from catalog import Catalog, diagram_store_name
+from diagram_store import DiagramStore
+from file_utils import file_hash
+from gridded_diagram import GriddedDiagram
+from instrumentation import StageTimer, peak_rss, reset_peak_rss
+from labels_cache import LabelsCache
+# The loaders are imported from here by older scripts
+from loaders import (RAW_SUFFIXES, count_lines, is_npy, iter_raw_chunks, load_interpolated_csv, load_raw, load_raw_csv,
+                     save_interpolated, save_interpolated_csv, save_interpolated_npy)
+from png_encoder import save_png
 from settings import settings
+from spatial_index import RawPointsIndex, point_spacing, raw_index_file, window_diagram
+
+# Change this version to rebuild every output if the processing changes
+PIPELINE_VERSION = 1
 
-DATA_DIR = Path(settings.data_dir)
-OUT_DIR = Path(settings.out_dir)
+# Interpolation methods for which filtering the extreme values before or after the interpolation is equivalent
+FILTER_COMMUTATIVE_METHODS = {'nearest'}
 
 
-def image_interpolation(diagram, step=0.001, method='nearest', filter_extreme=False) -> Tuple:
+def regular_grid(diagram) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Detect if the points of a diagram form a rectilinear sweep grid, with every x value measured once for every y value.
+
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram. The grid of a
+     GriddedDiagram is used as it is, without detecting it from the points.
+    :return: The sorted x axis, the sorted y axis and the z values as a 2D array indexed as [y, x].
+     None if the points are scattered.
+    """
+    if isinstance(diagram, GriddedDiagram):
+        # At least 2 values by axis are required to search the nearest neighbours, and no repeated value
+        if len(diagram.x) < 2 or len(diagram.y) < 2 or np.any(np.diff(diagram.x) <= 0) or \
+                np.any(np.diff(diagram.y) <= 0):
+            return None
+        return diagram.x, diagram.y, diagram.values
+
+    x, y = diagram.x.to_numpy(), diagram.y.to_numpy()
+    x_axis, y_axis = np.unique(x), np.unique(y)
+
+    # At least 2 values by axis are required to search the nearest neighbours
+    if len(x_axis) < 2 or len(y_axis) < 2 or len(x_axis) * len(y_axis) != len(diagram):
+        return None
+
+    # Every (x, y) couple has to be present exactly once
+    flat_index = np.searchsorted(y_axis, y) * len(x_axis) + np.searchsorted(x_axis, x)
+    if np.any(np.bincount(flat_index, minlength=len(diagram)) != 1):
+        return None
+
+    values = np.empty(len(diagram), dtype=diagram.z.dtype)
+    values[flat_index] = diagram.z.to_numpy()
+    return x_axis, y_axis, values.reshape(len(y_axis), len(x_axis))
+
+
+def nearest_axis_index(axis: np.ndarray, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the index of the nearest axis value for each query value, with a vectorized binary search.
+
+    :param axis: The sorted axis values.
+    :param query: The values to search in the axis.
+    :return: The index of the nearest axis value, the squared distance to the nearest axis value and the squared
+     distance to the second-nearest axis value, for each query value.
+    """
+    right = np.clip(np.searchsorted(axis, query), 1, len(axis) - 1)
+    left = right - 1
+    distance_left = (axis[left] - query) ** 2
+    distance_right = (axis[right] - query) ** 2
+
+    nearest = np.where(distance_left <= distance_right, left, right)
+    return nearest, np.minimum(distance_left, distance_right), np.maximum(distance_left, distance_right)
+
+
+def regular_grid_nearest(grid: Tuple[np.ndarray, np.ndarray, np.ndarray], x_i: np.ndarray,
+                         y_i: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Nearest neighbour resampling of a rectilinear grid with index lookups, instead of building a KD-tree.
+    Since the points are the product of 2 axes, the nearest point is the product of the nearest value on each axis.
+
+    :param grid: The sorted x axis, the sorted y axis and the z values as a 2D array, as returned by regular_grid.
+    :param x_i: The x coordinates of the output pixels, as a 1D array.
+    :param y_i: The y coordinates of the output pixels, as a 1D array.
+    :return: The resampled 2D array indexed as [y, x], the same as griddata would return.
+     None if a pixel is at equal distance of several points, because the KD-tree used by griddata choose the
+     neighbour according to its internal structure in this case.
+    """
+    x_axis, y_axis, values = grid
+
+    x_index, x_nearest, x_second = nearest_axis_index(x_axis, x_i)
+    y_index, y_nearest, y_second = nearest_axis_index(y_axis, y_i)
+
+    # Compare the squared distances the same way as the KD-tree (x² + y²), a tie is possible after rounding
+    best_distance = x_nearest[np.newaxis, :] + y_nearest[:, np.newaxis]
+    if np.any(x_second[np.newaxis, :] + y_nearest[:, np.newaxis] == best_distance) or \
+            np.any(x_nearest[np.newaxis, :] + y_second[:, np.newaxis] == best_distance):
+        return None
+
+    return values[np.ix_(y_index, x_index)]
+
+
+def pixel_axes(diagram, step: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram.
+    :param step: The output grid resolution.
+    :return: The x and y coordinates of the output pixels, as 1D arrays.
+    """
+    # Remove one pixel around to avoid rounding issues during the interpolation
+    return (np.arange(np.min(diagram.x) + step, np.max(diagram.x), step),
+            np.arange(np.min(diagram.y) + step, np.max(diagram.y), step))
+
+
+class PyramidInterpolator:
+    """
+    Interpolate a raw diagram at several pixel sizes, with the same results as image_interpolation and
+    filter_interpolated for each pixel size, but without repeating the costly steps:
+        * The grid of a regular sweep is detected once, the triangulation or the KD-tree of scipy is built once.
+        * The pixels of a level are copied from a finer level if they have exactly the same coordinates, since the
+          value of a pixel only depends on its coordinates.
+    The levels should be interpolated from the finest to the coarsest.
+    The results are exactly the same with the "nearest" method. With the other methods, a pixel on the edge of 2
+    triangles (e.g. regular sweeps) can be computed from either of them, so the results can differ by rounding errors.
+    """
+
+    def __init__(self, diagram, method: str = 'nearest', percentiles: Optional[Tuple[float, float]] = None):
+        """
+        :param diagram: The raw diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram.
+        :param method: The interpolation method.
+        (see https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.griddata.html)
+        :param percentiles: The 1st and 99th percentiles of the raw z values, if they are already known.
+        """
+        self.diagram = diagram
+        self.method = method
+        self._percentiles = percentiles
+        # The regular grid of the diagram (see regular_grid), False if the points are scattered
+        self._grid = None
+        self._triangulation = None
+        # The scipy interpolators, for the raw values (False) and the filtered values (True)
+        self._interpolators = {}
+        # The interpolated levels by (pixel size, filtered), as the x axis, the y axis and the pixels (not flipped)
+        self._levels: Dict[Tuple[float, bool], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        # The number of levels copied from a finer level
+        self.derived_levels = 0
+
+    @property
+    def percentiles(self) -> Tuple[float, float]:
+        """
+        :return: The 1st and 99th percentiles of the raw z values.
+        """
+        if self._percentiles is None:
+            z = self.diagram.values if isinstance(self.diagram, GriddedDiagram) else self.diagram.z
+            self._percentiles = tuple(np.percentile(z, [1, 99]))
+        return self._percentiles
+
+    def interpolate(self, step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Interpolate the diagram, the same as image_interpolation without filter.
+
+        :param step: The output grid resolution.
+        :return The x axes, the y axes, the 2D array representing the image.
+        """
+        x_axis, y_axis, pixels = self._level(step, filtered=False)
+        x_i, y_i = np.meshgrid(x_axis, y_axis)
+        # Flip the grid to keep the same direction (I don't know why it's inverted during the interpolation)
+        return x_i, y_i, np.flip(pixels, axis=0)
+
+    def filter(self, step: float, dtype: Optional[str] = None) -> np.ndarray:
+        """
+        Limit the interpolated values between the 1st and 99th percentile of the raw z values, the same as
+        filter_interpolated.
+
+        :param step: The output grid resolution.
+        :param dtype: The type of the filtered values (e.g. 'float32' for the images), the same as the pixels if None.
+        :return: The 2D array representing the filtered image.
+        """
+        if self.method in FILTER_COMMUTATIVE_METHODS:
+            pixels = self._level(step, filtered=False)[2]
+            # Clip directly into the array of the requested type
+            pixels = np.clip(pixels, *self.percentiles, out=np.empty(pixels.shape, dtype=dtype or pixels.dtype))
+        else:
+            pixels = self._level(step, filtered=True)[2]
+            pixels = pixels if dtype is None else pixels.astype(dtype, copy=False)
+        return np.flip(pixels, axis=0)
+
+    def _level(self, step: float, filtered: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if (step, filtered) not in self._levels:
+            x_axis, y_axis = pixel_axes(self.diagram, step)
+            pixels = self._derive(x_axis, y_axis, filtered)
+            if pixels is None:
+                pixels = self.evaluate(x_axis, y_axis, filtered)
+            else:
+                self.derived_levels += 1
+            self._levels[step, filtered] = x_axis, y_axis, pixels
+        return self._levels[step, filtered]
+
+    def _derive(self, x_axis: np.ndarray, y_axis: np.ndarray, filtered: bool) -> Optional[np.ndarray]:
+        """
+        Copy the pixels from a finer level, if the coordinates of every pixel are exactly the same.
+        The coordinates are often rounded differently (np.arange), then the level is evaluated again.
+        """
+        for (_, level_filtered), (level_x, level_y, level_pixels) in self._levels.items():
+            if level_filtered != filtered or len(level_x) < 2 or len(level_y) < 2:
+                continue
+            x_index = nearest_axis_index(level_x, x_axis)[0]
+            y_index = nearest_axis_index(level_y, y_axis)[0]
+            if np.array_equal(level_x[x_index], x_axis) and np.array_equal(level_y[y_index], y_axis):
+                return level_pixels[np.ix_(y_index, x_index)]
+        return None
+
+    def evaluate(self, x_axis: np.ndarray, y_axis: np.ndarray, filtered: bool = False) -> np.ndarray:
+        """
+        Interpolate the diagram on any pixel axes (e.g. the pixels of a window), without recording a level.
+
+        :param x_axis: The x coordinates of the pixels.
+        :param y_axis: The y coordinates of the pixels.
+        :param filtered: If True, interpolate the values limited between the 1st and 99th percentile (see
+         filter_interpolated), only needed for the methods that don't commute with the filter.
+        :return: The 2D array of the interpolated pixels (not flipped, the first row is the first y value).
+        """
+        if self.method == 'nearest' and not filtered:
+            # Fast path for regular sweeps
+            if self._grid is None:
+                self._grid = regular_grid(self.diagram) or False
+            if self._grid:
+                pixels = regular_grid_nearest(self._grid, x_axis, y_axis)
+                if pixels is not None:
+                    return pixels
+
+        # Scattered points or other interpolation methods
+        return self._interpolator(filtered)(*np.meshgrid(x_axis, y_axis))
+
+    def _interpolator(self, filtered: bool):
+        """
+        Build the scipy interpolator once, the same way as griddata.
+        The triangulation is shared by the raw and the filtered values.
+        """
+        if filtered not in self._interpolators:
+            if isinstance(self.diagram, GriddedDiagram):
+                x, y, z = self.diagram.to_columns()
+            else:
+                x, y, z = self.diagram.x.to_numpy(), self.diagram.y.to_numpy(), self.diagram.z.to_numpy()
+            if filtered:
+                z = np.clip(z, *self.percentiles)
+            points = np.column_stack((x, y))
+
+            if self.method == 'nearest':
+                interpolator = NearestNDInterpolator(points, z)
+            elif self.method in ('linear', 'cubic'):
+                if self._triangulation is None:
+                    self._triangulation = Delaunay(points)
+                interpolator_class = LinearNDInterpolator if self.method == 'linear' else CloughTocher2DInterpolator
+                interpolator = interpolator_class(self._triangulation, z)
+            else:
+                raise ValueError(f'Unknown interpolation method "{self.method}".')
+            self._interpolators[filtered] = interpolator
+        return self._interpolators[filtered]
+
+
+def image_interpolation(diagram, step=0.001, method='nearest', filter_extreme=False, window: Optional[Tuple] = None,
+                        margin: Optional[float] = None) -> Tuple:
     """
     Convert a set of irregular point into pixels using interpolation.
+    If the method is "nearest" and the points form a rectilinear grid, the interpolation is done with index lookups.
+    Otherwise, the scipy interpolators of griddata are used.
+    To interpolate a diagram at several pixel sizes, use a PyramidInterpolator.
 
-    :param diagram: The diagram as a pandas dataframe. With columns x, y, z.
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram. The grid of a
+     GriddedDiagram is used as it is, without detecting it from the points. It can also be a RawPointsIndex (see
+     spatial_index.py), then only the points around the window are read.
     :param step: The output grid resolution.
     :param method: The interpolation method.
     (see https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.griddata.html)
     :param filter_extreme: If true limit the z values between the first and the last percentile.
+    :param window: Optional voltage area to interpolate, as (x_min, x_max, y_min, y_max). Only the pixels of the
+     whole diagram grid inside this area are computed (see window_interpolation).
+    :param margin: The distance around the window where the points are used, in volt (see window_interpolation).
     :return The x axes, the y axes, the 2D array representing the image.
     """
+    if window is not None or isinstance(diagram, RawPointsIndex):
+        return window_interpolation(diagram, window or diagram.bounds, step, method, filter_extreme, margin)
+
     if filter_extreme:
-        # Limit z values between the 1st and 99th percentile to avoid visual issues with extreme values
-        percentile1 = np.percentile(diagram.z, 1)
-        percentile99 = np.percentile(diagram.z, 99)
-        diagram.loc[diagram.z < percentile1, 'z'] = percentile1
-        diagram.loc[diagram.z > percentile99, 'z'] = percentile99
+        x_i, y_i, grid = image_interpolation(diagram, step, method, filter_extreme=False)
+        return x_i, y_i, filter_interpolated(diagram, grid, step, method)
 
-    # Remove one pixel around to avoid rounding issues during the interpolation
-    x_i = np.arange(np.min(diagram.x) + step, np.max(diagram.x), step)
-    y_i = np.arange(np.min(diagram.y) + step, np.max(diagram.y), step)
-    x_i, y_i = np.meshgrid(x_i, y_i)
+    return PyramidInterpolator(diagram, method).interpolate(step)
 
-    # Use "nearest" interpolation method.
-    grid = griddata((diagram.x, diagram.y), diagram.z, (x_i, y_i), method=method)
 
-    # Flip the grid to keep the same direction (I don't know why it's inverted during the interpolation)
-    grid = np.flip(grid, axis=0)
-    return x_i, y_i, grid
+def window_interpolation(diagram, window: Tuple[float, float, float, float], step=0.001, method='nearest',
+                         filter_extreme=False, margin: Optional[float] = None) -> Tuple:
+    """
+    Interpolate a voltage window of a diagram, from the points inside the window and around it only.
+    The pixels have the same coordinates as the pixels of the whole diagram (see pixel_axes), so the result is the
+    part of the image_interpolation result inside the window, as long as the margin contains the points used by the
+    pixels of the window edges. The filter uses the percentiles of the whole diagram.
+
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z), as a GriddedDiagram or as a
+     RawPointsIndex. The index is the fastest, since only the tiles around the window are read.
+    :param window: The area to interpolate, as (x_min, x_max, y_min, y_max) in volt.
+    :param step: The output grid resolution.
+    :param method: The interpolation method.
+    :param filter_extreme: If true limit the z values between the first and the last percentile.
+    :param margin: The distance around the window where the points are used, in volt. By default 8 times the average
+     distance between points (at least 2 pixels), enough for the neighbours of the edge pixels. Increase it for
+     diagrams with very irregular point density.
+    :return The x axes, the y axes, the 2D array representing the image of the window.
+    """
+    if isinstance(diagram, RawPointsIndex):
+        x_axis, y_axis = diagram.pixel_axes(step)
+        spacing = diagram.spacing
+        percentiles = (diagram.statistics['z_p1'], diagram.statistics['z_p99']) if filter_extreme else None
+    else:
+        x_axis, y_axis = pixel_axes(diagram, step)
+        spacing = point_spacing((float(np.min(diagram.x)), float(np.max(diagram.x)), float(np.min(diagram.y)),
+                                 float(np.max(diagram.y))), diagram.size if isinstance(diagram, GriddedDiagram)
+                                else len(diagram))
+        # The percentiles of the whole diagram, to have the same filter as image_interpolation
+        percentiles = PyramidInterpolator(diagram, method).percentiles if filter_extreme else None
+
+    x_min, x_max, y_min, y_max = window
+    x_axis = x_axis[(x_axis >= x_min) & (x_axis <= x_max)]
+    y_axis = y_axis[(y_axis >= y_min) & (y_axis <= y_max)]
+    if len(x_axis) == 0 or len(y_axis) == 0:
+        raise ValueError(f'The window {window} contains no pixel of the diagram.')
+
+    margin = max(2 * step, 8 * spacing) if margin is None else margin
+    points = window_diagram(diagram, (x_min - margin, x_max + margin, y_min - margin, y_max + margin))
+    interpolator = PyramidInterpolator(points, method, percentiles)
+
+    if filter_extreme and method not in FILTER_COMMUTATIVE_METHODS:
+        pixels = interpolator.evaluate(x_axis, y_axis, filtered=True)
+    else:
+        pixels = interpolator.evaluate(x_axis, y_axis, filtered=False)
+        if filter_extreme:
+            pixels = np.clip(pixels, *percentiles)
+
+    x_i, y_i = np.meshgrid(x_axis, y_axis)
+    # Same direction as image_interpolation
+    return x_i, y_i, np.flip(pixels, axis=0)
+
+
+def filter_interpolated(diagram, pixels, step=0.001, method='nearest',
+                        percentiles: Optional[Tuple[float, float]] = None):
+    """
+    Limit the interpolated values between the 1st and 99th percentile of the raw z values, to avoid visual issues with
+    extreme values. The input arrays are not modified.
+
+    With the "nearest" method every pixel is a copy of one raw value, so clipping the raw values before the
+    interpolation or clipping the pixels after is strictly equivalent, and the interpolation is not repeated.
+    With other methods a pixel is a weighted combination of several raw values (and "cubic" can overshoot), so
+    clipping does not commute with the interpolation: the clipped raw values are interpolated again.
+
+    :param diagram: The raw diagram as a pandas dataframe (with columns x, y, z), or as a GriddedDiagram.
+    :param pixels: The 2D array returned by image_interpolation for this diagram (without filter).
+    :param step: The output grid resolution used for the interpolation.
+    :param method: The interpolation method used for the interpolation.
+    :param percentiles: The 1st and 99th percentiles of the raw z values, if they are already known.
+    :return: The 2D array representing the filtered image.
+    """
+    gridded = isinstance(diagram, GriddedDiagram)
+    z = diagram.values if gridded else diagram.z
+    percentile1, percentile99 = np.percentile(z, [1, 99]) if percentiles is None else percentiles
+
+    if method in FILTER_COMMUTATIVE_METHODS:
+        return np.clip(pixels, percentile1, percentile99)
+
+    if gridded:
+        filtered_diagram = diagram._replace(values=np.clip(z, percentile1, percentile99))
+    else:
+        filtered_diagram = diagram.assign(z=np.clip(z, percentile1, percentile99))
+    return image_interpolation(filtered_diagram, step, method, filter_extreme=False)[2]
 
 
 def save_images(file_dir: Path, file_basename: str, pixels, interpolation_method: str, pixel_size: float,
-                filter_extreme=True) -> None:
+                filter_extreme=True, threads: int = 3, timer: Optional[StageTimer] = None,
+                dtype: Optional[str] = None, stage_name: Optional[str] = None) -> None:
     """
     Save interpolated image in 3 versions:
         * Pixels color represent the normalized current value
         * Pixels color represent the derivative in respect to the x-axis
         * Pixels color represent the derivative in respect to the y-axis
+    The images are encoded without plotting backend (see png_encoder), in parallel threads.
 
     :param file_dir: The path to the directory where to save the image
     :param file_basename: The name of the image without extension
@@ -60,157 +396,436 @@ def save_images(file_dir: Path, file_basename: str, pixels, interpolation_method
     :param interpolation_method: The pixels interpolation method, used for metadata
     :param pixel_size: The size of pixels, in voltage, used for metadata
     :param filter_extreme: Allow or not to filter the derived images
+    :param threads: The number of threads used to encode the images
+    :param timer: Optional timer to measure the gradient and the encoding stages. The encoding of the first image
+     starts during the gradient stage.
+    :param dtype: The type of the values used to build the images ('float32' or 'float64'), the type of the pixels if
+     None. With 'float32', the gradients and the normalization take half the memory, and some pixels can have the next
+     color level.
+    :param stage_name: The name of the diagram in the stage records (e.g. the level name of process_diagram), the name
+     of the image if None.
     """
+    timer = timer or StageTimer(enabled=False)
+    stage_name = stage_name or file_basename
+    pixels = pixels if dtype is None else pixels.astype(dtype, copy=False)
 
     # Create directories if necessary
     file_dir.mkdir(parents=True, exist_ok=True)
 
-    # Save interpolated raw image as file
-    plt.imsave(file_dir / f'{file_basename}.png', pixels, cmap='Greys', metadata={
-        'interpolation_method': interpolation_method,
-        'pixel_size': f'{pixel_size:.6f}V',
-    })
-
-    # Compute the gradient with respect to each dimension
-    pixels_gradient = np.gradient(pixels)
-
-    if filter_extreme:
-        # Limit pixel values between the 1st and 99th percentile to avoid visual issues with extreme values
-        for pixel_d in pixels_gradient:
-            percentile1 = np.percentile(pixel_d, 1)
-            percentile99 = np.percentile(pixel_d, 99)
-            pixel_d[np.where(pixel_d < percentile1)] = percentile1
-            pixel_d[np.where(pixel_d > percentile99)] = percentile99
-
-    # Save interpolated gradient by x image as file
-    plt.imsave(file_dir / f'{file_basename}_DzDx.png', pixels_gradient[1], cmap='Greens', metadata={
-        'interpolation_method': interpolation_method,
-        'pixel_size': f'{pixel_size:.6f}V',
-        'derivative_method': 'numpy.gradient',
-        'type_of_derived': 'by x',
-    })
-
-    # Save interpolated gradient by y image as file
-    plt.imsave(file_dir / f'{file_basename}_DzDy.png', pixels_gradient[0], cmap='Blues', metadata={
-        'interpolation_method': interpolation_method,
-        'pixel_size': f'{pixel_size:.6f}V',
-        'derivative_method': 'numpy.gradient',
-        'type_of_derived': 'by y',
-    })
-
-
-def save_interpolated_csv(file_path: Path, values, x, y, pixel_size: float) -> None:
-    """
-    Save interpolated data as a CSV file.
-
-    :param file_path: The path where to save the CSV. The extension define the file format (GZ or CSV)
-    :param values: The list of voltage values as a numpy array
-    :param x: The x coordinates of the pixels (post interpolation), used in information row
-    :param y: The y coordinates of the pixels (post interpolation), used in information row
-    :param pixel_size: The size of pixels, in voltage, used in information row
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Save interpolated raw image as file
+        images = [executor.submit(save_png, file_dir / f'{file_basename}.png', pixels, 'Greys', {
+            'interpolation_method': interpolation_method,
+            'pixel_size': f'{pixel_size:.6f}V',
+        })]
+
+        with timer.stage(stage_name, 'gradient', pixels=pixels.size):
+            # Compute the gradient with respect to each dimension (same type as the pixels)
+            pixels_gradient = np.gradient(pixels)
+
+            if filter_extreme:
+                # Limit pixel values between the 1st and 99th percentile to avoid visual issues with extreme values
+                for pixel_d in pixels_gradient:
+                    # Both percentiles with a single partition of the values
+                    percentiles = np.percentile(pixel_d, [1, 99])
+                    # The percentiles are not defined if there is a not finite value (e.g. outside the convex hull)
+                    if not np.isnan(percentiles).any():
+                        np.clip(pixel_d, *percentiles, out=pixel_d)
+
+        with timer.stage(stage_name, 'png_encode', pixels=pixels.size * 3):
+            # The gradients are not used after the encoding, so they are normalized in place
+            # Save interpolated gradient by x image as file
+            images.append(executor.submit(save_png, file_dir / f'{file_basename}_DzDx.png', pixels_gradient[1],
+                                          'Greens', {
+                'interpolation_method': interpolation_method,
+                'pixel_size': f'{pixel_size:.6f}V',
+                'derivative_method': 'numpy.gradient',
+                'type_of_derived': 'by x',
+            }, overwrite_values=True))
+
+            # Save interpolated gradient by y image as file
+            images.append(executor.submit(save_png, file_dir / f'{file_basename}_DzDy.png', pixels_gradient[0],
+                                          'Blues', {
+                'interpolation_method': interpolation_method,
+                'pixel_size': f'{pixel_size:.6f}V',
+                'derivative_method': 'numpy.gradient',
+                'type_of_derived': 'by y',
+            }, overwrite_values=True))
+
+            # Raise encoding errors, if any
+            for image in images:
+                image.result()
+
+
+def diagram_outputs(diagram_file: Path, raw_clean_dir: Path, csv_out_dir: Path, img_out_dir: Path,
+                    interpolated_format: str = 'gz') -> Dict[str, List[Path]]:
     """
-    # Create directories if necessary
-    file_path.parent.mkdir(parents=True, exist_ok=True)
+    List the output files built from a raw diagram, by group of outputs built together.
+
+    :param diagram_file: The path to the raw file of the diagram (CSV or NPZ)
+    :param raw_clean_dir: The root directory of raw files, used to keep the file structure in the outputs
+    :param csv_out_dir: The root directory of the interpolated CSV files
+    :param img_out_dir: The root directory of the images
+    :param interpolated_format: The file format (extension) of the interpolated values: 'gz', 'csv' or 'npy'
+    :return: The output files as a dictionary: 'values' (interpolated values) and 'images' (value and gradient images)
+    """
+    file_basename = diagram_file.stem  # Remove extension
+    relative_dir = diagram_file.parent.relative_to(raw_clean_dir)  # Keep the file structure
+    current_img_dir = img_out_dir / relative_dir
 
-    compact_diagram = np.insert(values, 0, [x[0][0], y[0][0], pixel_size] + [0] * (len(x[0]) - 3), 0)
-    np.savetxt(file_path, compact_diagram, delimiter=',', fmt='%.6g',
-               header='First row: x start (V), y start (V), step (V) / Second row to end: values (V)')
+    return {
+        'values': [csv_out_dir / relative_dir / f'{file_basename}.{interpolated_format}'],
+        'images': [current_img_dir / f'{file_basename}{suffix}.png' for suffix in ('', '_DzDx', '_DzDy')],
+    }
 
 
-def load_interpolated_csv(file_path: Union[IO, str, Path]) -> Tuple:
+def list_raw_files(raw_clean_dir: Path) -> List[Path]:
     """
-    Load the stability diagrams from CSV file.
+    List the raw diagram files. If a diagram exists in several formats, the binary one is used.
 
-    :param file_path: The path to the CSV file or the byte stream.
-    :return: The stability diagram data as a tuple: x, y, values
+    :param raw_clean_dir: The root directory of raw files
+    :return: The sorted list of raw files, to have a deterministic processing order
     """
-    compact_diagram = np.loadtxt(file_path, delimiter=',')
-    # Extract information
-    x_start, y_start, step = compact_diagram[0][0], compact_diagram[0][1], compact_diagram[0][2]
-
-    # Remove the information row
-    values = np.delete(compact_diagram, 0, 0)
-
-    # Reconstruct the axes
+    raw_files = {}
+    # The last suffix has the priority
+    for suffix in RAW_SUFFIXES:
+        raw_files.update((file_path.with_suffix(''), file_path) for file_path in raw_clean_dir.rglob(f'*{suffix}'))
+    return sorted(raw_files.values())
 
-    x = np.arange(values.shape[1]) * step + x_start
-    y = np.arange(values.shape[0]) * step + y_start
 
-    return x, y, values
+def outputs_settings_hash(pixel_size: float, interpolation_method: str, filter_extreme: bool,
+                          interpolated_format: str, image_dtype: str = 'float64',
+                          raw_dtype: str = 'float64') -> Dict[str, str]:
+    """
+    Hash the settings that define each group of outputs, to detect the outputs built with other settings.
+
+    :param pixel_size: The output grid resolution
+    :param interpolation_method: The interpolation method
+    :param filter_extreme: If True, the extreme data points are removed from the generated images
+    :param interpolated_format: The file format (extension) of the interpolated values
+    :param image_dtype: The type of the values used to build the images
+    :param raw_dtype: The type of the raw values once loaded, used by the values and the images
+    :return: The settings hash of each group of outputs (see diagram_outputs)
+    """
+    # The default types are not hashed, to keep the outputs built before these settings
+    raw_settings = {} if raw_dtype == 'float64' else {'raw_dtype': raw_dtype}
+    image_settings = {} if image_dtype == 'float64' else {'image_dtype': image_dtype}
+    return {
+        'values': settings_hash(version=PIPELINE_VERSION, pixel_size=pixel_size,
+                                interpolation_method=interpolation_method, interpolated_format=interpolated_format,
+                                **raw_settings),
+        'images': settings_hash(version=PIPELINE_VERSION, pixel_size=pixel_size,
+                                interpolation_method=interpolation_method, filter_extreme=filter_extreme,
+                                **raw_settings, **image_settings),
+    }
+
+
+def level_dir(root_dir: Path, pixel_size: float) -> Path:
+    """
+    :param root_dir: The root directory of an output type (e.g. out/interpolated_csv)
+    :param pixel_size: The output grid resolution
+    :return: The directory of the outputs of this pixel size
+    """
+    return root_dir / f'{pixel_size * 1000}mV'
 
 
-def main():
-    label = DatasetLabel(settings.api_key) if settings.upload_images else None
-    raw_clean_dir = Path(OUT_DIR, 'raw_clean')
-    img_out_dir = Path(OUT_DIR, 'interpolated_img', f'{settings.pixel_size * 1000}mV')
-    csv_out_dir = Path(OUT_DIR, 'interpolated_csv', f'{settings.pixel_size * 1000}mV')
+def process_diagram(diagram_file: Path, outputs: Dict[float, Collection[str]], raw_clean_dir: Path,
+                    csv_out_dir: Path, img_out_dir: Path, interpolation_method: str, filter_extreme: bool,
+                    plot_results: bool, interpolated_format: str = 'gz', raw_chunk_size: int = 1_000_000,
+                    raw_dtype: str = 'float64', render_threads: int = 3, image_dtype: str = 'float64',
+                    focus_area: Optional[Tuple] = None, raw_index_dir: Optional[Path] = None,
+                    raw_sha256: Optional[str] = None, instrumentation: bool = False) -> dict:
+    """
+    Interpolate one raw diagram at one or several pixel sizes, then save the interpolated values and / or the images.
+    The raw diagram is loaded once for every pixel size (see PyramidInterpolator).
+    Every argument is explicit to be able to run this function in a worker process.
+
+    :param diagram_file: The path to the raw file of the diagram (CSV or NPZ)
+    :param outputs: The groups of outputs to build for each pixel size: 'values' and / or 'images' (see
+     diagram_outputs). No group means that the diagram is only loaded (grid shape for the catalog, spatial index).
+    :param raw_clean_dir: The root directory of raw files, used to keep the file structure in the outputs
+    :param csv_out_dir: The root directory where to save the interpolated CSV files, with a sub-directory by pixel size
+    :param img_out_dir: The root directory where to save the images, with a sub-directory by pixel size
+    :param interpolation_method: The interpolation method
+    :param filter_extreme: If True, the extreme data points are removed from the generated images
+    :param plot_results: If True, plot the diagrams as images at different steps of the processing
+    :param interpolated_format: The file format (extension) of the interpolated values: 'gz', 'csv' or 'npy'
+    :param raw_chunk_size: The number of rows parsed at once when loading a raw CSV file
+    :param raw_dtype: The type of the raw values once loaded ('float32' or 'float64')
+    :param render_threads: The number of threads used to encode the images of the diagram
+    :param image_dtype: The type of the values used to build the images ('float32' or 'float64')
+    :param focus_area: Optional coordinates to restrict the plotting area. A Tuple as (x_min, x_max, y_min, y_max).
+     Only the raw points of this area are plotted.
+    :param raw_index_dir: The root directory where to save the spatial index of the raw diagram (see spatial_index.py),
+     if it is missing or outdated. No index is saved if None.
+    :param raw_sha256: The content hash of the raw file (see BuildManifest.raw_hash), recorded in the spatial index.
+     Computed if None and the index is saved.
+    :param instrumentation: If True, measure each processing stage (see StageTimer)
+    :return: The processing result, with the keys 'raw_statistics' (see load_raw_csv), 'gridded' (True if the raw file
+     contains a GriddedDiagram), 'shapes' (the grid shape of each pixel size), 'peak_rss' (peak memory of the process
+     for this diagram) and 'stages' (the stage records, empty if not measured).
+    """
+    file_basename = diagram_file.stem  # Remove extension
+    timer = StageTimer(instrumentation)
+
+    reset_peak_rss()
+
+    # Load data
+    with timer.stage(file_basename, 'load') as counts:
+        diagram, raw_statistics = load_raw(diagram_file, raw_chunk_size, raw_dtype)
+        counts['raw_points'] = raw_statistics['points']
+
+    if raw_index_dir is not None and raw_statistics['points'] > 0:
+        # Reuse the loaded diagram to build the index for the windowed interpolation
+        index_file = raw_index_file(diagram_file, raw_clean_dir, raw_index_dir)
+        raw_sha256 = raw_sha256 or file_hash(diagram_file)
+        if not RawPointsIndex.is_valid(index_file, raw_sha256, raw_dtype):
+            with timer.stage(file_basename, 'raw_index', raw_points=raw_statistics['points']):
+                RawPointsIndex.build(diagram, raw_statistics).save(index_file, raw_sha256, raw_dtype)
+
+    if plot_results:
+        # Import here to load matplotlib only if necessary
+        from plots import plot_image, plot_raw
+
+        # Plot raw points, only the ones of the focus area
+        raw_points = window_diagram(diagram, focus_area) if focus_area else diagram
+        plot_raw(raw_points.to_dataframe() if isinstance(raw_points, GriddedDiagram) else raw_points, file_basename,
+                 focus_area, grid_size=None)
+
+    gridded = isinstance(diagram, GriddedDiagram)
+    # The grid shape doesn't require the interpolation
+    shapes = {pixel_size: (len(y_axis), len(x_axis))
+              for pixel_size, (x_axis, y_axis) in ((size, pixel_axes(diagram, size)) for size in outputs)}
+    built_sizes = sorted(pixel_size for pixel_size, groups in outputs.items() if groups)
+
+    # Reuse the interpolation structures and the finer levels for the coarser levels
+    percentiles = (raw_statistics['z_p1'], raw_statistics['z_p99']) if raw_statistics['points'] > 0 else None
+    interpolator = PyramidInterpolator(diagram, interpolation_method, percentiles)
+    del diagram  # Only kept by the interpolator
+
+    for pixel_size in built_sizes:
+        level_name = f'{pixel_size * 1000}mV/{file_basename}'
+        level_outputs = diagram_outputs(diagram_file, raw_clean_dir, level_dir(csv_out_dir, pixel_size),
+                                        level_dir(img_out_dir, pixel_size), interpolated_format)
 
-    count = 0
-    skipped = 0
+        # Interpolate
+        with timer.stage(level_name, 'interpolate', raw_points=raw_statistics['points']) as counts:
+            x_i, y_i, pixels = interpolator.interpolate(pixel_size)
+            counts['pixels'] = pixels.size
 
-    for diagram_file in raw_clean_dir.rglob('*.csv'):
-        # Plot a specific area of the diagram
-        focus_area = None
-        # focus_area = (-0.460, -0.440, -0.65, -0.63)
+        if 'values' in outputs[pixel_size]:
+            # Save interpolated values
+            with timer.stage(level_name, 'save_values', pixels=pixels.size):
+                save_interpolated(level_outputs['values'][0], pixels, x_i, y_i, pixel_size)
 
-        # Compute out file paths
-        file_basename = diagram_file.stem  # Remove extension
-        current_csv_dir = csv_out_dir / diagram_file.parent.relative_to(raw_clean_dir)  # Keep the file structure
-        current_img_dir = img_out_dir / diagram_file.parent.relative_to(raw_clean_dir)  # Keep the file structure
-        out_csv_file = current_csv_dir / f'{file_basename}.gz'
+        if filter_extreme:
+            # Reuse the interpolated values when possible
+            with timer.stage(level_name, 'filter', pixels=pixels.size):
+                pixels = interpolator.filter(pixel_size, image_dtype)
 
-        # If the csv file exists, skip everything (no image created)
-        if out_csv_file.is_file():
-            skipped += 1
-            continue
+        if pixel_size == built_sizes[-1]:
+            del interpolator  # Explicite remove large data, before the images of the last level
+            gc.collect()
 
-        # Load data
-        diagram = pandas.read_csv(diagram_file)
+        if plot_results:
+            # Plot the image
+            plot_image(x_i, y_i, pixels, file_basename, interpolation_method, pixel_size, focus_area=focus_area)
 
-        if settings.plot_results:
-            # Plot raw points
-            plot_raw(diagram, file_basename, focus_area, grid_size=None)
+        if 'images' in outputs[pixel_size]:
+            # Save the interpolated image and derived images
+            save_images(level_outputs['images'][0].parent, file_basename, pixels, interpolation_method, pixel_size,
+                        threads=render_threads, timer=timer, dtype=image_dtype, stage_name=level_name)
 
-        # Interpolate
-        x_i, y_i, pixels = image_interpolation(diagram,
-                                               method=settings.interpolation_method,
-                                               step=settings.pixel_size,
-                                               filter_extreme=False)
-
-        # Save interpolated values
-        current_csv_dir.mkdir(parents=True, exist_ok=True)
-        save_interpolated_csv(out_csv_file, pixels, x_i, y_i, settings.pixel_size)
-
-        if settings.filter_extreme:
-            _, _, pixels = image_interpolation(diagram,
-                                               method=settings.interpolation_method,
-                                               step=settings.pixel_size,
-                                               filter_extreme=True)
-
-        del diagram  # Explicite remove large data
+        del pixels  # Explicite remove large data
         gc.collect()
 
-        if settings.plot_results:
-            # Plot the image
-            plot_image(x_i, y_i, pixels, file_basename, settings.interpolation_method, settings.pixel_size,
-                       focus_area=focus_area)
-
-        # Save the interpolated image and derived images
-        save_images(current_img_dir, file_basename, pixels, settings.interpolation_method,
-                    settings.pixel_size)
+    # The peak memory is reset at the beginning of each measured stage
+    return {'raw_statistics': raw_statistics, 'gridded': gridded, 'shapes': shapes,
+            'peak_rss': max(peak_rss(), timer.max_peak_rss()), 'stages': timer.records}
 
-        # Upload image into Labelbox
-        if settings.upload_images:
-            label.load_img_into_labelbox(current_img_dir, file_basename)
 
-        count += 1
+def main():
+    if settings.upload_images:
+        # Import here to load labelbox only if necessary
+        from dataset_label import DatasetLabel
+        # The images are uploaded in background threads, while the next diagrams are processed
+        uploads = DatasetLabel(settings.api_key).upload_queue()
+    else:
+        uploads = None
+
+    out_dir = Path(settings.out_dir)
+    raw_clean_dir = Path(out_dir, 'raw_clean')
+    img_out_dir = Path(out_dir, 'interpolated_img')
+    csv_out_dir = Path(out_dir, 'interpolated_csv')
+    raw_index_dir = Path(out_dir, 'raw_index') if settings.raw_index else None
+    # Every level is built from a single load of each raw diagram, from the finest to the coarsest
+    pixel_sizes = sorted({settings.pixel_size, *map(float, settings.pyramid_pixel_sizes)})
+
+    # Plot a specific area of the diagram, e.g. --focus-area=-0.460 --focus-area=-0.440 --focus-area=-0.65 ...
+    focus_area = tuple(map(float, settings.focus_area)) or None
+
+    # The interactive plots can't be shown from worker processes
+    plot_results = settings.plot_results and settings.workers <= 1
+
+    process = partial(process_diagram,
+                      raw_clean_dir=raw_clean_dir,
+                      csv_out_dir=csv_out_dir,
+                      img_out_dir=img_out_dir,
+                      interpolation_method=settings.interpolation_method,
+                      filter_extreme=settings.filter_extreme,
+                      plot_results=plot_results,
+                      interpolated_format=settings.interpolated_format,
+                      raw_chunk_size=settings.raw_chunk_size,
+                      raw_dtype=settings.raw_dtype,
+                      render_threads=settings.render_threads,
+                      image_dtype=settings.image_dtype,
+                      focus_area=focus_area,
+                      raw_index_dir=raw_index_dir,
+                      instrumentation=settings.instrumentation)
+
+    # Single file store of every interpolated diagram
+    store = DiagramStore(Path(out_dir, 'interpolated_store.bin'), 'a') if settings.pack_store else None
+
+    # Measurements of every stage, from the workers and from this process
+    timer = StageTimer(settings.instrumentation)
+
+    # Record of the built outputs, to only build again the missing or outdated ones
+    manifest = BuildManifest(Path(out_dir, 'build_manifest.json'), out_dir)
+    # Record of the diagrams and of their grids, queried to select the diagrams without opening the files
+    catalog = Catalog(Path(out_dir, 'catalog.sqlite'), out_dir)
+    outputs_hashes = {pixel_size: outputs_settings_hash(pixel_size, settings.interpolation_method,
+                                                        settings.filter_extreme, settings.interpolated_format,
+                                                        settings.image_dtype, settings.raw_dtype)
+                      for pixel_size in pixel_sizes}
+
+    def level_outputs(diagram_file: Path, pixel_size: float) -> Dict[str, List[Path]]:
+        return diagram_outputs(diagram_file, raw_clean_dir, level_dir(csv_out_dir, pixel_size),
+                               level_dir(img_out_dir, pixel_size), settings.interpolated_format)
+
+    def store_missing(diagram_file: Path, pixel_size: float, force: bool = False) -> None:
+        # Add the diagram if it is new, or if it is not in the store yet
+        store_key = f'{pixel_size * 1000}mV/{diagram_store_name(diagram_file, raw_clean_dir)}'
+        if force or store_key not in store:
+            with timer.stage(diagram_file.stem, 'store'):
+                store.put(store_key, *load_interpolated_csv(level_outputs(diagram_file, pixel_size)['values'][0]))
+
+    diagram_files = []
+    diagram_stale_outputs = []
+    skipped = 0
+    for diagram_file in list_raw_files(raw_clean_dir):
+        stale_outputs = {}
+        for pixel_size in pixel_sizes:
+            outputs = level_outputs(diagram_file, pixel_size)
+            stale_groups = [name for name, output_files in outputs.items()
+                            if manifest.is_stale(output_files, diagram_file, outputs_hashes[pixel_size][name])]
+            if stale_groups:
+                stale_outputs[pixel_size] = stale_groups
+            else:
+                if store is not None:
+                    store_missing(diagram_file, pixel_size)
+                if not catalog.has_level(diagram_store_name(diagram_file, raw_clean_dir), pixel_size):
+                    # Up-to-date outputs missing in the catalog, only the raw diagram is loaded
+                    stale_outputs[pixel_size] = []
+
+        if not stale_outputs and raw_index_dir is not None and \
+                not RawPointsIndex.is_valid(raw_index_file(diagram_file, raw_clean_dir, raw_index_dir),
+                                            manifest.raw_hash(diagram_file), settings.raw_dtype):
+            # Up-to-date outputs without spatial index, only the raw diagram is loaded
+            stale_outputs[settings.pixel_size] = []
+
+        if stale_outputs:
+            diagram_files.append(diagram_file)
+            diagram_stale_outputs.append(stale_outputs)
+        else:
+            skipped += 1
 
-        del pixels  # Explicite remove large data
-        gc.collect()
+    count = 0
+    # The diagrams that raised an error, with their error
+    failures = []
+
+    def iter_results(executor) -> Iterator[Tuple[Path, dict, Optional[dict], Optional[Exception]]]:
+        # The error of a diagram is returned instead of raised, so the other diagrams are still processed
+        if executor is None:
+            # Lazy evaluation in the main process
+            for diagram_file, stale_outputs in zip(diagram_files, diagram_stale_outputs):
+                try:
+                    result = process(diagram_file, stale_outputs, raw_sha256=manifest.raw_hash(diagram_file))
+                except Exception as error:
+                    yield diagram_file, stale_outputs, None, error
+                else:
+                    yield diagram_file, stale_outputs, result, None
+            return
+
+        # Parallel evaluation in the worker pool, in the order of completion
+        # The raw file hashes are already cached by the manifest (see is_stale)
+        futures = {executor.submit(process, diagram_file, stale_outputs, raw_sha256=manifest.raw_hash(diagram_file)):
+                   (diagram_file, stale_outputs)
+                   for diagram_file, stale_outputs in zip(diagram_files, diagram_stale_outputs)}
+        for future in as_completed(futures):
+            try:
+                yield *futures[future], future.result(), None
+            except Exception as error:
+                yield *futures[future], None, error
+
+    # Save the manifest even if the processing is interrupted, to keep the outputs already built
+    try:
+        with ProcessPoolExecutor(max_workers=settings.workers) if settings.workers > 1 else nullcontext() as executor:
+            for diagram_file, stale_outputs, result, error in iter_results(executor):
+                if error is not None:
+                    # The outputs of this diagram are not recorded, so they are built again by the next run
+                    failures.append((diagram_file, error))
+                    print(f'{diagram_file.relative_to(raw_clean_dir)} failed: {type(error).__name__}: {error}')
+                    continue
+
+                timer.extend(result['stages'])
+                diagram_name = diagram_store_name(diagram_file, raw_clean_dir)
+                catalog.record_diagram(diagram_name, diagram_file, result['raw_statistics'], result['gridded'])
+
+                for pixel_size, stale_groups in stale_outputs.items():
+                    outputs = level_outputs(diagram_file, pixel_size)
+                    for name in stale_groups:
+                        manifest.record(outputs[name], diagram_file, outputs_hashes[pixel_size][name])
+
+                    if store is not None and stale_groups:
+                        store_missing(diagram_file, pixel_size, force='values' in stale_groups)
+
+                    catalog.record_level(diagram_name, pixel_size, result['shapes'][pixel_size],
+                                         outputs['values'][0], outputs['images'][0])
+
+                levels = ', '.join(f'{pixel_size * 1000}mV: {"+".join(stale_groups) or "load only"}'
+                                   for pixel_size, stale_groups in stale_outputs.items())
+                print(f'{diagram_file.relative_to(raw_clean_dir)} interpolated ({levels}, '
+                      f'{result["raw_statistics"]["points"]:,} raw points, '
+                      f'peak memory {result["peak_rss"] / 1e6:,.0f} MB)')
+
+                # Queue the images to upload into Labelbox, only for the main pixel size
+                if uploads is not None and 'images' in stale_outputs.get(settings.pixel_size, ()):
+                    current_img_dir = level_outputs(diagram_file, settings.pixel_size)['images'][0].parent
+                    uploads.put(current_img_dir, diagram_file.stem)
+
+                count += 1
+    finally:
+        if uploads is not None:
+            # Wait for the last uploads
+            with timer.stage('labelbox', 'upload_wait'):
+                uploads.join()
+        if store is not None:
+            # Write the index of the last diagrams added
+            store.close()
+        manifest.save()
+        timer.save(Path(out_dir, 'instrumentation'), 'raw_to_images')
 
     print(f'{count} raw file(s) interpolated')
     if skipped > 0:
-        print(f'{skipped} file(s) skipped (already existing)')
+        print(f'{skipped} file(s) skipped (up to date)')
+    if failures:
+        print(f'{len(failures)} file(s) failed:')
+        for diagram_file, error in failures:
+            print(f'    {diagram_file.relative_to(raw_clean_dir)}: {type(error).__name__}: {error}')
+
+    labels_path = Path(settings.data_dir, 'labels.json')
+    if labels_path.is_file():
+        print(f'{catalog.record_labels(LabelsCache(labels_path))} labeled diagram(s) recorded in the catalog')
 
 
 if __name__ == '__main__':
@@ -1,9 +1,6 @@
 import argparse
 from dataclasses import asdict, dataclass
 
-import configargparse
-from numpy.distutils.misc_util import is_sequence
-
 
 @dataclass(init=False, repr=True, eq=True, order=False, unsafe_hash=False, frozen=False)
 class Settings:
@@ -14,6 +11,8 @@ class Settings:
         - local file (default path: ./settings.yaml)
         - environment variables
         - arguments of the command line (with "--" in front)
+    The file and the command line are only parsed at the first access to a setting, so importing this module is cheap
+    and doesn't fail with the arguments of another program.
     """
 
     # API key required for logging in labelbox
@@ -29,13 +28,73 @@ class Settings:
     # Dataset name for new dataset or to fetch an existing one
     dataset_name: str = 'Default'
 
+    # The maximal number of images uploaded into labelbox with one request
+    upload_batch_size: int = 100
+
+    # The maximal number of concurrent upload requests to labelbox
+    upload_threads: int = 4
+
+    # The number of attempts to upload a batch of images into labelbox, before reporting them as failed
+    upload_retries: int = 3
+
     # The pixel size in volt, for the interpolation
     pixel_size: float = 0.0010
 
+    # Additional pixel sizes in volt (e.g. 0.002, 0.004), built by raw_to_images with the pixel_size, from a single load
+    # of each raw diagram. The coarser levels reuse the finer ones when possible. Only the pixel_size images are
+    # uploaded into labelbox.
+    pyramid_pixel_sizes: tuple = ()
+
     # The interpolation method
     # See https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.griddata.html
     interpolation_method: str = 'nearest'
 
+    # The file format of the interpolated values: 'gz' (compressed CSV), 'csv' or 'npy'.
+    # The NPY format is binary, without rounding, and can be memory-mapped by load_interpolated_csv.
+    interpolated_format: str = 'gz'
+
+    # If True, every interpolated diagram is also added to a single file store (out_dir/interpolated_store.bin),
+    # with random access by key 'pixel_size/single|double/research_group/diagram'.
+    pack_store: bool = False
+
+    # The number of rows parsed at once when loading a raw CSV file, to bound the memory used by the parser.
+    raw_chunk_size: int = 1_000_000
+
+    # The type of the raw values once loaded: 'float64' or 'float32' (half the memory, but rounded values).
+    raw_dtype: str = 'float64'
+
+    # If True, process_annotations converts the labels of every folder found (all pixel sizes, dot types and research
+    # groups) in parallel and without plots, instead of the folder defined at the top of the file.
+    annotations_batch: bool = False
+
+    # The number of threads used to encode the 3 images of each diagram.
+    render_threads: int = 3
+
+    # The type of the values used to build the images: 'float64' or 'float32' (half the memory for the gradients and
+    # the normalization, but some pixels can have the next color level).
+    image_dtype: str = 'float64'
+
+    # The file format of the raw diagrams written by data_cleanup/convert.py: 'csv' (text) or 'npz' (binary columns,
+    # faster to write and read, without rounding). raw_to_images reads both formats.
+    raw_clean_format: str = 'csv'
+
+    # The size of the patches (square, in pixels) indexed by patch_sampler.py.
+    patch_size: int = 32
+
+    # The step between 2 patches of the same diagram (in pixels) indexed by patch_sampler.py.
+    patch_stride: int = 16
+
+    # If True, raw_to_images also saves a spatial index of each raw diagram (out_dir/raw_index), used to interpolate a
+    # voltage window from the points around it only (see spatial_index.py).
+    raw_index: bool = False
+
+    # The voltage area (x_min, x_max, y_min, y_max) plotted by raw_to_images and interpolated alone by spatial_index.py.
+    # If empty, the whole diagrams are used.
+    focus_area: tuple = ()
+
+    # The research groups converted by data_cleanup/convert.py (see SOURCE_SPECS). If empty, every group is converted.
+    research_groups: tuple = ()
+
     # The relative path to the data directory, from the working directory
     data_dir: str = 'data'
 
@@ -49,16 +108,40 @@ class Settings:
     # If True, plot the diagrams as images at different steps of the processing.
     plot_results: bool = True
 
+    # The number of processes used to interpolate the diagrams in parallel.
+    # If 1, the diagrams are processed one by one in the main process.
+    # The plots are disabled when more than 1 worker is used.
+    workers: int = 1
+
+    # If True, measure the time, the memory and the counts of each processing stage of each diagram, then save them
+    # in out_dir/instrumentation (JSON and CSV) and print a summary by stage.
+    instrumentation: bool = False
+
     def __init__(self):
         """
-        Create the setting object.
+        Create the setting object. The settings are loaded at the first access.
         """
-        self._load_file_and_cmd()
+        # Directly set the value to bypass the "__setattr__" function
+        self.__dict__['_loaded'] = False
+
+    def __getattribute__(self, name):
+        """
+        Get an attribute, and load the settings from file and command line if it is the first access to a setting.
+
+        :param name: The name of the attribut
+        :return: The value of the attribut
+        """
+        if name in Settings.__dataclass_fields__ and not object.__getattribute__(self, '_loaded'):
+            # Set the flag first because the loading reads the default values
+            self.__dict__['_loaded'] = True
+            self._load_file_and_cmd()
+        return object.__getattribute__(self, name)
 
     def _load_file_and_cmd(self) -> None:
         """
         Load settings from local file and arguments of the command line.
         """
+        import configargparse
 
         def str_to_bool(arg_value: str) -> bool:
             """
@@ -76,6 +159,9 @@ class Settings:
                 return True
             raise argparse.ArgumentTypeError(f'{arg_value} is not a valid boolean value')
 
+        def is_sequence(arg_value) -> bool:
+            return isinstance(arg_value, (list, tuple))
+
         def type_mapping(arg_value):
             if type(arg_value) == bool:
                 return str_to_bool
@@ -0,0 +1,291 @@
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from file_utils import file_hash
+from gridded_diagram import GriddedDiagram
+from loaders import load_raw, raw_statistics
+
+if TYPE_CHECKING:
+    import pandas
+
+# Change this version to build again every existing index if the structure changes
+INDEX_VERSION = 2
+# The average number of points by tile. Small tiles limit the points read around a small window.
+TILE_POINTS = 1024
+
+
+def diagram_columns(diagram: Union['pandas.DataFrame', GriddedDiagram]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+    :return: The columns x, y, z of the raw points.
+    """
+    if isinstance(diagram, GriddedDiagram):
+        return diagram.to_columns()
+    return diagram.x.to_numpy(), diagram.y.to_numpy(), diagram.z.to_numpy()
+
+
+def point_spacing(bounds: Tuple[float, float, float, float], points: int) -> float:
+    """
+    :param bounds: The limits of a diagram, as (x_min, x_max, y_min, y_max) in volt.
+    :param points: The number of points of the diagram.
+    :return: The average distance between 2 neighbour points, if they are uniformly distributed (in volt).
+    """
+    x_min, x_max, y_min, y_max = bounds
+    return float(np.sqrt((x_max - x_min) * (y_max - y_min) / max(points, 1)))
+
+
+def window_diagram(diagram: Union['pandas.DataFrame', GriddedDiagram, 'RawPointsIndex'],
+                   window: Tuple[float, float, float, float]) -> Union['pandas.DataFrame', GriddedDiagram]:
+    """
+    Select the points of a diagram inside a voltage window (limits included).
+
+    :param diagram: The diagram as a pandas dataframe (with columns x, y, z), as a GriddedDiagram or as a
+     RawPointsIndex (only the tiles around the window are read).
+    :param window: The area to select, as (x_min, x_max, y_min, y_max) in volt.
+    :return: The points inside the window as a pandas dataframe, or as a GriddedDiagram for a gridded diagram.
+    """
+    x_min, x_max, y_min, y_max = window
+    if isinstance(diagram, GriddedDiagram):
+        # Slices of the axes, no scan of the values
+        columns = slice(np.searchsorted(diagram.x, x_min, side='left'),
+                        np.searchsorted(diagram.x, x_max, side='right'))
+        rows = slice(np.searchsorted(diagram.y, y_min, side='left'), np.searchsorted(diagram.y, y_max, side='right'))
+        return diagram._replace(x=diagram.x[columns], y=diagram.y[rows], values=diagram.values[rows, columns])
+
+    # Import here to keep this module light, pandas is only required for the raw files
+    import pandas
+
+    if isinstance(diagram, RawPointsIndex):
+        points = diagram.window_points(window)
+        return pandas.DataFrame({'x': points[:, 0], 'y': points[:, 1], 'z': points[:, 2]})
+
+    inside = diagram.x.between(x_min, x_max) & diagram.y.between(y_min, y_max)
+    return diagram[inside]
+
+
+class RawPointsIndex(NamedTuple):
+    """
+    Spatial index of the points of a raw diagram, to read the points of a voltage window without scanning the diagram.
+    The diagram area is cut in tiles of about TILE_POINTS points, and the points are sorted by tile column (x) then by
+    tile row (y). So the points of a window are a few contiguous slices of the array, one by tile column.
+    Once saved, the points are memory-mapped, so only the tiles around the window are read from the file.
+    """
+    # The points sorted by tile, as an array (N, 3) with the columns x, y, z
+    points: np.ndarray
+    # The limits of the whole diagram, as (x_min, x_max, y_min, y_max) in volt
+    bounds: Tuple[float, float, float, float]
+    # The number of tiles along x (columns) and along y (rows)
+    tiles: Tuple[int, int]
+    # The position of the first point of each tile in the points, with the tiles sorted by column then by row, and the
+    # number of points at the end (columns * rows + 1,)
+    offsets: np.ndarray
+    # The statistics of the raw points (see load_raw_csv), for the filter of the extreme values
+    statistics: dict = {}
+
+    @classmethod
+    def build(cls, diagram: Union['pandas.DataFrame', GriddedDiagram],
+              statistics: Optional[dict] = None) -> 'RawPointsIndex':
+        """
+        Sort the points of a diagram by tile.
+
+        :param diagram: The diagram as a pandas dataframe (with columns x, y, z) or as a GriddedDiagram.
+        :param statistics: The statistics of the raw points, if they are already known (see load_raw_csv).
+        :return: The index, with the points in memory.
+        """
+        x, y, z = diagram_columns(diagram)
+        if len(x) == 0:
+            raise ValueError('Can not index a diagram without point.')
+
+        bounds = (float(np.min(x)), float(np.max(x)), float(np.min(y)), float(np.max(y)))
+        width, height = bounds[1] - bounds[0], bounds[3] - bounds[2]
+
+        # Square tiles (in volt) with TILE_POINTS points if the points are uniformly distributed
+        tile_side = np.sqrt(width * height * TILE_POINTS / len(x))
+        tiles = (max(1, int(np.ceil(width / tile_side))) if tile_side > 0 else 1,
+                 max(1, int(np.ceil(height / tile_side))) if tile_side > 0 else 1)
+
+        tile_x = cls._tile_position(x, bounds[0], width, tiles[0])
+        tile_y = cls._tile_position(y, bounds[2], height, tiles[1])
+        tile_id = tile_x * tiles[1] + tile_y
+
+        order = np.argsort(tile_id, kind='stable')
+        points = np.empty((len(x), 3), dtype=np.result_type(x, y, z))
+        for column, values in enumerate((x, y, z)):
+            points[:, column] = values[order]
+        offsets = np.zeros(tiles[0] * tiles[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tile_id, minlength=tiles[0] * tiles[1]), out=offsets[1:])
+
+        return cls(points, bounds, tiles, offsets, statistics or raw_statistics(diagram))
+
+    @staticmethod
+    def _tile_position(values: np.ndarray, start: float, length: float, count: int) -> np.ndarray:
+        """
+        :return: The tile position of each value along one axis, between 0 and count - 1.
+        """
+        if length <= 0:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.clip(np.floor((values - start) / length * count).astype(np.int64), 0, count - 1)
+
+    @property
+    def spacing(self) -> float:
+        """
+        :return: The average distance between 2 neighbour points, if they are uniformly distributed (in volt).
+        """
+        return point_spacing(self.bounds, len(self.points))
+
+    def pixel_axes(self, step: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the pixel coordinates of the whole diagram, the same as raw_to_images.pixel_axes, without the points.
+
+        :param step: The output grid resolution.
+        :return: The x and y coordinates of the output pixels, as 1D arrays.
+        """
+        # Same type as the min and max of the raw points, to compute exactly the same coordinates
+        x_min, x_max, y_min, y_max = (self.points.dtype.type(bound) for bound in self.bounds)
+        return np.arange(x_min + step, x_max, step), np.arange(y_min + step, y_max, step)
+
+    def window_points(self, window: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Read the points inside a voltage window. Only the tiles that overlap the window are read.
+
+        :param window: The area to read, as (x_min, x_max, y_min, y_max) in volt.
+        :return: The points inside the window (limits included) as an array (M, 3), with the columns x, y, z.
+        """
+        x_min, x_max, y_min, y_max = window
+        columns, rows = self.tiles
+        first_col, last_col = self._tile_position(np.array([x_min, x_max]), self.bounds[0],
+                                                  self.bounds[1] - self.bounds[0], columns)
+        first_row, last_row = self._tile_position(np.array([y_min, y_max]), self.bounds[2],
+                                                  self.bounds[3] - self.bounds[2], rows)
+
+        # The tiles of one column are contiguous, so one slice by column
+        candidates = np.concatenate([self.points[self.offsets[col * rows + first_row]:
+                                                 self.offsets[col * rows + last_row + 1]]
+                                     for col in range(first_col, last_col + 1)])
+        inside = (candidates[:, 0] >= x_min) & (candidates[:, 0] <= x_max) & \
+                 (candidates[:, 1] >= y_min) & (candidates[:, 1] <= y_max)
+        return candidates[inside]
+
+    def save(self, file_path: Path, raw_sha256: str, dtype: str = 'float64') -> None:
+        """
+        Save the index as a NPZ file (tiles and statistics) and a NPY file next to it (points), so the points can be
+        memory-mapped.
+
+        :param file_path: The path where to save the index (NPZ file).
+        :param raw_sha256: The content hash of the raw file the index is built from (see BuildManifest.raw_hash).
+        :param dtype: The type of the raw values loaded to build the index ('float32' or 'float64'). The points can have
+         another type, e.g. the axes of a GriddedDiagram are always float64.
+        """
+        # Create directories if necessary
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        np.save(file_path.with_suffix('.npy'), self.points)
+        # The NPZ file is written last, so an index interrupted after the points is not valid
+        np.savez(file_path, version=INDEX_VERSION, bounds=np.array(self.bounds), tiles=np.array(self.tiles),
+                 offsets=self.offsets, statistics=np.array(json.dumps(self.statistics)),
+                 dtype=np.array(np.dtype(dtype).name), raw_sha256=np.array(raw_sha256))
+
+    @classmethod
+    def load(cls, file_path: Union[str, Path]) -> 'RawPointsIndex':
+        """
+        Load an index saved with save, with the points memory-mapped (read-only).
+
+        :param file_path: The path to the index (NPZ file).
+        :return: The index.
+        """
+        file_path = Path(file_path)
+        with np.load(file_path) as index:
+            if int(index['version']) != INDEX_VERSION:
+                raise ValueError(f'The raw index "{file_path}" has an old version, it has to be built again.')
+            return cls(np.load(file_path.with_suffix('.npy'), mmap_mode='r'), tuple(index['bounds'].tolist()),
+                       tuple(index['tiles'].tolist()), index['offsets'], json.loads(str(index['statistics'])))
+
+    @staticmethod
+    def is_valid(file_path: Path, raw_sha256: str, dtype: str = 'float64') -> bool:
+        """
+        :param file_path: The path to the index (NPZ file).
+        :param raw_sha256: The content hash of the current raw file of the diagram (see BuildManifest.raw_hash).
+        :param dtype: The type of the raw values once loaded ('float32' or 'float64').
+        :return: True if the index exists, has the current version, and was built from the same raw file content with
+         the same type of values.
+        """
+        if not file_path.is_file() or not file_path.with_suffix('.npy').is_file():
+            return False
+
+        with np.load(file_path) as index:
+            return int(index['version']) == INDEX_VERSION and str(index['dtype']) == np.dtype(dtype).name \
+                and str(index['raw_sha256']) == raw_sha256
+
+
+def raw_index_file(diagram_file: Path, raw_clean_dir: Path, index_dir: Path) -> Path:
+    """
+    :param diagram_file: The path to the raw file of the diagram (CSV or NPZ).
+    :param raw_clean_dir: The root directory of raw files, used to keep the file structure.
+    :param index_dir: The root directory of the indexes.
+    :return: The path to the index of the diagram (NPZ file, with the points in the NPY file next to it).
+    """
+    return index_dir / diagram_file.parent.relative_to(raw_clean_dir) / f'{diagram_file.stem}.npz'
+
+
+def load_raw_index(diagram_file: Path, raw_clean_dir: Path, index_dir: Path, chunk_size: int = 1_000_000,
+                   dtype: str = 'float64', raw_sha256: Optional[str] = None) -> RawPointsIndex:
+    """
+    Load the index of a raw diagram, or build and save it if it is missing or outdated (other raw file content or other
+    type of values).
+
+    :param diagram_file: The path to the raw file of the diagram (CSV or NPZ).
+    :param raw_clean_dir: The root directory of raw files, used to keep the file structure.
+    :param index_dir: The root directory of the indexes.
+    :param chunk_size: The number of rows parsed at once when loading a raw CSV file.
+    :param dtype: The type of the raw values once loaded ('float32' or 'float64').
+    :param raw_sha256: The content hash of the raw file (see BuildManifest.raw_hash), computed if None.
+    :return: The index, with the points memory-mapped.
+    """
+    raw_sha256 = raw_sha256 or file_hash(diagram_file)
+    index_file = raw_index_file(diagram_file, raw_clean_dir, index_dir)
+    if not RawPointsIndex.is_valid(index_file, raw_sha256, dtype):
+        diagram, statistics = load_raw(diagram_file, chunk_size, dtype)
+        RawPointsIndex.build(diagram, statistics).save(index_file, raw_sha256, dtype)
+    return RawPointsIndex.load(index_file)
+
+
+if __name__ == '__main__':
+    import time
+
+    from build_manifest import BuildManifest
+    from raw_to_images import image_interpolation, list_raw_files
+    from settings import settings
+    # Use the index class of the module (not of __main__), the one expected by image_interpolation
+    from spatial_index import load_raw_index
+
+    raw_clean_dir = Path(settings.out_dir, 'raw_clean')
+    index_dir = Path(settings.out_dir, 'raw_index')
+    focus_area = tuple(map(float, settings.focus_area)) or None
+    # The raw file hashes cached by raw_to_images, to not read the unchanged raw files again
+    manifest = BuildManifest(Path(settings.out_dir, 'build_manifest.json'), settings.out_dir)
+
+    for diagram_file in list_raw_files(raw_clean_dir):
+        raw_index = load_raw_index(diagram_file, raw_clean_dir, index_dir, settings.raw_chunk_size, settings.raw_dtype,
+                                   manifest.raw_hash(diagram_file))
+        print(f'{diagram_file.relative_to(raw_clean_dir)} indexed ({len(raw_index.points):,} points, '
+              f'{raw_index.tiles[0]}x{raw_index.tiles[1]} tiles)')
+
+        if focus_area is not None:
+            # Interpolate only the focus area, from the points around it
+            start = time.perf_counter()
+            x_i, y_i, pixels = image_interpolation(raw_index, settings.pixel_size, settings.interpolation_method,
+                                                   settings.filter_extreme, window=focus_area)
+            print(f'\tfocus area interpolated in {(time.perf_counter() - start) * 1000:.1f} ms ({pixels.shape[0]}x'
+                  f'{pixels.shape[1]} pixels)')
+
+            if settings.plot_results and pixels.size > 0:
+                # Import here to load matplotlib only if necessary
+                from plots import plot_image
+                plot_image(x_i, y_i, pixels, diagram_file.stem, settings.interpolation_method, settings.pixel_size,
+                           focus_area=focus_area)
+
+    manifest.save()
+    print(f'Raw indexes saved in {index_dir}')
@@ -0,0 +1,118 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from upload_queue import UploadQueue
+
+
+class LocalTask:
+    """
+    Stand-in of a Labelbox task, the rows are added to the dataset when the task is done.
+    """
+
+    def __init__(self, dataset: 'LocalDataset', rows: list, wait_failures: int, accepted: int):
+        self.dataset = dataset
+        self.rows = rows
+        self.wait_failures = wait_failures
+        # The number of rows created if the wait never succeeds
+        self.accepted = accepted
+        self.errors = None
+
+    def wait_till_done(self) -> None:
+        if self.wait_failures > 0:
+            self.wait_failures -= 1
+            self.dataset.add(self.rows[:self.accepted])
+            raise TimeoutError('Task status unknown')
+        self.dataset.add(self.rows)
+
+
+class LocalDataset:
+    """
+    Stand-in of a Labelbox dataset, without network.
+    """
+
+    def __init__(self, create_failures: int = 0, accept_failed: bool = False, wait_failures: int = 0,
+                 accepted: int = 0):
+        self.external_ids = []
+        self.created_rows = []
+        self.create_failures = create_failures
+        # If True, the failed creation requests are accepted by the server (e.g. timeout of the response)
+        self.accept_failed = accept_failed
+        self.wait_failures = wait_failures
+        self.accepted = accepted
+
+    def add(self, rows: list) -> None:
+        self.external_ids.extend(row['external_id'] for row in rows if row['external_id'] not in self.external_ids)
+
+    def data_rows(self) -> list:
+        return [SimpleNamespace(external_id=external_id) for external_id in self.external_ids]
+
+    def create_data_rows(self, rows: list) -> LocalTask:
+        self.created_rows.extend(row['external_id'] for row in rows)
+        if self.create_failures > 0:
+            self.create_failures -= 1
+            if self.accept_failed:
+                self.add(rows)
+            raise ConnectionError('Request failed')
+        return LocalTask(self, rows, self.wait_failures, self.accepted)
+
+
+class LocalClient:
+    def __init__(self):
+        self.uploaded_files = []
+
+    def upload_file(self, path: str) -> str:
+        self.uploaded_files.append(path)
+        return f'https://files/{Path(path).name}'
+
+
+def upload(dataset: LocalDataset, names: list, tmp_path: Path) -> tuple:
+    """
+    Upload some images with their attachments, and return the result and the client.
+    """
+    for name in names:
+        for suffix in ('', '_DzDy', '_DzDx'):
+            (tmp_path / f'{name}{suffix}.png').write_bytes(b'')
+
+    client = LocalClient()
+    queue = UploadQueue(dataset, client, batch_size=10, sleep=lambda delay: None)
+    for name in names:
+        queue.put(tmp_path, name)
+    return queue.join(), client
+
+
+def test_retry_after_accepted_request(tmp_path):
+    # The first request times out after the server created the rows
+    dataset = LocalDataset(create_failures=1, accept_failed=True)
+    result, client = upload(dataset, ['a', 'b'], tmp_path)
+
+    assert result == {'uploaded': 2, 'failed': []}
+    assert dataset.created_rows == ['a.png', 'b.png']
+    assert sorted(dataset.external_ids) == ['a.png', 'b.png']
+    # The attachments are uploaded once, not for every attempt
+    assert len(client.uploaded_files) == 4
+
+
+def test_retry_after_failed_request(tmp_path):
+    dataset = LocalDataset(create_failures=2)
+    result, client = upload(dataset, ['a', 'b'], tmp_path)
+
+    assert result == {'uploaded': 2, 'failed': []}
+    assert dataset.created_rows == ['a.png', 'b.png'] * 3
+    assert len(client.uploaded_files) == 4
+
+
+def test_every_request_failed(tmp_path):
+    dataset = LocalDataset(create_failures=3)
+    result, _ = upload(dataset, ['a', 'b'], tmp_path)
+
+    assert result == {'uploaded': 0, 'failed': ['a.png', 'b.png']}
+
+
+def test_partial_failure_after_wait(tmp_path):
+    # The task status is never known, and only the first row reached the dataset
+    dataset = LocalDataset(wait_failures=3, accepted=1)
+    result, _ = upload(dataset, ['a', 'b'], tmp_path)
+
+    assert result == {'uploaded': 1, 'failed': ['b.png']}
+    # The rows are not sent again
+    assert dataset.created_rows == ['a.png', 'b.png']
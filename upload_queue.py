@@ -0,0 +1,216 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Set
+
+
+class UploadQueue:
+    """
+    Queue of images to upload into a Labelbox dataset, decoupled from the processing that creates them.
+    The external IDs already in the dataset are fetched once, then the new images are uploaded in batches of data rows
+    (one bulk request by batch), with a bounded number of concurrent requests and a retry on failed requests (an image
+    is never sent twice).
+
+    The dataset and the client are only used through a few methods, so any object with the same methods can be used
+    (e.g. a local stand-in without network):
+        - dataset.data_rows(): iterable of objects with an "external_id" attribute
+        - dataset.create_data_rows(rows): task with a "wait_till_done()" method and an "errors" attribute
+        - client.upload_file(path): URL of the uploaded file
+    """
+
+    def __init__(self, dataset, client, batch_size: int = 100, threads: int = 4, retries: int = 3,
+                 retry_delay: float = 2.0, sleep: Callable[[float], None] = time.sleep):
+        """
+        :param dataset: The Labelbox dataset where to upload the images.
+        :param client: The Labelbox client, used to upload the attachment files.
+        :param batch_size: The maximal number of images sent in one bulk request.
+        :param threads: The maximal number of concurrent requests.
+        :param retries: The number of attempts for each request, before counting the images of the batch as failed.
+        :param retry_delay: The delay before the first retry, in seconds. It is doubled after each failed attempt.
+        :param sleep: The function used to wait before a retry (replaced in tests to avoid waiting).
+        """
+        self._dataset = dataset
+        self._client = client
+        self._batch_size = batch_size
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._sleep = sleep
+
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._existing_ids: Optional[Set[str]] = None
+        self._pending: List[dict] = []
+        self._batches: List[Future] = []
+
+    def __enter__(self) -> 'UploadQueue':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.join()
+
+    @property
+    def existing_ids(self) -> Set[str]:
+        """
+        :return: The external IDs of the dataset, fetched once at the first access, and the IDs queued since then.
+        """
+        if self._existing_ids is None:
+            self._existing_ids = self._dataset_ids()
+        return self._existing_ids
+
+    def put(self, file_dir: Path, file_basename: str) -> bool:
+        """
+        Queue an image with its 2 derived images as attachments, if it is not already in the dataset.
+        A batch is sent as soon as it is full.
+
+        :param file_dir: The directory where the images are stored.
+        :param file_basename: The base name of the image to upload.
+        :return: True if the image is queued, False if it is already in the dataset.
+        """
+        external_id = f'{file_basename}.png'
+        if external_id in self.existing_ids:
+            print(f'Image "{file_basename}" already exists in the dataset')
+            return False
+
+        attachments = [file_dir / f'{file_basename}_{ax}.png' for ax in ('DzDy', 'DzDx')]
+        attachments = [file for file in attachments if file.exists()]
+        if len(attachments) == 0:
+            print(f'No attachments found for image "{file_basename}".')
+
+        self.existing_ids.add(external_id)
+        self._pending.append({'external_id': external_id, 'row_data': file_dir / f'{file_basename}.png',
+                              'attachments': attachments})
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """
+        Send the queued images as a batch, without waiting for the upload.
+        """
+        if self._pending:
+            self._batches.append(self._executor.submit(self._upload_batch, self._pending))
+            self._pending = []
+
+    def join(self) -> dict:
+        """
+        Send the last batch and wait for every upload to finish.
+
+        :return: The number of images 'uploaded' and the external IDs of the images 'failed'.
+        """
+        self.flush()
+        uploaded, failed = 0, []
+        for batch in self._batches:
+            batch_uploaded, batch_failed = batch.result()
+            uploaded += batch_uploaded
+            failed.extend(batch_failed)
+        self._batches = []
+        self._executor.shutdown()
+
+        print(f'{uploaded} image(s) uploaded into Labelbox' + (f', {len(failed)} failed' if failed else ''))
+        return {'uploaded': uploaded, 'failed': failed}
+
+    def _retry(self, action: Callable[[], Any], description: str) -> Any:
+        """
+        Call a request until it succeeds, with a delay doubled after each failed attempt.
+
+        :param action: The request to call.
+        :param description: The description of the request, for the error messages.
+        :return: The result of the request.
+        :raise Exception: The error of the last attempt, if every attempt failed.
+        """
+        delay = self._retry_delay
+        for attempt in range(1, self._retries + 1):
+            try:
+                return action()
+            except Exception as error:
+                print(f'{description} failed (attempt {attempt}/{self._retries}): {error}')
+                if attempt == self._retries:
+                    raise
+                self._sleep(delay)
+                delay *= 2
+
+    def _build_row(self, image: dict) -> dict:
+        """
+        :param image: The queued image, with the attachment files.
+        :return: The data row as expected by create_data_rows, with the attachment files uploaded.
+        """
+        return {
+            'external_id': image['external_id'],
+            'row_data': str(image['row_data']),  # Local files are uploaded by create_data_rows
+            'attachments': [{'type': 'IMAGE_OVERLAY',
+                             'value': self._retry(partial(self._client.upload_file, str(file)),
+                                                  f'Upload of "{file.name}"'),
+                             'name': file.stem.rsplit('_', 1)[-1]} for file in image['attachments']],
+        }
+
+    def _dataset_ids(self) -> Set[str]:
+        """
+        :return: The external IDs currently in the dataset (a new request, not the cached existing_ids).
+        """
+        return {data_row.external_id for data_row in self._dataset.data_rows()}
+
+    def _create_task(self, rows: List[dict]):
+        """
+        Send the data rows with one bulk request, retried if the request fails.
+        A failed request can have been accepted by the server (e.g. timeout of the response), so before each retry the
+        rows already in the dataset are removed.
+
+        :param rows: The data rows (see _build_row).
+        :return: The task of the request, or None if every row is already in the dataset.
+        :raise Exception: The error of the last attempt, if every attempt failed.
+        """
+        delay = self._retry_delay
+        for attempt in range(1, self._retries + 1):
+            if attempt > 1:
+                self._sleep(delay)
+                delay *= 2
+                dataset_ids = self._dataset_ids()
+                rows = [row for row in rows if row['external_id'] not in dataset_ids]
+                if len(rows) == 0:
+                    return None
+
+            try:
+                return self._dataset.create_data_rows(rows)
+            except Exception as error:
+                print(f'Upload of {len(rows)} image(s) failed (attempt {attempt}/{self._retries}): {error}')
+                if attempt == self._retries:
+                    raise
+
+    def _upload_batch(self, images: List[dict]) -> tuple:
+        """
+        Upload a batch of images with one bulk request.
+        The attachment files are uploaded once. The creation of the task is retried with only the images not found in
+        the dataset. Once the task is created, it is polled again if the wait fails, then the dataset is checked, so
+        the images are never sent twice.
+        A batch with images rejected by Labelbox (task errors) is not retried, since the other images of the batch are
+        created, and all its images are reported as failed.
+
+        :param images: The queued images.
+        :return: The number of images uploaded and the external IDs of the images that failed.
+        """
+        external_ids = [image['external_id'] for image in images]
+        try:
+            task = self._create_task([self._build_row(image) for image in images])
+        except Exception:
+            return 0, external_ids
+
+        if task is None:
+            # Every image was created by a request reported as failed
+            return len(images), []
+
+        try:
+            self._retry(task.wait_till_done, f'Wait for the upload of {len(images)} image(s)')
+        except Exception:
+            # Unknown task status, only the images found in the dataset are uploaded
+            try:
+                dataset_ids = self._dataset_ids()
+            except Exception as error:
+                print(f'Can not check the images of the dataset: {error}')
+                return 0, external_ids
+            failed = [external_id for external_id in external_ids if external_id not in dataset_ids]
+            return len(images) - len(failed), failed
+
+        if task.errors:
+            print(f'Labelbox rejected some images of the batch: {task.errors}')
+            return 0, external_ids
+        return len(images), []